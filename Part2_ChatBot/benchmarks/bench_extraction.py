@@ -0,0 +1,67 @@
+"""
+מדידת זמן חילוץ הקטעים מ-HTML: parser x מספר תהליכים, על מאגר סינתטי גדול.
+
+    python -m benchmarks.bench_extraction --files 200 --sections 10 --services 30
+"""
+import os
+import time
+import logging
+import argparse
+import tempfile
+from bot_app.html_reader import ImprovedVectorGenerator, Config
+from benchmarks.synthetic_kb import write_corpus
+
+
+def available_parsers():
+    parsers = ["html.parser"]
+    try:
+        import lxml  # noqa: F401
+        parsers.append("lxml")
+    except ImportError:
+        pass
+    return parsers
+
+
+def run(html_dir: str, parser: str, workers: int):
+    config = Config()
+    config.HTML_DIR = html_dir
+    config.HTML_PARSER = parser
+    config.EXTRACT_WORKERS = workers
+    config.EXTRACT_PARALLEL_MIN_FILES = 2
+
+    filenames = sorted(f for f in os.listdir(html_dir) if f.endswith(".html"))
+    started = time.perf_counter()
+    extracted = ImprovedVectorGenerator(config).extract_files(filenames)
+    return time.perf_counter() - started, sum(len(chunks) for chunks in extracted)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML chunk extraction")
+    parser.add_argument("--dir", help="existing HTML directory (default: generate a synthetic corpus)")
+    parser.add_argument("--files", type=int, default=200)
+    parser.add_argument("--sections", type=int, default=10)
+    parser.add_argument("--services", type=int, default=30)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, os.cpu_count() or 1])
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    with tempfile.TemporaryDirectory() as tmp:
+        html_dir = args.dir
+        if not html_dir:
+            html_dir = os.path.join(tmp, "kb")
+            write_corpus(html_dir, args.files, args.sections, args.services)
+
+        size_mb = sum(os.path.getsize(os.path.join(html_dir, f)) for f in os.listdir(html_dir)) / 2 ** 20
+        print(f"\n⏱️ Extraction benchmark: {len(os.listdir(html_dir))} files, {size_mb:.1f} MB")
+
+        baseline = None
+        for html_parser in available_parsers():
+            for workers in sorted(set(args.workers)):
+                elapsed, chunks = run(html_dir, html_parser, workers)
+                baseline = baseline or elapsed
+                print(f"  {html_parser:<12} workers={workers:<3} {elapsed:7.2f}s  {chunks / elapsed:9.0f} chunks/s  "
+                      f"x{baseline / elapsed:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+חבילת מדידות על מאגר ידע סינתטי בכמה גדלים, עם ספק embeddings מקומי (hashing) במקום Azure.
+
+לכל גודל: זמן חילוץ, קצב embeddings, זמן יצירת המאגר המלא, גודל המאגר על הדיסק,
+זמן טעינת האינדקס, וזמני תגובה לשאילתות (חיפוש ישיר בטבלה, מסלול לקסיקלי, חיפוש היברידי).
+
+    python -m benchmarks.bench_suite --sizes 100 10000 1000000 --json bench.json
+
+הכול רץ בתיקייה זמנית; 10^6 קטעים דורשים כמה GB פנויים בדיסק.
+"""
+import io
+import os
+import asyncio
+import json
+import time
+import random
+import logging
+import argparse
+import tempfile
+from contextlib import redirect_stdout
+from typing import List, Dict, Any
+import numpy as np
+from benchmarks.synthetic_kb import corpus_shape, write_corpus, FILLER, TOPICS
+
+EMBED_SAMPLE = 20000
+
+
+def _percentiles(samples: List[float]) -> Dict[str, float]:
+    values = np.array(samples) * 1000
+    return {"p50_ms": float(np.percentile(values, 50)), "p95_ms": float(np.percentile(values, 95))}
+
+
+def _store_size(store_dir: str) -> Dict[str, float]:
+    groups = {"embeddings": ("embeddings.npy",), "chunks": ("chunks.json",), "lexical": ("bm25_",),
+              "ann": ("ivf_",), "benefits": ("benefits",)}
+    sizes = {name: 0 for name in groups}
+    sizes["total"] = 0
+    for filename in os.listdir(store_dir):
+        size = os.path.getsize(os.path.join(store_dir, filename))
+        sizes["total"] += size
+        for name, prefixes in groups.items():
+            if filename.startswith(prefixes):
+                sizes[name] += size
+    return {name: size / 2 ** 20 for name, size in sizes.items()}
+
+
+def _time_queries(fn, queries: List[str]) -> Dict[str, float]:
+    samples = []
+    for query in queries:
+        started = time.perf_counter()
+        fn(query)
+        samples.append(time.perf_counter() - started)
+    return _percentiles(samples)
+
+
+def run_size(target: int, workdir: str, queries: int, seed: int) -> Dict[str, Any]:
+    from bot_app import embeddings
+    from bot_app.html_reader import ImprovedVectorGenerator, Config
+    from bot_app.vector_store import read_manifest
+
+    html_dir = os.path.join(workdir, "kb")
+    files, sections, services = corpus_shape(target)
+    write_corpus(html_dir, files, sections, services, seed)
+    html_mb = sum(os.path.getsize(os.path.join(html_dir, f)) for f in os.listdir(html_dir)) / 2 ** 20
+
+    config = Config()
+    config.HTML_DIR = html_dir
+    config.OUT_ROOT = os.path.join(workdir, "saved_vectors")
+    generator = ImprovedVectorGenerator(config, provider=embeddings.embedding_provider)
+    result = {"target": target, "files": files, "html_mb": html_mb}
+
+    filenames = sorted(f for f in os.listdir(html_dir) if f.endswith(".html"))
+    started = time.perf_counter()
+    chunks = [chunk for extracted in generator.extract_files(filenames) for chunk in extracted]
+    result["parse_s"] = time.perf_counter() - started
+    result["chunks"] = len(chunks)
+
+    sample = chunks[:EMBED_SAMPLE]
+    started = time.perf_counter()
+    generator.process_embeddings_in_batches(sample)
+    result["embed_per_s"] = len(sample) / (time.perf_counter() - started)
+    del chunks, sample
+
+    started = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        generator.generate_vectors()
+    result["ingest_s"] = time.perf_counter() - started
+
+    manifest = read_manifest(config.OUT_ROOT)
+    result["store_mb"] = _store_size(os.path.join(config.OUT_ROOT, manifest["path"]))
+
+    embeddings.VECTOR_STORE_ROOT = config.OUT_ROOT
+    embeddings.reset_vector_index()
+    started = time.perf_counter()
+    index = embeddings.get_vector_index()
+    result["load_s"] = time.perf_counter() - started
+    result["ann"] = index.ann is not None
+
+    rng = random.Random(seed)
+    service_names = index.benefits.services if index.benefits else []
+    hmo, tier = "מכבי", "זהב"
+    service_questions = [f"מה מגיע לי על {rng.choice(service_names)}?" for _ in range(queries)] if service_names else []
+    # שאלות כלליות ייחודיות, כדי שמטמון ה-embeddings לא יסתיר את עלות החיפוש
+    open_questions = [f"{rng.choice(FILLER)} {rng.choice(TOPICS)} {target}-{n}" for n in range(queries)]
+
+    # החיפוש אסינכרוני (כמו בשרת); event loop אחד לכל השאילתות
+    loop = asyncio.new_event_loop()
+    search = lambda q: loop.run_until_complete(embeddings.find_similar_chunks(q, top_k=5, hmo=hmo, tier=tier))
+    latency = {}
+    try:
+        if service_questions:
+            latency["lookup"] = _time_queries(lambda q: embeddings.lookup_benefit(q, hmo=hmo, tier=tier), service_questions)
+            latency["lexical_fast_path"] = _time_queries(search, service_questions)
+        latency["hybrid"] = _time_queries(search, open_questions)
+    finally:
+        loop.close()
+    result["latency"] = latency
+    return result
+
+
+def print_report(results: List[Dict[str, Any]]) -> None:
+    for r in results:
+        sizes = r["store_mb"]
+        print(f"\n  {r['chunks']:,} chunks ({r['files']} files, {r['html_mb']:.1f} MB HTML)")
+        print(f"    parse      {r['parse_s']:8.2f}s  {r['chunks'] / r['parse_s']:10,.0f} chunks/s")
+        print(f"    embed      {r['embed_per_s']:10,.0f} chunks/s")
+        print(f"    ingest     {r['ingest_s']:8.2f}s  (extract + embed + compact + publish)")
+        print(f"    store      {sizes['total']:8.1f} MB  (embeddings {sizes['embeddings']:.1f}, chunks {sizes['chunks']:.1f}, "
+              f"bm25 {sizes['lexical']:.1f}, ivf {sizes['ann']:.1f}, benefits {sizes['benefits']:.1f})")
+        print(f"    load       {r['load_s']:8.2f}s  ({'ivf' if r['ann'] else 'exact'} search)")
+        for path, stats in r["latency"].items():
+            print(f"    {path:<18} p50 {stats['p50_ms']:7.2f} ms   p95 {stats['p95_ms']:7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingestion and query benchmark on synthetic knowledge bases")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 10000, 1000000], help="approximate chunk counts")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=512, help="hashing embedding dimension")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    # ספק מקומי: המדידה לא פונה ל-Azure. חייב לקרות לפני הייבוא של bot_app.embeddings
+    os.environ["EMBEDDING_PROVIDER"] = "hashing"
+    os.environ["HASHING_EMBEDDING_DIM"] = str(args.dim)
+    logging.disable(logging.WARNING)
+
+    output = os.path.abspath(args.json) if args.json else None
+    print(f"\n📊 Benchmark (hashing provider, dim {args.dim})")
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as tmp:
+        # נתיבים יחסיים (saved_vectors/, מטמון ה-embeddings) נוצרים בתיקייה הזמנית
+        os.chdir(tmp)
+        try:
+            for size in args.sizes:
+                workdir = os.path.join(tmp, str(size))
+                os.makedirs(workdir)
+                results.append(run_size(size, workdir, args.queries, args.seed))
+                print_report(results[-1:])
+        finally:
+            os.chdir(cwd)
+
+    if output:
+        with open(output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""
+מחולל מאגר ידע סינתטי בצורת קבצי phase2_data: כותרות h2/h3, פסקאות, רשימת שירותים,
+טבלת שירות x קופה עם תאי <strong>זהב:</strong> / כסף / ארד, ורשימות פרטי קשר.
+
+    python -m benchmarks.synthetic_kb --out /tmp/synthetic_kb --files 20 --sections 10 --services 30
+    python -m benchmarks.synthetic_kb --out /tmp/synthetic_kb --chunks 10000
+"""
+import os
+import math
+import random
+import argparse
+from typing import List, Tuple
+
+HMOS = ["מכבי", "מאוחדת", "כללית"]
+TIERS = ["זהב", "כסף", "ארד"]
+TOPICS = ["מרפאות שיניים", "אופטומטריה", "רפואה משלימה", "מרפאות תקשורת", "הריון", "סדנאות בריאות",
+          "פיזיותרפיה", "בריאות הנפש", "דיאטנים", "רפואת ספורט", "אורתופדיה", "עור ואלרגיה"]
+SERVICE_WORDS = ["טיפול", "בדיקת", "ייעוץ", "אבחון", "שיקום", "מעקב", "סדנת", "הדרכה", "קורס", "סקירת"]
+SERVICE_OBJECTS = ["שיניים", "ראייה", "שמיעה", "תזונה", "גב", "כתפיים", "עור", "דיבור", "בליעה", "נשימה",
+                   "שינה", "מתח", "הריון", "ילדים", "מבוגרים", "ספורטאים", "קול", "יציבה", "ברכיים", "כאב"]
+BENEFITS = ["{p}% הנחה", "חינם עד {n} פעמים בשנה", "{p}% הנחה, עד {n} טיפולים בשנה",
+            "{p}% הנחה, תור תוך {n} ימים", "השתתפות עצמית של {c} ₪ לטיפול", "ללא הנחה"]
+# כל קטע (section) מייצר 2 פסקאות, 3 פרטי קשר, ולכל שירות פריט רשימה ו-9 תאי טבלה
+CHUNKS_PER_SECTION_BASE = 5
+CHUNKS_PER_SERVICE = 10
+MAX_SECTIONS_PER_FILE = 10
+MAX_SERVICES_PER_SECTION = 30
+
+FILLER = ["השירות ניתן במרפאות הקופה ובמכונים בהסדר", "נדרשת הפניה מרופא משפחה",
+          "הזכאות מותנית בוותק של שלושה חודשים לפחות", "ניתן לקבוע תור באתר או במוקד הטלפוני",
+          "השירות מיועד לכל בני המשפחה המבוטחים", "הטיפולים מבוצעים על ידי אנשי מקצוע מורשים"]
+
+
+def _benefit(rng: random.Random) -> str:
+    return rng.choice(BENEFITS).format(p=rng.choice(range(5, 95, 5)), n=rng.randint(1, 12), c=rng.randint(20, 300))
+
+
+def _service_names(rng: random.Random, count: int) -> List[str]:
+    names = set()
+    while len(names) < count:
+        names.add(f"{rng.choice(SERVICE_WORDS)} {rng.choice(SERVICE_OBJECTS)} {rng.randint(1, 999)}")
+    return sorted(names)
+
+
+def generate_section(rng: random.Random, topic: str, services: int) -> str:
+    names = _service_names(rng, services)
+    parts = [f"<h2>{topic}</h2>", ""]
+    for _ in range(2):
+        sentences = rng.sample(FILLER, 3)
+        parts.append(f"<p>{topic}: {'. '.join(sentences)}.</p>")
+    parts.append("")
+
+    parts.append("<ul>")
+    for name in names:
+        parts.append(f"  <li>{name}: {rng.choice(FILLER)}</li>")
+    parts.append("</ul>")
+    parts.append("")
+
+    parts.append('<table border="1">')
+    parts.append("  <tr>")
+    parts.append("    <th>שם השירות</th>")
+    for hmo in HMOS:
+        parts.append(f"    <th>{hmo}</th>")
+    parts.append("  </tr>")
+    for name in names:
+        parts.append("  <tr>")
+        parts.append(f"    <td>{name}</td>")
+        for _ in HMOS:
+            lines = [f"      <strong>{tier}:</strong> {_benefit(rng)}, {rng.choice(FILLER)}" for tier in TIERS]
+            parts.append("    <td>")
+            parts.append("<br>\n".join(lines))
+            parts.append("    </td>")
+        parts.append("  </tr>")
+    parts.append("</table>")
+    parts.append("")
+
+    parts.append(f"<h3>מספרי טלפון לשירות לקוחות בנושא {topic}:</h3>")
+    parts.append("")
+    parts.append("<ul>")
+    for hmo in HMOS:
+        parts.append(f"  <li>{hmo}: *{rng.randint(1000, 9999)} או 1-700-{rng.randint(10, 99)}-{rng.randint(10, 99)}-{rng.randint(10, 99)}</li>")
+    parts.append("</ul>")
+    parts.append("")
+    return "\n".join(parts)
+
+
+def generate_page(rng: random.Random, sections: int, services: int) -> str:
+    return "\n".join(generate_section(rng, rng.choice(TOPICS), services) for _ in range(sections))
+
+
+def section_chunks(services: int) -> int:
+    return CHUNKS_PER_SECTION_BASE + CHUNKS_PER_SERVICE * services
+
+
+def corpus_shape(chunks: int) -> Tuple[int, int, int]:
+    """(קבצים, קטעים לקובץ, שירותים לקטע) למאגר של כ-chunks קטעים"""
+    services = max(1, min(MAX_SERVICES_PER_SECTION, (chunks - CHUNKS_PER_SECTION_BASE) // CHUNKS_PER_SERVICE))
+    total_sections = max(1, round(chunks / section_chunks(services)))
+    files = math.ceil(total_sections / MAX_SECTIONS_PER_FILE)
+    return files, max(1, round(total_sections / files)), services
+
+
+def write_corpus(out_dir: str, files: int, sections: int, services: int, seed: int = 0) -> List[str]:
+    """כותב files קבצי HTML ומחזיר את הנתיבים שלהם"""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    paths = []
+    for n in range(files):
+        path = os.path.join(out_dir, f"synthetic_{n:05d}.html")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(generate_page(rng, sections, services))
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic phase2_data-style knowledge base")
+    parser.add_argument("--out", required=True)
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--sections", type=int, default=10, help="h2 sections per file")
+    parser.add_argument("--services", type=int, default=30, help="table rows per section")
+    parser.add_argument("--chunks", type=int, help="approximate chunk count; overrides --files/--sections/--services")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.chunks:
+        args.files, args.sections, args.services = corpus_shape(args.chunks)
+    paths = write_corpus(args.out, args.files, args.sections, args.services, args.seed)
+    chunks = len(paths) * args.sections * section_chunks(args.services)
+    print(f"✅ {len(paths)} files (~{chunks} chunks) written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+"""
+אינדקס IVF-flat לחיפוש שכנים קרובים משוער (ANN), ממומש מקומית ב-NumPy.
+
+הוקטורים מחולקים ל-nlist רשימות לפי k-means (קוסינוס) על הוקטורים המנורמלים.
+בשאילתה נסרקות רק nprobe הרשימות הקרובות ביותר; nprobe גבוה יותר = recall גבוה יותר וזמן ארוך יותר.
+"""
+import os
+import math
+import logging
+from typing import Optional
+import numpy as np
+from bot_app.vector_index import normalize_rows
+
+logger = logging.getLogger(__name__)
+
+CENTROIDS_FILE = "ivf_centroids.npy"
+ORDER_FILE = "ivf_order.npy"
+OFFSETS_FILE = "ivf_offsets.npy"
+
+
+def default_nlist(count: int) -> int:
+    return max(1, min(count, int(4 * math.sqrt(count))))
+
+
+class IVFIndex:
+    """רשימות הפוכות: centroids, סדר השורות לפי רשימה, והיסט תחילת כל רשימה"""
+
+    def __init__(self, centroids: np.ndarray, order: np.ndarray, offsets: np.ndarray):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+
+    @property
+    def nlist(self) -> int:
+        return self.centroids.shape[0]
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, nlist: Optional[int] = None, iterations: int = 10,
+              sample_per_list: int = 64, seed: int = 0) -> "IVFIndex":
+        """מאמן k-means כדורי על דגימה מהמטריצה (המנורמלת) ומשייך את כל השורות לרשימות"""
+        count = matrix.shape[0]
+        nlist = min(nlist or default_nlist(count), count)
+        rng = np.random.default_rng(seed)
+
+        sample_size = min(count, nlist * sample_per_list)
+        sample_rows = np.sort(rng.choice(count, size=sample_size, replace=False))
+        sample = np.asarray(matrix[sample_rows], dtype=np.float32)
+
+        centroids = sample[rng.choice(sample_size, size=nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.bincount(assignment, minlength=nlist) == 0
+            # רשימות ריקות מקבלות נקודה אקראית מהדגימה במקום להיעלם
+            sums[empty] = sample[rng.choice(sample_size, size=int(empty.sum()))]
+            centroids = normalize_rows(sums)
+
+        assignment = cls._assign(matrix, centroids)
+        order = np.argsort(assignment, kind="stable").astype(np.int64)
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(assignment, minlength=nlist))
+
+        logger.info(f"Built IVF index: {count} vectors in {nlist} lists")
+        return cls(centroids.astype(np.float32), order, offsets)
+
+    @staticmethod
+    def _assign(matrix: np.ndarray, centroids: np.ndarray, block: int = 65536) -> np.ndarray:
+        assignment = np.empty(matrix.shape[0], dtype=np.int64)
+        for start in range(0, matrix.shape[0], block):
+            rows = np.asarray(matrix[start:start + block], dtype=np.float32)
+            assignment[start:start + block] = np.argmax(rows @ centroids.T, axis=1)
+        return assignment
+
+    def candidates(self, query: np.ndarray, nprobe: int) -> np.ndarray:
+        """מחזיר את מספרי השורות ב-nprobe הרשימות הקרובות לשאילתה (מנורמלת)"""
+        nprobe = max(1, min(nprobe, self.nlist))
+        scores = self.centroids @ query
+        if nprobe < self.nlist:
+            lists = np.argpartition(-scores, nprobe - 1)[:nprobe]
+        else:
+            lists = np.arange(self.nlist)
+        return np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+
+    def save(self, store_dir: str) -> None:
+        np.save(os.path.join(store_dir, CENTROIDS_FILE), self.centroids)
+        np.save(os.path.join(store_dir, ORDER_FILE), self.order)
+        np.save(os.path.join(store_dir, OFFSETS_FILE), self.offsets)
+
+    @classmethod
+    def load(cls, store_dir: str) -> "IVFIndex":
+        return cls(
+            np.load(os.path.join(store_dir, CENTROIDS_FILE)),
+            np.load(os.path.join(store_dir, ORDER_FILE), mmap_mode="r"),
+            np.load(os.path.join(store_dir, OFFSETS_FILE)),
+        )
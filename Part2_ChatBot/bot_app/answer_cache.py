@@ -0,0 +1,165 @@
+"""
+מטמון תשובות סמנטי לשאלות אחרי ההרשמה.
+
+המפתח: (קופה, רמת ביטוח) מנורמלים, ובתוך כל אחד מהם - embedding של השאלה.
+תשובה נשמרת מוחזרת לשאלה חדשה באותה קופה ורמה כשדמיון הקוסינוס ביניהן עולה על ANSWER_CACHE_THRESHOLD,
+כך ש"כמה עולה הלבנת שיניים במכבי זהב" ו"מה המחיר של הלבנת שיניים?" חולקות תשובה אחת בלי קריאה למודל.
+
+רשומות פגות אחרי ANSWER_CACHE_TTL שניות, המטמון חסום ל-ANSWER_CACHE_SIZE רשומות (LRU),
+והוא מתרוקן כשגרסת בסיס הידע (גרסת האינדקס) משתנה.
+"""
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "2000"))
+
+
+class _Scope:
+    """הרשומות של (קופה, רמה) אחת, ומטריצת ה-embeddings המנורמלים שלהן לחיפוש במכפלה אחת"""
+
+    def __init__(self):
+        self.entries = OrderedDict()  # לפי סדר ההכנסה, כלומר גם לפי זמן התפוגה
+        self._ids = None
+        self._matrix = None
+
+    def matrix(self) -> Tuple[List[int], Optional[np.ndarray]]:
+        if self._matrix is None and self.entries:
+            self._ids = list(self.entries)
+            self._matrix = np.stack([self.entries[i]["embedding"] for i in self._ids])
+        return self._ids or [], self._matrix
+
+    def changed(self) -> None:
+        self._ids = self._matrix = None
+
+
+class SemanticAnswerCache:
+    """תשובות לפי (קופה, רמה) ודמיון embeddings של השאלה"""
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl: float = ANSWER_CACHE_TTL,
+                 max_entries: int = ANSWER_CACHE_SIZE, enabled: bool = ANSWER_CACHE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._scopes = {}
+        self._lru = OrderedDict()  # מזהה רשומה -> (קופה, רמה)
+        self._next_id = 0
+        self._version = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.saved_seconds = 0.0
+        self.invalidations = 0
+
+    def __len__(self) -> int:
+        return len(self._lru)
+
+    @staticmethod
+    def _normalize(embedding) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _check_version(self, version) -> None:
+        """נקרא תחת _lock. גרסה חדשה של בסיס הידע פוסלת את כל התשובות"""
+        if version == self._version:
+            return
+        if self._lru:
+            logger.info(f"Answer cache invalidated: knowledge base {self._version} -> {version} ({len(self._lru)} entries)")
+            self.invalidations += 1
+        self._scopes.clear()
+        self._lru.clear()
+        self._version = version
+
+    def _remove(self, entry_id: int) -> None:
+        """נקרא תחת _lock"""
+        scope_key = self._lru.pop(entry_id)
+        scope = self._scopes[scope_key]
+        scope.entries.pop(entry_id, None)
+        scope.changed()
+        if not scope.entries:
+            del self._scopes[scope_key]
+
+    def _expire(self, scope: _Scope, now: float) -> None:
+        """נקרא תחת _lock. הרשומות הוותיקות בתחילת הסדר - עוצרים בראשונה שעוד בתוקף"""
+        while scope.entries:
+            entry_id, entry = next(iter(scope.entries.items()))
+            if now - entry["created_at"] <= self.ttl:
+                break
+            self._remove(entry_id)
+
+    def lookup(self, hmo: str, tier: str, embedding, version) -> Optional[Dict[str, Any]]:
+        """התשובה של השאלה הדומה ביותר באותה קופה ורמה, אם הדמיון מעל הסף"""
+        if not self.enabled:
+            return None
+        query = self._normalize(embedding)
+        with self._lock:
+            self._check_version(version)
+            scope = self._scopes.get((hmo, tier))
+            if scope is not None:
+                self._expire(scope, time.time())
+            ids, matrix = scope.matrix() if scope is not None and scope.entries else ([], None)
+            if matrix is None or matrix.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+
+            scores = matrix @ query
+            best = int(np.argmax(scores))
+            if scores[best] < self.threshold:
+                self.misses += 1
+                return None
+
+            entry_id = ids[best]
+            entry = scope.entries[entry_id]
+            self._lru.move_to_end(entry_id)
+            self.hits += 1
+            self.saved_seconds += entry["cost"]
+            return {"answer": entry["answer"], "query": entry["query"], "similarity": float(scores[best]),
+                    "cost": entry["cost"]}
+
+    def put(self, hmo: str, tier: str, query: str, embedding, answer: str, cost: float, version) -> None:
+        """cost - כמה זמן לקח להפיק את התשובה; נספר כזמן שנחסך בכל פגיעה"""
+        if not self.enabled or self.max_entries <= 0:
+            return
+        with self._lock:
+            self._check_version(version)
+            scope = self._scopes.setdefault((hmo, tier), _Scope())
+            entry_id = self._next_id
+            self._next_id += 1
+            scope.entries[entry_id] = {
+                "query": query,
+                "embedding": self._normalize(embedding),
+                "answer": answer,
+                "cost": cost,
+                "created_at": time.time(),
+            }
+            scope.changed()
+            self._lru[entry_id] = (hmo, tier)
+            while len(self._lru) > self.max_entries:
+                self._remove(next(iter(self._lru)))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "avg_saved_seconds_per_hit": round(self.saved_seconds / self.hits, 3) if self.hits else 0.0,
+                "entries": len(self._lru),
+                "scopes": len(self._scopes),
+                "invalidations": self.invalidations,
+                "kb_version": self._version,
+                "threshold": self.threshold,
+            }
@@ -0,0 +1,141 @@
+"""
+טבלת ההטבות המובנית: (שירות x קופה x רמת ביטוח) -> טקסט ההטבה, בקידוד מילון.
+
+נבנית בזמן יצירת המאגר מתאי הטבלאות ב-HTML ונשמרת לצד הוקטורים:
+    benefits.json       - מילונים: שירותים (וקטגוריה לכל שירות), קופות, רמות, טקסטי הטבות
+    benefits_table.npy  - מערך int32 בגודל (שירותים, קופות, רמות) של מספרי הטבות;
+                          -1 = אין ערך, -2 = ערכים סותרים לאותו תא
+
+שאלה שמזכירה שירות אחד באופן חד-משמעי (כולל שגיאות כתיב קלות) נענית בחיפוש ישיר בטבלה,
+בלי embedding ובלי פרומפט ארוך.
+"""
+import os
+import json
+from typing import List, Dict, Any, Tuple, Optional, Iterable
+import numpy as np
+from bot_app.lexical import ServiceMatcher, tokenize
+from bot_app.vector_index import HMO_ALIASES, TIER_ALIASES, normalize_hmo, normalize_tier
+
+TABLE_FILE = "benefits_table.npy"
+DICT_FILE = "benefits.json"
+
+MISSING = -1
+CONFLICT = -2
+
+# שאלות על דרכי יצירת קשר אינן שאלות על ההטבה עצמה
+NON_BENEFIT_TERMS = {"טלפון", "כתובת", "להתקשר", "phone", "contact", "address"}
+
+# התשובה הישירה רק לשאלה על ההטבה: מה מגיע, כמה עולה, מה מכוסה. אחרת ("מה זה X", "איפה X") - שליפה רגילה
+BENEFIT_TERMS = {
+    "מגיע", "מגיעה", "מגיעים", "זכאי", "זכאית", "זכאים", "זכאות", "הנחה", "הנחות", "עולה", "עלות", "מחיר",
+    "כיסוי", "מכוסה", "מכוסים", "מכסה", "מכסים", "הטבה", "הטבות", "השתתפות", "לשלם", "משלם", "משלמת", "תשלום",
+    "חינם", "מקבל", "מקבלת", "לקבל", "כלול", "כלולים",
+    "entitled", "entitlement", "discount", "discounts", "cost", "costs", "price", "pay", "cover", "covers",
+    "covered", "coverage", "benefit", "benefits", "free", "get", "receive", "included", "copay",
+}
+
+
+class BenefitsTable:
+    """מילונים של שירותים / קופות / רמות / הטבות ומערך תלת-ממדי של מספרי הטבות"""
+
+    def __init__(self, services: List[str], categories: List[str], hmos: List[str], tiers: List[str],
+                 benefits: List[str], table: np.ndarray):
+        self.services = services
+        self.categories = categories
+        self.hmos = hmos
+        self.tiers = tiers
+        self.benefits = benefits
+        self.table = table
+        self._service_ids = {name: n for n, name in enumerate(services)}
+        self._matcher = ServiceMatcher(services, fuzzy=True)
+
+    @classmethod
+    def build(cls, rows: Iterable[Tuple[str, str, str, str, str]]) -> "BenefitsTable":
+        """rows: (קטגוריה, שירות, קופה, רמה, הטבה)"""
+        cells = {}
+        categories = {}
+        benefit_ids = {}
+        for category, service, hmo, tier, benefit in rows:
+            hmo, tier = normalize_hmo(hmo), normalize_tier(tier)
+            if not (service and hmo and tier and benefit):
+                continue
+            categories.setdefault(service, category)
+            benefit_id = benefit_ids.setdefault(benefit, len(benefit_ids))
+            key = (service, hmo, tier)
+            cells[key] = benefit_id if cells.get(key, benefit_id) == benefit_id else CONFLICT
+
+        services = sorted(categories)
+        hmos = sorted({hmo for _, hmo, _ in cells})
+        tiers = sorted({tier for _, _, tier in cells})
+        table = np.full((len(services), len(hmos), len(tiers)), MISSING, dtype=np.int32)
+        service_ids = {name: n for n, name in enumerate(services)}
+        hmo_ids = {name: n for n, name in enumerate(hmos)}
+        tier_ids = {name: n for n, name in enumerate(tiers)}
+        for (service, hmo, tier), benefit_id in cells.items():
+            table[service_ids[service], hmo_ids[hmo], tier_ids[tier]] = benefit_id
+
+        benefits = [""] * len(benefit_ids)
+        for text, benefit_id in benefit_ids.items():
+            benefits[benefit_id] = text
+        return cls(services, [categories[s] for s in services], hmos, tiers, benefits, table)
+
+    def __len__(self) -> int:
+        return int((self.table >= 0).sum())
+
+    def match_service(self, question: str) -> Tuple[Optional[str], List[str]]:
+        """(שירות, מועמדים) - ראו ServiceMatcher.match; כולל תיקון שגיאות כתיב קלות"""
+        return self._matcher.match(question)
+
+    def lookup(self, service: str, hmo: Optional[str], tier: Optional[str]) -> Optional[str]:
+        hmo, tier = normalize_hmo(hmo), normalize_tier(tier)
+        if service not in self._service_ids or hmo not in self.hmos or tier not in self.tiers:
+            return None
+        benefit_id = int(self.table[self._service_ids[service], self.hmos.index(hmo), self.tiers.index(tier)])
+        return self.benefits[benefit_id] if benefit_id >= 0 else None
+
+    def answer(self, question: str, hmo: Optional[str], tier: Optional[str]) -> Optional[Dict[str, str]]:
+        """
+        תשובה ישירה לשאלה "מה מגיע לי עבור X" לפי הקופה והרמה של המשתמש.
+        None אם אין שירות חד-משמעי, אם השאלה משווה לקופה / רמה אחרת, או שאינה על ההטבה עצמה.
+        """
+        hmo, tier = normalize_hmo(hmo), normalize_tier(tier)
+        words = set(tokenize(question))
+        if words & NON_BENEFIT_TERMS or not words & BENEFIT_TERMS:
+            return None
+        if {HMO_ALIASES[w] for w in words if w in HMO_ALIASES} - {hmo}:
+            return None
+        if {TIER_ALIASES[w] for w in words if w in TIER_ALIASES} - {tier}:
+            return None
+
+        service, _ = self.match_service(question)
+        if service is None:
+            return None
+        benefit = self.lookup(service, hmo, tier)
+        if benefit is None:
+            return None
+        return {
+            "service": service,
+            "category": self.categories[self._service_ids[service]],
+            "hmo": hmo,
+            "tier": tier,
+            "benefit": benefit,
+        }
+
+    def save(self, store_dir: str) -> Dict[str, Any]:
+        with open(os.path.join(store_dir, DICT_FILE), "w", encoding="utf-8") as f:
+            json.dump({
+                "services": self.services,
+                "categories": self.categories,
+                "hmos": self.hmos,
+                "tiers": self.tiers,
+                "benefits": self.benefits,
+            }, f, ensure_ascii=False)
+        np.save(os.path.join(store_dir, TABLE_FILE), self.table)
+        return {"type": "benefits", "services": len(self.services), "cells": len(self)}
+
+    @classmethod
+    def load(cls, store_dir: str, header: Dict[str, Any]) -> "BenefitsTable":
+        with open(os.path.join(store_dir, DICT_FILE), "r", encoding="utf-8") as f:
+            data = json.load(f)
+        return cls(data["services"], data["categories"], data["hmos"], data["tiers"], data["benefits"],
+                   np.load(os.path.join(store_dir, TABLE_FILE)))
@@ -1,19 +1,45 @@
 import os
+import time
+import asyncio
 from dotenv import load_dotenv
 import openai
-from typing import List, Dict
-from bot_app.embeddings import find_similar_chunks
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+import re
+from pydantic import ValidationError
+from bot_app.embeddings import (find_similar_chunks, find_similar_chunks_batch, lookup_benefit, lexical_chunks,
+                                get_embedding, get_embeddings, get_index_version, get_vector_index)
+from bot_app.user_info import UserInfo
+from bot_app.answer_cache import SemanticAnswerCache
+from bot_app.medical_classifier import MedicalClassifier
+from bot_app.conversation_context import conversation_text, context_messages, recent_messages, update_context, adopt_fold
 
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 env_path = os.path.join(project_root, ".env")
 load_dotenv(dotenv_path=env_path)
 
-client = openai.AzureOpenAI(
+client = openai.AsyncAzureOpenAI(
     api_key=os.getenv("AZURE_OPENAI_API_KEY"),
     api_version="2024-02-01",
     azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
 )
 
+# תשובות משותפות למשתמשים באותה קופה ורמה, לשאלות דומות (ראו bot_app/answer_cache.py)
+answer_cache = SemanticAnswerCache()
+
+# פרטים מזהים לא נכנסים לפרומפט התשובה - הם לא נדרשים לה, והתשובה עשויה להיות משותפת למשתמשים אחרים
+IDENTIFYING_FIELDS = {"first_name", "last_name", "id_number", "hmo_card"}
+# תשובה במטמון משותפת לכל מי שבאותה קופה ורמה, ולכן כשהמטמון פעיל הפרומפט כולל רק את שני השדות האלה
+# (תשובה שהותאמה לגיל או למגדר של משתמש אחד לא תוחזר למשתמש אחר)
+CACHE_SCOPE_FIELDS = {"hmo", "insurance_tier"}
+
+def prompt_user_info(user_info: Dict[str, str]) -> str:
+    """הפרטים שנכנסים לפרומפט התשובה"""
+    if answer_cache.enabled:
+        fields = {k: v for k, v in user_info.items() if k in CACHE_SCOPE_FIELDS}
+    else:
+        fields = {k: v for k, v in user_info.items() if k not in IDENTIFYING_FIELDS}
+    return "\n".join([f"{k}: {v}" for k, v in fields.items() if v])
+
 system_prompt = """
 You are a smart and polite virtual assistant for healthcare services in Israel.
 
@@ -63,6 +89,7 @@ Required fields:
 Rules:
 - Only extract information that was clearly provided by the user
 - Normalize variations (e.g., "נקבהה" → "נקבה", "מכביי" → "מכבי")
+- If a field was given more than once (e.g. the user later corrected it), use the latest value
 - If information wasn't provided, use empty string ""
 - Return only valid JSON
 
@@ -70,6 +97,26 @@ Conversation:
 {conversation_text}
 """
 
+summary_prompt_template = """
+Update the running summary of a healthcare registration conversation with the messages below.
+
+Current summary:
+{summary}
+
+Details already known:
+{facts}
+
+New messages:
+{messages}
+
+Return JSON with two keys:
+- "summary": the updated summary, at most 80 words, in English. Keep what still matters for the rest of the conversation
+  (open questions, invalid answers the user still has to fix, the user's language), drop small talk
+- "facts": the fields the user provided in the new messages (first_name, last_name, id_number, gender, age, hmo,
+  hmo_card, insurance_tier), latest value if given more than once. Omit fields that were not provided
+Return only valid JSON.
+"""
+
 confirmation_prompt_template = """
 Is this confirmation? '{user_reply}' Answer YES or NO.
 """
@@ -116,6 +163,16 @@ User question:
 """
 
 
+benefit_answer_prompt_template = """
+User question: "{user_message}"
+
+Fact from the HMO's official benefits table:
+For {service}, members of {hmo} with the {tier} insurance tier are entitled to: {benefit}
+
+Answer the question using only this fact, briefly, in the user's language.
+"""
+
+
 redirect_prompt_template = """
 The user said: "{user_message}"
 
@@ -127,19 +184,68 @@ Examples:
 - "אני כאן לעזור עם שאלות על שירותים רפואיים. במה תרצה שאעזור לך בנושא הבריאות שלך?"
 """
 
-def ask_gpt(messages, max_tokens=1000, temperature=0.1):
-    return client.chat.completions.create(
+async def ask_gpt(messages, max_tokens=1000, temperature=0.1):
+    response = await client.chat.completions.create(
         model="gpt-4o",
         messages=messages,
         max_tokens=max_tokens,
         temperature=temperature
-    ).choices[0].message.content.strip()
+    )
+    return response.choices[0].message.content.strip()
 
-def extract_user_info_with_ai(chat_history: List[Dict[str, str]]) -> Dict[str, str]:
-    conversation_text = "\n".join([f"{m['role']}: {m['content']}" for m in chat_history])
-    prompt = extraction_prompt_template.format(conversation_text=conversation_text)
+async def ask_gpt_stream(messages, max_tokens=1000, temperature=0.1) -> AsyncIterator[str]:
+    """כמו ask_gpt, אבל מחזיר את הטוקנים כשהם מגיעים מהמודל"""
+    stream = await client.chat.completions.create(
+        model="gpt-4o",
+        messages=messages,
+        max_tokens=max_tokens,
+        temperature=temperature,
+        stream=True
+    )
+    async for chunk in stream:
+        # ב-Azure החלק הראשון (תוצאות סינון התוכן) מגיע בלי choices
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+def gpt_reply(messages, max_tokens=1000, temperature=0.1) -> Dict[str, Any]:
+    """תשובה שתיווצר במודל - ב-ask_gpt או ב-ask_gpt_stream, לפי סוג הבקשה"""
+    return {"request": {"messages": messages, "max_tokens": max_tokens, "temperature": temperature}}
+
+async def complete_reply(reply: Dict[str, Any]) -> str:
+    if "text" in reply:
+        return reply["text"]
+    return await ask_gpt(**reply["request"])
+
+async def stream_reply(reply: Dict[str, Any]) -> AsyncIterator[str]:
+    if "text" in reply:
+        yield reply["text"]
+        return
+    async for token in ask_gpt_stream(**reply["request"]):
+        yield token
+
+async def summarize_conversation(summary: str, facts: Dict[str, str], messages: List[Dict[str, str]]) -> Dict[str, Any]:
+    """מקפל הודעות שיצאו מהחלון לסיכום המתגלגל (ראו bot_app/conversation_context.py)"""
+    import json
+    prompt = summary_prompt_template.format(
+        summary=summary or "(empty)",
+        facts=json.dumps(facts, ensure_ascii=False) if facts else "(none)",
+        messages="\n".join([f"{m['role']}: {m['content']}" for m in messages])
+    )
+    response = await ask_gpt([
+        {"role": "system", "content": "Summarize conversations and extract user details. Return JSON."},
+        {"role": "user", "content": prompt}
+    ], max_tokens=400, temperature=0)
+    json_match = re.search(r'\{.*\}', response, re.DOTALL)
+    if not json_match:
+        raise ValueError(f"No JSON in summary response: {response[:100]!r}")
+    return json.loads(json_match.group())
+
+async def extract_user_info_with_ai(chat_history: List[Dict[str, str]],
+                                    context: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
+    # העובדות הנעוצות, הסיכום וההודעות האחרונות - לא כל השיחה
+    prompt = extraction_prompt_template.format(conversation_text=conversation_text(chat_history, context))
     try:
-        response = ask_gpt([
+        response = await ask_gpt([
             {"role": "system", "content": "Extract user information from a healthcare registration conversation and return JSON."},
             {"role": "user", "content": prompt}
         ], max_tokens=500, temperature=0)
@@ -158,18 +264,36 @@ def extract_user_info_with_ai(chat_history: List[Dict[str, str]]) -> Dict[str, s
         print(f"AI extraction failed: {e}")
         return {}
 
-def is_medical_related_ai(user_message: str, chat_history: List[Dict[str, str]]) -> bool:
+async def is_medical_related_ai(user_message: str, chat_history: List[Dict[str, str]]) -> bool:
     recent_messages = chat_history[-6:] if len(chat_history) >= 6 else chat_history
     recent_context = "\n".join([f"{msg.get('role', 'unknown')}: {msg.get('content', '')}" for msg in recent_messages])
     classification_prompt = medical_classification_prompt_template.format(message=user_message, context=recent_context)
     try:
-        response = ask_gpt([
+        response = await ask_gpt([
             {"role": "system", "content": "Classify messages as MEDICAL or NON_MEDICAL."},
             {"role": "user", "content": classification_prompt}
         ], max_tokens=10, temperature=0)
-        return response.strip().upper() == "MEDICAL"
-    except:
-        return True
+    except Exception as e:
+        raise RuntimeError(f"Medical classification failed: {e}") from e
+    label = response.strip().upper()
+    if label not in ("MEDICAL", "NON_MEDICAL"):
+        raise ValueError(f"Unexpected classification: {response!r}")
+    return label == "MEDICAL"
+
+def mentions_service(user_message: str) -> bool:
+    """האם ההודעה מזכירה שירות מהאינדקס (גם כשהיא דו-משמעית בין כמה שירותים)"""
+    index = get_vector_index()
+    if index.benefits is not None:
+        return bool(index.benefits.match_service(user_message)[1])
+    return index.match_service(user_message) is not None
+
+# סיווג מקומי (לקסיקון + מרכזי כובד של embeddings); המודל נשאל רק באזור אי-הוודאות
+medical_classifier = MedicalClassifier(
+    embed_one=get_embedding,
+    embed_many=get_embeddings,
+    llm_classify=is_medical_related_ai,
+    service_matcher=mentions_service,
+)
 
 def extract_key_terms(user_message: str) -> List[str]:
     words = user_message.replace('?', '').replace('.', '').replace(',', '').split()
@@ -202,7 +326,33 @@ def transform_chunk(chunk: str) -> str:
     
     return chunk.strip()
 
-def enhanced_search_and_answer(user_message: str, user_info: Dict[str, str]) -> str:
+def benefit_answer_reply(benefit: Dict[str, str], user_message: str) -> Dict[str, Any]:
+    """
+    תשובה מתוצאת חיפוש ישיר בטבלת ההטבות: בעברית - ניסוח קבוע ללא קריאה למודל,
+    בשפה אחרת - פרומפט קצר עם העובדה היחידה במקום כל בסיס הידע.
+    """
+    if re.search(r"[א-ת]", user_message):
+        return {"text": (
+            f"עבור {benefit['service']}: חברי קופת חולים {benefit['hmo']} ברמת ביטוח {benefit['tier']} "
+            f"זכאים ל{benefit['benefit']}"
+        )}
+
+    prompt = benefit_answer_prompt_template.format(user_message=user_message, **benefit)
+    return gpt_reply([
+        {"role": "system", "content": "You are a helpful assistant. Answer only based on the provided fact."},
+        {"role": "user", "content": prompt}
+    ], max_tokens=300, temperature=0.1)
+
+async def format_benefit_answer(benefit: Dict[str, str], user_message: str) -> str:
+    return await complete_reply(benefit_answer_reply(benefit, user_message))
+
+async def retrieve_for_answer(user_message: str, user_info: Dict[str, str]) -> Dict[str, Any]:
+    """
+    שלב השליפה, ללא קריאה למודל השפה. מחזיר אחד מהבאים:
+    {"reply": ...} - תשובה סופית (חסרים פרטים / לא נמצא מידע),
+    {"benefit": ...} - תוצאת חיפוש ישיר בטבלת ההטבות,
+    {"qa_prompt": ...} - פרומפט מוכן ליצירת התשובה מהקטעים שנמצאו.
+    """
     print(f"\n🔍 DEBUG - User info received: {user_info}")
     
     tier_translation = {"זהב": "Gold", "כסף": "Silver", "ארד": "Bronze"}
@@ -221,13 +371,33 @@ def enhanced_search_and_answer(user_message: str, user_info: Dict[str, str]) ->
 
     if not normalized_hmo or not normalized_tier:
         print("⚠️ WARNING: Missing HMO or insurance tier information")
-        return "מצטער, אני צריך את פרטי קופת החולים ודרגת הביטוח שלך כדי לתת לך מידע מדויק."
-
-    relevant_chunks = find_similar_chunks(user_message, top_k=5)
+        return {"reply": "מצטער, אני צריך את פרטי קופת החולים ודרגת הביטוח שלך כדי לתת לך מידע מדויק."}
+
+    benefit = lookup_benefit(user_message, hmo=normalized_hmo, tier=normalized_tier)
+    if benefit:
+        print(f"⚡ Direct benefits lookup: {benefit['service']} / {benefit['hmo']} / {benefit['tier']}")
+        return {"benefit": benefit}
+
+    # שאלה שמזכירה שירות אחד נענית מהמסלול הלקסיקלי בלי embedding - גם לא בשביל מטמון התשובות
+    relevant_chunks = lexical_chunks(user_message, top_k=5, hmo=normalized_hmo, tier=normalized_tier)
+    cache_entry = None
+    if relevant_chunks is None and answer_cache.enabled:
+        started = time.perf_counter()
+        question_emb = await get_embedding(user_message)
+        kb_version = get_index_version()
+        cached = answer_cache.lookup(normalized_hmo, normalized_tier, question_emb, kb_version)
+        if cached:
+            print(f"♻️ Answer cache hit ({cached['similarity']:.3f} to '{cached['query']}'), saved ~{cached['cost']:.2f}s")
+            return {"reply": cached["answer"]}
+        cache_entry = {"hmo": normalized_hmo, "tier": normalized_tier, "query": user_message,
+                       "embedding": question_emb, "version": kb_version, "started": started}
+
+    if relevant_chunks is None:
+        relevant_chunks = await find_similar_chunks(user_message, top_k=5, hmo=normalized_hmo, tier=normalized_tier,
+                                                    fast_path=False)
     if not relevant_chunks or all(len(chunk.strip()) < 50 for chunk in relevant_chunks):
         key_terms = extract_key_terms(user_message)
-        for term in key_terms:
-            relevant_chunks.extend(find_similar_chunks(term, top_k=2))
+        relevant_chunks.extend(await find_similar_chunks_batch(key_terms, top_k=2, hmo=normalized_hmo, tier=normalized_tier))
         relevant_chunks = list(dict.fromkeys(relevant_chunks))[:5]
 
     transformed_chunks = []
@@ -238,11 +408,11 @@ def enhanced_search_and_answer(user_message: str, user_info: Dict[str, str]) ->
                 transformed_chunks.append(transformed)
     
     if not transformed_chunks:
-        return "אני מצטער, לא הצלחתי למצוא מידע הקשור לשאלתך."
+        return {"reply": "אני מצטער, לא הצלחתי למצוא מידע הקשור לשאלתך."}
     
     context = "\n\n".join([f"• {c}" for c in transformed_chunks])
 
-    user_info_text = "\n".join([f"{k}: {v}" for k, v in user_info.items() if v])
+    user_info_text = prompt_user_info(user_info)
 
     qa_prompt = qa_prompt_template.format(
         user_info_text=user_info_text,
@@ -253,13 +423,100 @@ def enhanced_search_and_answer(user_message: str, user_info: Dict[str, str]) ->
     print("\n📤 QA PROMPT:")
     print(qa_prompt)
     print("\n" + "="*50)
-
-    return ask_gpt([
+    return {"qa_prompt": qa_prompt, "cache": cache_entry}
+
+def answer_reply(user_message: str, retrieval: Dict[str, Any]) -> Dict[str, Any]:
+    """שלב היצירה, מתוצאת retrieve_for_answer"""
+    if "reply" in retrieval:
+        return {"text": retrieval["reply"]}
+    if "benefit" in retrieval:
+        return benefit_answer_reply(retrieval["benefit"], user_message)
+    reply = gpt_reply([
         {"role": "system", "content": "You are a helpful assistant. Answer only based on provided context."},
-        {"role": "user", "content": qa_prompt}
+        {"role": "user", "content": retrieval["qa_prompt"]}
     ], max_tokens=1000, temperature=0.1)
+    reply["cache"] = retrieval.get("cache")
+    return reply
+
+def remember_answer(reply: Dict[str, Any], answer: str) -> None:
+    """תשובה שנוצרה מהקטעים נשמרת במטמון הסמנטי, עם הזמן שלקח להפיק אותה"""
+    entry = reply.get("cache")
+    if not entry or not answer:
+        return
+    answer_cache.put(entry["hmo"], entry["tier"], entry["query"], entry["embedding"], answer,
+                     cost=time.perf_counter() - entry["started"], version=entry["version"])
 
+async def generate_answer(user_message: str, retrieval: Dict[str, Any]) -> str:
+    return await complete_reply(answer_reply(user_message, retrieval))
 
+async def enhanced_search_and_answer(user_message: str, user_info: Dict[str, str]) -> str:
+    return await generate_answer(user_message, await retrieve_for_answer(user_message, user_info))
+
+async def _timed(awaitable):
+    started = time.perf_counter()
+    return await awaitable, time.perf_counter() - started
+
+async def classify_and_retrieve(user_message: str, chat_history: List[Dict[str, str]],
+                          user_info: Dict[str, str]) -> Tuple[bool, Optional[Dict[str, Any]]]:
+    """
+    הסיווג (מקומי, ובמקרה של ספק - קריאה למודל) והשליפה (embedding + חיפוש) אינם תלויים זה בזה,
+    ולכן רצים במקביל: השליפה רצה כ-task ברקע בזמן הסיווג, ושניהם חולקים את ה-embedding של ההודעה.
+    הודעה שאינה רפואית לא מחכה לשליפה - ה-task מבוטל. מחזיר (רפואית?, תוצאת השליפה או None).
+    """
+    started = time.perf_counter()
+    retrieval = asyncio.create_task(_timed(retrieve_for_answer(user_message, dict(user_info))))
+    try:
+        decision, classify_s = await _timed(medical_classifier.classify(user_message, chat_history))
+    except BaseException:
+        retrieval.cancel()
+        raise
+
+    label = f"{decision['source']} {decision['confidence']:.2f}"
+    if not decision["medical"]:
+        if retrieval.done():
+            print(f"⏱️ classify {classify_s:.2f}s ({label}) - non-medical, speculative retrieval discarded")
+        else:
+            retrieval.cancel()
+            print(f"⏱️ classify {classify_s:.2f}s ({label}) - non-medical, speculative retrieval cancelled")
+        return False, None
+
+    result, retrieve_s = await retrieval
+    stage_s = time.perf_counter() - started
+    saved_s = max(classify_s + retrieve_s - stage_s, 0.0)
+    overlap = saved_s / min(classify_s, retrieve_s) if min(classify_s, retrieve_s) > 0 else 0.0
+    print(f"⏱️ classify {classify_s:.2f}s ({label}) ‖ retrieve {retrieve_s:.2f}s -> stage {stage_s:.2f}s "
+          f"(sequential {classify_s + retrieve_s:.2f}s, saved {saved_s:.2f}s, overlap {min(overlap, 1.0):.0%})")
+    return True, result
+
+
+
+# בקשה מפורשת לשנות פרט אישי אחרי האישור: פועל שינוי בגוף ראשון (או בקשה מהבוט) צמוד לאחד השדות.
+# שאלה רגילה שרק מזכירה שינוי ושדה ("האם יש שינוי בהנחה במכבי?") אינה בקשת שינוי
+HE_PROFILE_WORD = r"(?:שמי|שם|ת\.?ז|תעודת|מספר|מגדר|גיל|קופ[הת]?|כרטיס|מסלול|ביטוח|רמת|זהב|כסף|ארד|מכבי|מאוחדת|כללית)"
+HE_PROFILE_FIELD = rf"[הלב]?{HE_PROFILE_WORD}"
+EN_PROFILE_FIELD = (r"(?:the\s+)?(?:hmo|health\s+fund|tier|plan|insurance|age|name|id|card|gender|"
+                    r"maccabi|meuhedet|clalit|gold|silver|bronze)\b")
+PROFILE_CHANGE_RE = re.compile(
+    "|".join([
+        rf"(?<![א-ת])עברתי\s+(?:עכשיו\s+|כבר\s+)?ל-?(?:קופ[הת]\s+|מסלול\s+)?{HE_PROFILE_FIELD}",
+        rf"(?<![א-ת])(?:שיניתי|החלפתי|עדכנתי|טעיתי)\s+(?:את\s+)?{HE_PROFILE_FIELD}",
+        rf"(?<![א-ת])(?:תשנה|תשני|תעדכן|תעדכני|תתקן|תתקני|(?:רוצה|צריך|צריכה|מבקש|מבקשת)\s+ל(?:שנות|עדכן|תקן))"
+        rf"\s+(?:לי\s+)?(?:את\s+)?{HE_PROFILE_FIELD}",
+        rf"{HE_PROFILE_FIELD}\s+שלי\s+(?:הוא\s+|היא\s+)?(?:עכשיו|כעת|השתנ)",
+        rf"(?<![א-ת])אני\s+(?:עכשיו|כעת)\s+(?:במסלול\s+)?ב-?{HE_PROFILE_WORD}",
+        rf"\bI(?:'ve|\s+have)?\s+(?:switched|moved|transferred|changed|upgraded|downgraded)\s+"
+        rf"(?:my\s+|to\s+|from\s+\w+\s+to\s+)?{EN_PROFILE_FIELD}",
+        rf"\b(?:change|update|correct|fix)\s+my\s+{EN_PROFILE_FIELD}",
+        rf"\bmy\s+{EN_PROFILE_FIELD}(?:\s+\w+)?\s+(?:is\s+now|is\s+actually|is\s+wrong|was\s+wrong|has\s+changed|changed)",
+        rf"\bI(?:'m|\s+am)\s+now\s+(?:with|in|on|at)\s+{EN_PROFILE_FIELD}",
+    ]),
+    re.IGNORECASE
+)
+
+profile_updated_template = {
+    "he": "עדכנתי את הפרטים שלך: קופת חולים {hmo}, רמת ביטוח {insurance_tier}, גיל {age}. אפשר להמשיך לשאול.",
+    "en": "I've updated your details: HMO {hmo}, insurance tier {insurance_tier}, age {age}. Feel free to continue."
+}
 
 def all_info_collected(chat_history: List[Dict[str, str]]) -> bool:
     for i in range(len(chat_history) - 1, -1, -1):
@@ -275,14 +532,15 @@ def all_info_collected(chat_history: List[Dict[str, str]]) -> bool:
     return False
 
 
-def extract_user_info(chat_history: List[Dict[str, str]]) -> Dict[str, str]:
+async def extract_user_info(chat_history: List[Dict[str, str]],
+                            context: Optional[Dict[str, Any]] = None) -> Dict[str, str]:
     """
     מחלץ את פרטי המשתמש מההיסטוריה של השיחה
     """
     print("\n🔍 Starting user info extraction...")
     
     try:
-        user_info = extract_user_info_with_ai(chat_history)
+        user_info = await extract_user_info_with_ai(chat_history, context)
         if user_info and len(user_info) > 3:  
             print(f"✅ AI extraction successful: {user_info}")
             return user_info
@@ -352,32 +610,140 @@ def extract_user_info(chat_history: List[Dict[str, str]]) -> Dict[str, str]:
         print(f"❌ Error in extract_user_info: {e}")
         return {}
 
-def get_answer(user_message: str, chat_history: List[Dict[str, str]] = []) -> Dict:
+async def extract_user_profile(chat_history: List[Dict[str, str]],
+                               context: Optional[Dict[str, Any]] = None) -> Tuple[Optional[Dict[str, str]], Dict[str, str]]:
+    """
+    חילוץ הפרטים ואימות מול UserInfo. מחזיר (פרופיל לשמירה בסשן, הפרטים שחולצו);
+    הפרופיל None אם החילוץ חלקי, ואז החילוץ ינוסה שוב בתור הבא, כמו קודם.
+    """
+    user_info = await extract_user_info(chat_history, context)
     try:
-        if all_info_collected(chat_history):
-            user_info = extract_user_info(chat_history)
-            if not is_medical_related_ai(user_message, chat_history):
-                redirect_prompt = redirect_prompt_template.format(user_message=user_message)
-                bot_reply = ask_gpt([
-                    {"role": "system", "content": "You are a helpful healthcare assistant."},
-                    {"role": "user", "content": redirect_prompt}
-                ], max_tokens=500, temperature=0.3)
-            else:
-                bot_reply = enhanced_search_and_answer(user_message, user_info)
-            updated_history = chat_history + [
-                {"role": "user", "content": user_message},
-                {"role": "assistant", "content": bot_reply}
-            ]
-            return {"answer": bot_reply, "chat_history": updated_history}
-        else:
-            messages = [{"role": "system", "content": system_prompt}]
-            messages.extend(chat_history)
-            messages.append({"role": "user", "content": user_message})
-            bot_reply = ask_gpt(messages)
-            updated_history = chat_history + [
-                {"role": "user", "content": user_message},
-                {"role": "assistant", "content": bot_reply}
-            ]
-            return {"answer": bot_reply, "chat_history": updated_history}
+        profile = UserInfo.from_extracted(user_info)
+    except ValidationError as e:
+        print(f"⚠️ Extracted profile failed validation, not caching: {e.error_count()} error(s)")
+        return None, user_info
+    print(f"💾 User profile cached for the session: {profile.hmo} / {profile.tier}")
+    return profile.model_dump(), profile.to_extracted()
+
+def is_profile_change(user_message: str) -> bool:
+    return bool(PROFILE_CHANGE_RE.search(user_message))
+
+def checked_profile(user_profile: Optional[Dict[str, Any]]) -> Optional[Dict[str, str]]:
+    """פרופיל שהגיע מהלקוח (/ask) לא מובטח שעבר את UserInfo; פרופיל לא תקין נזנח והפרטים יחולצו מחדש"""
+    if not user_profile:
+        return None
+    try:
+        return UserInfo(**user_profile).model_dump()
+    except ValidationError as e:
+        print(f"⚠️ Ignoring invalid user profile: {e.error_count()} error(s)")
+        return None
+
+async def resolve_user_profile(user_message: str, chat_history: List[Dict[str, str]],
+                         user_profile: Optional[Dict[str, str]],
+                         context: Optional[Dict[str, Any]] = None) -> Tuple[Optional[Dict[str, str]], Dict[str, str], bool]:
+    """
+    הפרטים לתור הנוכחי: מהסשן אם קיימים; חילוץ מחדש רק כשאין פרופיל שמור,
+    או כשהמשתמש מבקש במפורש לשנות פרט. מחזיר (פרופיל, פרטים לתשובה, האם השתנה).
+    """
+    if user_profile and not is_profile_change(user_message):
+        return user_profile, UserInfo(**user_profile).to_extracted(), False
+
+    if user_profile:
+        print("✏️ Profile change requested, re-extracting user details")
+    history = chat_history + [{"role": "user", "content": user_message}]
+    profile, user_info = await extract_user_profile(history, context)
+    if profile is None:
+        if user_profile:
+            return user_profile, UserInfo(**user_profile).to_extracted(), False
+        return None, user_info, False
+    return profile, user_info, bool(user_profile) and profile != user_profile
+
+async def plan_reply(user_message: str, chat_history: List[Dict[str, str]], user_profile: Optional[Dict[str, str]],
+                     context: Optional[Dict[str, Any]] = None) -> Tuple[Dict[str, Any], Optional[Dict[str, str]]]:
+    """
+    כל מה שקודם ליצירת התשובה (פרופיל, סיווג, שליפה). מחזיר (תשובה, פרופיל), כשהתשובה היא
+    {"text": ...} מוכנה או בקשה למודל (gpt_reply) - שתיווצר במלואה או בהזרמה.
+    """
+    user_profile = checked_profile(user_profile)
+    if all_info_collected(chat_history):
+        user_profile, user_info, changed = await resolve_user_profile(user_message, chat_history, user_profile, context)
+        is_medical, retrieval = await classify_and_retrieve(user_message, chat_history, user_info)
+        if is_medical:
+            return answer_reply(user_message, retrieval), user_profile
+        if changed:
+            language = "he" if re.search(r"[א-ת]", user_message) else "en"
+            return {"text": profile_updated_template[language].format(**user_info)}, user_profile
+        redirect_prompt = redirect_prompt_template.format(user_message=user_message)
+        return gpt_reply([
+            {"role": "system", "content": "You are a helpful healthcare assistant."},
+            {"role": "user", "content": redirect_prompt}
+        ], max_tokens=500, temperature=0.3), user_profile
+
+    # חלון התורות האחרונים, הסיכום של הקודמים והפרטים שכבר נמסרו - גודל קבוע בערך לכל תור
+    recent = recent_messages(chat_history, context)
+    pinned = context_messages(context)
+    print(f"🧵 Registration context: {len(recent)}/{len(chat_history)} messages verbatim, "
+          f"{'with' if pinned else 'no'} summary/facts")
+    messages = [{"role": "system", "content": system_prompt}]
+    messages.extend(pinned)
+    messages.extend(recent)
+    messages.append({"role": "user", "content": user_message})
+    return gpt_reply(messages), user_profile
+
+async def finish_turn(user_message: str, chat_history: List[Dict[str, str]], user_profile: Optional[Dict[str, str]],
+                      bot_reply: str, context: Optional[Dict[str, Any]] = None) -> Dict:
+    updated_history = chat_history + [
+        {"role": "user", "content": user_message},
+        {"role": "assistant", "content": bot_reply}
+    ]
+    # המשתמש אישר עכשיו את הפרטים - חילוץ יחיד, שנשמר לכל המשך הסשן
+    if not all_info_collected(chat_history) and all_info_collected(updated_history):
+        user_profile, _ = await extract_user_profile(updated_history, context)
+    if user_profile and all_info_collected(updated_history):
+        # אחרי ההרשמה ההיסטוריה לא נשלחת לפרומפט; מספיק לנעוץ את הפרופיל (לחילוץ מחדש בבקשת שינוי)
+        context = update_context(updated_history, context, facts=UserInfo(**user_profile).to_extracted())
+    else:
+        context = update_context(updated_history, context, summarize=summarize_conversation)
+    return {"answer": bot_reply, "chat_history": updated_history, "user_profile": user_profile, "context": context}
+
+async def get_answer(user_message: str, chat_history: List[Dict[str, str]] = [],
+               user_profile: Optional[Dict[str, str]] = None, context: Optional[Dict[str, Any]] = None) -> Dict:
+    """
+    user_profile - הפרטים שחולצו ואומתו בתור האישור (מוחזרים בתשובה ונשלחים חזרה בכל תור),
+    כדי שלא לשלוח את כל השיחה למודל לחילוץ מחדש בכל שאלה.
+    context - הסיכום המתגלגל והעובדות הנעוצות (bot_app/conversation_context.py), מוחזר ונשלח חזרה באותו אופן.
+    """
+    context = adopt_fold(chat_history, context)
+    try:
+        reply, user_profile = await plan_reply(user_message, chat_history, user_profile, context)
+        bot_reply = await complete_reply(reply)
+        remember_answer(reply, bot_reply)
+        return await finish_turn(user_message, chat_history, user_profile, bot_reply, context)
+    except Exception as e:
+        return {"answer": f"שגיאה בשליחת הבקשה למודל: {e}", "chat_history": chat_history, "user_profile": user_profile,
+                "context": context}
+
+async def stream_answer(user_message: str, chat_history: List[Dict[str, str]] = [],
+                        user_profile: Optional[Dict[str, str]] = None,
+                        context: Optional[Dict[str, Any]] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    כמו get_answer, אבל בהזרמה: אירוע {"type": "token", "content"} לכל טוקן של התשובה,
+    ובסוף אירוע {"type": "done"} עם answer / chat_history / user_profile / context (ו-error אם נכשל).
+    """
+    parts = []
+    context = adopt_fold(chat_history, context)
+    try:
+        reply, user_profile = await plan_reply(user_message, chat_history, user_profile, context)
+        async for token in stream_reply(reply):
+            parts.append(token)
+            yield {"type": "token", "content": token}
+        bot_reply = "".join(parts).strip()
+        remember_answer(reply, bot_reply)
+        result = await finish_turn(user_message, chat_history, user_profile, bot_reply, context)
     except Exception as e:
-        return {"answer": f"שגיאה בשליחת הבקשה למודל: {e}", "chat_history": chat_history}
\ No newline at end of file
+        error_reply = f"שגיאה בשליחת הבקשה למודל: {e}"
+        if not parts:
+            yield {"type": "token", "content": error_reply}
+        result = {"answer": error_reply, "chat_history": chat_history, "user_profile": user_profile, "context": context,
+                  "error": str(e)}
+    yield {"type": "done", **result}
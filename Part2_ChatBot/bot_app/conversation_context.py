@@ -0,0 +1,164 @@
+"""
+הקשר שיחה חסום לפרומפטים של ההרשמה ושל חילוץ הפרטים.
+
+במקום כל ההיסטוריה, המודל מקבל:
+1. את CONTEXT_WINDOW_TURNS התורות האחרונים כלשונם,
+2. סיכום מתגלגל של התורות הישנים יותר - מתעדכן בהדרגה (הסיכום הקודם + התורות שיצאו מהחלון),
+3. הפרטים שכבר חולצו, כעובדות מובנות ("נעוצות") שלא תלויות בסיכום.
+
+הקיפול קורה באצוות: כשמעבר לחלון הצטברו CONTEXT_FOLD_TURNS תורות, כולם מקופלים לסיכום בקריאה אחת,
+כך שגודל הפרומפט נע בין החלון לחלון + אצווה, בלי קשר לאורך השיחה.
+הסיכום רץ ברקע, אחרי שהתשובה נשלחה: התור לא מחכה לו, והתוצאה מוחלת כשהיא מסתיימת (או בתחילת התור הבא).
+
+המצב (context) הוא מילון JSON שנשמר עם השיחה, כמו user_profile:
+    {"summary": טקסט הסיכום, "facts": {שדה: ערך}, "folded": כמה הודעות מתחילת ההיסטוריה כבר בסיכום}
+ובזמן קיפול ברקע גם "pending": {"key", "from", "to", "digest"} - המשימה, הטווח שהיא מקפלת,
+וטביעת האצבע של ההיסטוריה עד סופו.
+"""
+import os
+import json
+import asyncio
+import hashlib
+import logging
+import uuid
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+
+logger = logging.getLogger(__name__)
+
+CONTEXT_WINDOW_TURNS = int(os.getenv("CONTEXT_WINDOW_TURNS", "6"))
+CONTEXT_FOLD_TURNS = int(os.getenv("CONTEXT_FOLD_TURNS", "4"))
+CONTEXT_MAX_PENDING_FOLDS = int(os.getenv("CONTEXT_MAX_PENDING_FOLDS", "1000"))
+
+Summarizer = Callable[[str, Dict[str, str], List[Dict[str, str]]], Awaitable[Dict[str, Any]]]
+
+# קיפולים שרצים ברקע, או שהסתיימו ועוד לא הוחלו (נמחקים ב-adopt_fold), לפי pending["key"]
+_folds: "OrderedDict[str, asyncio.Task]" = OrderedDict()
+
+
+def new_context() -> Dict[str, Any]:
+    return {"summary": "", "facts": {}, "folded": 0}
+
+
+def checked_context(chat_history: List[Dict[str, str]], context: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """המצב השמור, או מצב ריק אם אין כזה או שאינו מתאים להיסטוריה (למשל לקוח /ask שהתחיל שיחה מחדש)"""
+    if not context or context.get("folded", 0) > len(chat_history):
+        return new_context()
+    checked = {"summary": context.get("summary", ""), "facts": dict(context.get("facts") or {}),
+               "folded": context.get("folded", 0)}
+    if context.get("pending"):
+        checked["pending"] = dict(context["pending"])
+    return checked
+
+
+def recent_messages(chat_history: List[Dict[str, str]], context: Optional[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """ההודעות שעוד לא בסיכום; לכל היותר חלון + אצווה, גם אם הקיפול מפגר (למשל אחרי קריאה שנכשלה)"""
+    context = checked_context(chat_history, context)
+    limit = 2 * (CONTEXT_WINDOW_TURNS + CONTEXT_FOLD_TURNS)
+    return chat_history[context["folded"]:][-limit:]
+
+
+def context_messages(context: Optional[Dict[str, Any]]) -> List[Dict[str, str]]:
+    """הודעות system עם העובדות הנעוצות והסיכום, לפני ההודעות האחרונות"""
+    messages = []
+    if context and context.get("facts"):
+        facts = json.dumps(context["facts"], ensure_ascii=False)
+        messages.append({"role": "system", "content": f"Details the user already provided (latest values): {facts}"})
+    if context and context.get("summary"):
+        messages.append({"role": "system", "content": f"Summary of the earlier conversation: {context['summary']}"})
+    return messages
+
+
+def conversation_text(chat_history: List[Dict[str, str]], context: Optional[Dict[str, Any]]) -> str:
+    """השיחה כטקסט לפרומפט החילוץ: עובדות, סיכום, ואז ההודעות האחרונות"""
+    lines = [f"{m['role']}: {m['content']}" for m in context_messages(checked_context(chat_history, context))]
+    lines += [f"{m['role']}: {m['content']}" for m in recent_messages(chat_history, context)]
+    return "\n".join(lines)
+
+
+def pin_facts(context: Dict[str, Any], facts: Dict[str, Any]) -> Dict[str, Any]:
+    """ערכים חדשים שאינם ריקים גוברים על הקודמים"""
+    pinned = dict(context["facts"])
+    pinned.update({key: str(value) for key, value in facts.items() if value not in (None, "")})
+    return {**context, "facts": pinned}
+
+
+def _digest(messages: List[Dict[str, str]]) -> str:
+    return hashlib.sha1(json.dumps(messages, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def _evict_finished() -> None:
+    """
+    מעל CONTEXT_MAX_PENDING_FOLDS - מוחק קיפולים שהסתיימו ולא הוחלו (שיחות שננטשו), מהישן לחדש.
+    קיפול שעוד רץ לא נמחק ולא מבוטל: הקריאה למודל כבר שולמה, והשיחה שלו עוד תחיל אותו.
+    """
+    for key in [key for key, task in _folds.items() if task.done()]:
+        if len(_folds) <= CONTEXT_MAX_PENDING_FOLDS:
+            break
+        del _folds[key]
+
+
+async def _fold(summarize: Summarizer, context: Dict[str, Any],
+                messages: List[Dict[str, str]]) -> Optional[Dict[str, Any]]:
+    try:
+        result = await summarize(context["summary"], context["facts"], messages)
+    except Exception as e:
+        logger.warning(f"Conversation summary failed, keeping {len(messages)} unsummarized messages: {e}")
+        return None
+    logger.info(f"Folded {len(messages)} messages into the conversation summary "
+                f"({len(result.get('summary', ''))} chars, {len(result.get('facts') or {})} new facts)")
+    return result
+
+
+def pending_fold(context: Optional[Dict[str, Any]]) -> Optional[asyncio.Task]:
+    """המשימה שמקפלת ברקע את המצב הזה, אם יש"""
+    pending = (context or {}).get("pending")
+    return _folds.get(pending["key"]) if pending else None
+
+
+def adopt_fold(chat_history: List[Dict[str, str]], context: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    מחיל על המצב קיפול שהסתיים ברקע. קיפול שעוד רץ נשאר ממתין (בינתיים recent_messages חוסם את הפרומפט);
+    קיפול שנכשל, שאינו מוכר (למשל אחרי הפעלה מחדש) או שאינו מתאים להיסטוריה - נזנח, וינוסה שוב בסוף התור.
+    """
+    context = checked_context(chat_history, context)
+    pending = context.get("pending")
+    if not pending:
+        return context
+    task = _folds.get(pending["key"])
+    if task is not None and not task.done():
+        return context
+
+    del context["pending"]
+    _folds.pop(pending["key"], None)
+    result = task.result() if task is not None and not task.cancelled() else None
+    if not result or context["folded"] != pending["from"] or _digest(chat_history[:pending["to"]]) != pending["digest"]:
+        return context
+    return pin_facts({**context, "summary": result.get("summary", context["summary"]), "folded": pending["to"]},
+                     result.get("facts") or {})
+
+
+def update_context(chat_history: List[Dict[str, str]], context: Optional[Dict[str, Any]],
+                   summarize: Optional[Summarizer] = None,
+                   facts: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """
+    נקרא בסוף כל תור. מחיל קיפול שהסתיים, נועץ את facts אם נמסרו, ואם מעבר לחלון הצטברה אצווה -
+    מתחיל לקפל אותה ברקע בעזרת summarize(סיכום קודם, עובדות, הודעות) -> {"summary", "facts"}.
+    התור לא מחכה לסיכום; כישלון שלו נרשם ביומן, והקיפול ינוסה שוב בתור הבא.
+    """
+    context = adopt_fold(chat_history, context)
+    if facts:
+        context = pin_facts(context, facts)
+    if summarize is None or context.get("pending"):
+        return context
+
+    # חלון + אצווה שלמה שעוד לא בסיכום: מקפלים הכול חוץ מהחלון (CONTEXT_FOLD_TURNS תורות, או יותר אם הקיפול פיגר)
+    if len(chat_history) - context["folded"] < 2 * (CONTEXT_WINDOW_TURNS + CONTEXT_FOLD_TURNS):
+        return context
+
+    end = len(chat_history) - 2 * CONTEXT_WINDOW_TURNS
+    key = uuid.uuid4().hex
+    _folds[key] = asyncio.create_task(_fold(summarize, context, chat_history[context["folded"]:end]))
+    _evict_finished()
+    return {**context, "pending": {"key": key, "from": context["folded"], "to": end,
+                                   "digest": _digest(chat_history[:end])}}
@@ -0,0 +1,129 @@
+"""
+מטמון דו-שכבתי ל-embeddings של שאילתות.
+
+שכבה 1: LRU חסום בזיכרון התהליך.
+שכבה 2: קובץ SQLite על הדיסק (מצב WAL) ששורד הפעלה מחדש ומשותף בין workers.
+המפתח הוא הטקסט המנורמל יחד עם שם המודל.
+"""
+import os
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import List, Dict, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_cache_text(text: str) -> str:
+    text = unicodedata.normalize("NFC", text or "")
+    return " ".join(text.split()).lower()
+
+
+def cache_key(text: str, model: str) -> str:
+    return hashlib.sha256(f"{model}\n{normalize_cache_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """מטמון embeddings: LRU בזיכרון מעל SQLite על הדיסק"""
+
+    def __init__(self, max_size: int = 1024, db_path: Optional[str] = None):
+        self.max_size = max_size
+        self.db_path = db_path
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.db_path:
+            try:
+                self._connection()
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding disk cache disabled ({self.db_path}): {e}")
+                self.db_path = None
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            directory = os.path.dirname(self.db_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL)"
+            )
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def _remember(self, key: str, embedding: List[float]) -> None:
+        with self._lock:
+            self._memory[key] = embedding
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_size:
+                self._memory.popitem(last=False)
+
+    def get(self, text: str, model: str) -> Optional[List[float]]:
+        key = cache_key(text, model)
+
+        with self._lock:
+            embedding = self._memory.get(key)
+            if embedding is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return embedding
+
+        if self.db_path:
+            try:
+                row = self._connection().execute(
+                    "SELECT vector FROM embeddings WHERE key = ?", (key,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding disk cache read failed: {e}")
+                row = None
+
+            if row is not None:
+                embedding = np.frombuffer(row[0], dtype=np.float32).tolist()
+                self._remember(key, embedding)
+                with self._lock:
+                    self.disk_hits += 1
+                return embedding
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, text: str, model: str, embedding: List[float]) -> None:
+        key = cache_key(text, model)
+        self._remember(key, embedding)
+
+        if self.db_path:
+            vector = np.asarray(embedding, dtype=np.float32)
+            try:
+                conn = self._connection()
+                conn.execute(
+                    "INSERT OR REPLACE INTO embeddings (key, model, dim, vector) VALUES (?, ?, ?, ?)",
+                    (key, model, int(vector.shape[0]), vector.tobytes())
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Embedding disk cache write failed: {e}")
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            hits = self.memory_hits + self.disk_hits
+            total = hits + self.misses
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_ratio": round(hits / total, 4) if total else 0.0,
+                "memory_size": len(self._memory),
+            }
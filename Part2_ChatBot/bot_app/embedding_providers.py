@@ -0,0 +1,163 @@
+"""
+ספקי embeddings: ממשק אחיד לשאילתות ולבניית המאגר.
+
+    azure    - Azure OpenAI (text-embedding-ada-002), קריאת רשת לכל batch
+    local    - מודל sentence-embedding שמור בדיסק (sentence-transformers), רץ על CPU
+    hashing  - הטלת hashing של מילים ו-n-grams של תווים; מקומי, דטרמיניסטי ומתאים לבדיקות
+
+המאגר שומר את חתימת הספק (שם, מודל, מימד) כדי שלא יערבבו שאילתות ממרחב וקטורי אחר.
+"""
+import os
+import zlib
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Any, Optional
+import numpy as np
+from bot_app.lexical import tokenize
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingProvider:
+    name = ""
+
+    def __init__(self, model: str, dim: Optional[int] = None):
+        self.model = model
+        self.dim = dim
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        """גרסה אסינכרונית לשרת; ברירת המחדל מריצה את embed ב-thread כדי לא לחסום את ה-event loop"""
+        return await asyncio.to_thread(self.embed, texts)
+
+    @property
+    def cache_model(self) -> str:
+        """מזהה למפתח המטמון - שאילתה זהה אצל ספקים שונים היא embedding שונה"""
+        return self.model if self.name == "azure" else f"{self.name}:{self.model}"
+
+    def signature(self) -> Dict[str, Any]:
+        return {"provider": self.name, "model": self.model, "dim": self.dim}
+
+    def check_compatible(self, info: Optional[Dict[str, Any]], dim: int) -> None:
+        """מעלה ValueError אם מאגר נבנה בספק / מודל / מימד אחר"""
+        if self.dim and dim != self.dim:
+            raise ValueError(f"vector index has dimension {dim}, but provider {self.name} produces {self.dim}")
+        if info and (info.get("provider"), info.get("model")) != (self.name, self.model):
+            raise ValueError(
+                f"vector index was built with {info.get('provider')}/{info.get('model')}, "
+                f"but queries use {self.name}/{self.model}"
+            )
+
+
+class AzureEmbeddingProvider(EmbeddingProvider):
+    name = "azure"
+
+    def __init__(self, client, model: str = "text-embedding-ada-002", dim: int = 1536, async_client=None):
+        super().__init__(model, dim)
+        self.client = client
+        self.async_client = async_client
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        response = self.client.embeddings.create(
+            model=self.model,
+            input=list(texts)
+        )
+        return [item.embedding for item in response.data]
+
+    async def aembed(self, texts: List[str]) -> List[List[float]]:
+        if self.async_client is None:
+            return await super().aembed(texts)
+        response = await self.async_client.embeddings.create(
+            model=self.model,
+            input=list(texts)
+        )
+        return [item.embedding for item in response.data]
+
+
+class _PooledProvider(EmbeddingProvider):
+    """ספק מקומי: מחלק את הקלט ל-batches ומריץ אותם במקביל ב-thread pool"""
+
+    def __init__(self, model: str, dim: Optional[int], batch_size: int = 64, workers: int = 4):
+        super().__init__(model, dim)
+        self.batch_size = batch_size
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"{self.name}-embed")
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        texts = list(texts)
+        if len(texts) <= self.batch_size:
+            return self._embed_batch(texts).tolist()
+
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        result = []
+        for vectors in self._pool.map(self._embed_batch, batches):
+            result.extend(vectors.tolist())
+        return result
+
+
+class HashingEmbeddingProvider(_PooledProvider):
+    name = "hashing"
+
+    def __init__(self, dim: int = 512, ngram: int = 3, batch_size: int = 64, workers: int = 4):
+        super().__init__(f"hashing-{dim}-{ngram}gram", dim, batch_size, workers)
+        self.ngram = ngram
+
+    def _features(self, text: str) -> List[str]:
+        words = tokenize(text)
+        features = list(words)
+        for word in words:
+            padded = f"<{word}>"
+            features.extend(padded[i:i + self.ngram] for i in range(len(padded) - self.ngram + 1))
+        return features
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = {}
+            for feature in self._features(text):
+                counts[feature] = counts.get(feature, 0) + 1
+            for feature, count in counts.items():
+                h = zlib.crc32(feature.encode("utf-8"))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                vectors[row, h % self.dim] += sign * (1.0 + np.log(count))
+
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+
+class SentenceTransformerProvider(_PooledProvider):
+    name = "local"
+
+    def __init__(self, model_path: str, batch_size: int = 64, workers: int = 2):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError as e:
+            raise ImportError("EMBEDDING_PROVIDER=local requires the sentence-transformers package") from e
+
+        self._model = SentenceTransformer(model_path, device="cpu")
+        super().__init__(os.path.basename(os.path.normpath(model_path)),
+                         self._model.get_sentence_embedding_dimension(), batch_size, workers)
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        return self._model.encode(texts, batch_size=len(texts), convert_to_numpy=True,
+                                  normalize_embeddings=True).astype(np.float32)
+
+
+def create_provider(name: str, client=None, async_client=None) -> EmbeddingProvider:
+    """יוצר ספק לפי שם (משתני סביבה EMBEDDING_PROVIDER, EMBEDDING_MODEL_PATH, HASHING_EMBEDDING_DIM)"""
+    if name == "azure":
+        return AzureEmbeddingProvider(client, async_client=async_client)
+    if name == "hashing":
+        return HashingEmbeddingProvider(dim=int(os.getenv("HASHING_EMBEDDING_DIM", "512")))
+    if name == "local":
+        model_path = os.getenv("EMBEDDING_MODEL_PATH")
+        if not model_path:
+            raise ValueError("EMBEDDING_PROVIDER=local requires EMBEDDING_MODEL_PATH")
+        return SentenceTransformerProvider(model_path)
+    raise ValueError(f"unknown embedding provider {name}, expected azure / local / hashing")
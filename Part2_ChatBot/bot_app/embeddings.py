@@ -1,43 +1,276 @@
-import json
 import numpy as np
 import openai
 import os
+import asyncio
+import logging
+import threading
 from dotenv import load_dotenv
+from bot_app.vector_index import VectorIndex
+from bot_app.vector_store import is_vector_store, read_manifest
+from bot_app.embedding_cache import EmbeddingCache
+from bot_app.embedding_providers import create_provider
 
 project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 env_path = os.path.join(project_root, ".env")
 load_dotenv(dotenv_path=env_path)
 
-client = openai.AzureOpenAI(
-    api_key=os.getenv("AZURE_OPENAI_API_KEY"),
-    api_version="2024-02-01",
-    azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
-)
+logger = logging.getLogger(__name__)
 
 VECTORS_FILE = "saved_vectors/vectors.json"
+VECTOR_STORE_ROOT = "saved_vectors"
+VECTOR_STORE_DIR = "saved_vectors/store"  # מאגר ללא גרסאות (לפני manifest.json)
+INDEX_RELOAD_INTERVAL = float(os.getenv("INDEX_RELOAD_INTERVAL", "5"))
+EMBEDDING_CACHE_FILE = "saved_vectors/embedding_cache.sqlite"
+EMBEDDING_CACHE_SIZE = 1024
+
+# exact - תמיד חיפוש מדויק; ivf - שימוש באינדקס IVF אם נבנה; auto - IVF רק מ-VECTOR_INDEX_ANN_MIN_ROWS שורות
+VECTOR_INDEX_MODE = os.getenv("VECTOR_INDEX_MODE", "auto")
+VECTOR_INDEX_ANN_MIN_ROWS = int(os.getenv("VECTOR_INDEX_ANN_MIN_ROWS", "20000"))
+VECTOR_INDEX_NPROBE = int(os.getenv("VECTOR_INDEX_NPROBE", "8"))
+
+# קודים דחוסים (int8 / PQ) אם נבנו; RERANK_FACTOR * top_k מועמדים מדורגים מחדש מול הוקטורים המלאים
+VECTOR_INDEX_QUANTIZED = os.getenv("VECTOR_INDEX_QUANTIZED", "1") == "1"
+VECTOR_INDEX_RERANK_FACTOR = int(os.getenv("VECTOR_INDEX_RERANK_FACTOR", "10"))
+
+# חיפוש היברידי: מיזוג BM25 עם החיפוש הוקטורי, ומסלול מהיר ללא embedding כששם השירות חד-משמעי
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+LEXICAL_FAST_PATH = os.getenv("LEXICAL_FAST_PATH", "1") == "1"
+LEXICAL_WEIGHT = float(os.getenv("LEXICAL_WEIGHT", "1.0"))
+HYBRID_CANDIDATES = 20
+
+# תשובה ישירה מטבלת ההטבות כשהשאלה מזכירה שירות אחד
+BENEFITS_LOOKUP = os.getenv("BENEFITS_LOOKUP", "1") == "1"
+
+# azure / local / hashing - ראו bot_app/embedding_providers.py
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "azure")
+
+def azure_clients():
+    """
+    לקוח סינכרוני לבניית המאגר ולקוח אסינכרוני לשאילתות מהשרת.
+    נוצרים רק לספק azure, כך שהספקים המקומיים רצים בלי מפתחות של Azure.
+    """
+    settings = dict(
+        api_key=os.getenv("AZURE_OPENAI_API_KEY"),
+        api_version="2024-02-01",
+        azure_endpoint=os.getenv("AZURE_OPENAI_ENDPOINT")
+    )
+    return openai.AzureOpenAI(**settings), openai.AsyncAzureOpenAI(**settings)
+
+client, async_client = azure_clients() if EMBEDDING_PROVIDER == "azure" else (None, None)
+embedding_provider = create_provider(EMBEDDING_PROVIDER, client=client, async_client=async_client)
+
+embedding_cache = EmbeddingCache(max_size=EMBEDDING_CACHE_SIZE, db_path=EMBEDDING_CACHE_FILE)
+
+_vector_index = None
+_vector_index_version = None
+_vector_index_lock = threading.Lock()
 
 def cosine_similarity(vec1, vec2):
     v1 = np.array(vec1)
     v2 = np.array(vec2)
     return np.dot(v1, v2) / (np.linalg.norm(v1) * np.linalg.norm(v2))
 
-def get_embedding(text):
-    response = client.embeddings.create(
-        model="text-embedding-ada-002",
-        input=[text]
-    )
-    return response.data[0].embedding
+# בקשות embedding שבדרך, לפי (מודל, טקסט): הסיווג והשליפה של אותה הודעה חולקים קריאת API אחת
+_inflight_embeddings = {}
+
+def _forget_inflight(key, task):
+    _inflight_embeddings.pop(key, None)
+    if not task.cancelled():
+        task.exception()  # גם אם כל הממתינים בוטלו, החריגה לא תירשם כ"לא נקראה"
+
+async def get_embedding(text, use_cache=True):
+    if not use_cache:
+        return await _get_embedding(text, use_cache=False)
+    key = (embedding_provider.cache_model, text)
+    task = _inflight_embeddings.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_get_embedding(text))
+        _inflight_embeddings[key] = task
+        task.add_done_callback(lambda t: _forget_inflight(key, t))
+    # ביטול של ממתין אחד לא מבטל את הבקשה עבור האחרים
+    return await asyncio.shield(task)
+
+async def _get_embedding(text, use_cache=True):
+    # המטמון קורא וכותב SQLite, ולכן רץ ב-thread מחוץ ל-event loop
+    cache_model = embedding_provider.cache_model
+    if use_cache:
+        cached = await asyncio.to_thread(embedding_cache.get, text, cache_model)
+        if cached is not None:
+            return cached
+
+    embedding = (await embedding_provider.aembed([text]))[0]
+
+    if use_cache:
+        await asyncio.to_thread(embedding_cache.put, text, cache_model, embedding)
+    return embedding
+
+def _cached_embeddings(texts, cache_model):
+    return [embedding_cache.get(text, cache_model) for text in texts]
+
+def _cache_embeddings(texts, cache_model, embeddings):
+    for text, embedding in zip(texts, embeddings):
+        embedding_cache.put(text, cache_model, embedding)
+
+async def get_embeddings(texts, use_cache=True):
+    """embeddings לכמה טקסטים בקריאת API אחת (רק לטקסטים שאינם במטמון)"""
+    cache_model = embedding_provider.cache_model
+    if use_cache:
+        embeddings = await asyncio.to_thread(_cached_embeddings, texts, cache_model)
+    else:
+        embeddings = [None] * len(texts)
+    missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+
+    if missing:
+        computed = await embedding_provider.aembed([texts[i] for i in missing])
+        for i, embedding in zip(missing, computed):
+            embeddings[i] = embedding
+        if use_cache:
+            await asyncio.to_thread(_cache_embeddings, [texts[i] for i in missing], cache_model, computed)
+
+    return embeddings
+
+def _load_vector_index():
+    manifest = read_manifest(VECTOR_STORE_ROOT)
+    if manifest:
+        index = VectorIndex.from_store(os.path.join(VECTOR_STORE_ROOT, manifest["path"]))
+        version = manifest["version"]
+    elif is_vector_store(VECTOR_STORE_DIR):
+        index = VectorIndex.from_store(VECTOR_STORE_DIR)
+        version = "store"
+    else:
+        index = VectorIndex.from_json(VECTORS_FILE)
+        version = "json"
+    configure_index(index)
+    return index, version
+
+def get_vector_index() -> VectorIndex:
+    """טוען את האינדקס פעם אחת לכל תהליך ומחזיר את אותו מופע בכל קריאה"""
+    global _vector_index, _vector_index_version
+    if _vector_index is None:
+        with _vector_index_lock:
+            if _vector_index is None:
+                _vector_index, _vector_index_version = _load_vector_index()
+    return _vector_index
+
+def get_index_version():
+    return _vector_index_version
+
+def reload_vector_index_if_changed() -> bool:
+    """
+    טוען גרסה חדשה שפורסמה ב-manifest.json ומחליף את ההפניה לאינדקס הפעיל.
+    הטעינה נעשית מחוץ לנעילה, כך שבקשות שכבר רצות ממשיכות עם האינדקס הקודם.
+    """
+    global _vector_index, _vector_index_version
+    manifest = read_manifest(VECTOR_STORE_ROOT)
+    if not manifest or manifest["version"] == _vector_index_version:
+        return False
+
+    index = VectorIndex.from_store(os.path.join(VECTOR_STORE_ROOT, manifest["path"]))
+    configure_index(index)
+    with _vector_index_lock:
+        previous = _vector_index_version
+        _vector_index, _vector_index_version = index, manifest["version"]
+    logger.info(f"Vector index swapped: {previous} -> {manifest['version']} ({len(index)} vectors)")
+    return True
+
+def start_index_reloader(interval=None) -> threading.Event:
+    """מריץ ברקע בדיקה תקופתית של manifest.json; מחזיר Event לעצירה"""
+    stop = threading.Event()
+    interval = interval or INDEX_RELOAD_INTERVAL
+
+    def run():
+        while not stop.wait(interval):
+            try:
+                reload_vector_index_if_changed()
+            except Exception:
+                logger.error("Vector index reload failed", exc_info=True)
+
+    threading.Thread(target=run, name="vector-index-reloader", daemon=True).start()
+    return stop
+
+def configure_index(index: VectorIndex) -> None:
+    embedding_provider.check_compatible(index.embedding_info, index.dim)
+    if VECTOR_INDEX_MODE == "exact" or (VECTOR_INDEX_MODE == "auto" and len(index) < VECTOR_INDEX_ANN_MIN_ROWS):
+        index.ann = None
+    index.nprobe = VECTOR_INDEX_NPROBE
+    if not VECTOR_INDEX_QUANTIZED:
+        index.quantizer = None
+    index.rerank_factor = VECTOR_INDEX_RERANK_FACTOR
+
+def reset_vector_index():
+    global _vector_index, _vector_index_version
+    with _vector_index_lock:
+        _vector_index = None
+        _vector_index_version = None
+
+def lexical_chunks(question, top_k=3, hmo=None, tier=None):
+    """הקטעים מהמסלול הלקסיקלי המהיר (בלי embedding), או None אם השאלה לא מזכירה שירות אחד"""
+    if not LEXICAL_FAST_PATH:
+        return None
+    index = get_vector_index()
+    results = index.lexical_fast_path(question, top_k, hmo=hmo, tier=tier)
+    if results is None:
+        return None
+    logger.info(f"Lexical fast path answered '{question}' without an embedding call")
+    return [index.texts[row] for _, row in results]
+
+async def find_similar_chunks(question, top_k=3, hmo=None, tier=None, fast_path=True):
+    """
+    מחזיר את top_k הקטעים הדומים לשאלה.
+    hmo / tier מצמצמים את החיפוש למחיצה של הקופה ורמת הביטוח (בתוספת קטעים כלליים).
+    fast_path=False - המסלול הלקסיקלי כבר נוסה (lexical_chunks) ולא נבדק שוב.
+    """
+    index = get_vector_index()
+
+    if fast_path:
+        chunks = lexical_chunks(question, top_k, hmo=hmo, tier=tier)
+        if chunks is not None:
+            return chunks
+
+    question_emb = await get_embedding(question)
+    # מכפלת המטריצות (וקריאת הוקטורים המלאים לדירוג מחדש) ב-thread, מחוץ ל-event loop
+    return await asyncio.to_thread(_search_chunks, index, question, question_emb, top_k, hmo, tier)
+
+def _search_chunks(index, question, question_emb, top_k, hmo, tier):
+    if not HYBRID_SEARCH:
+        return [index.texts[row] for _, row in index.search(question_emb, top_k, hmo=hmo, tier=tier)]
+
+    results = index.search(question_emb, max(top_k, HYBRID_CANDIDATES), hmo=hmo, tier=tier)
+    results = index.fuse(results, question, top_k, hmo=hmo, tier=tier, lexical_weight=LEXICAL_WEIGHT)
+    return [index.texts[row] for _, row in results]
+
+def lookup_benefit(question, hmo=None, tier=None):
+    """
+    חיפוש ישיר בטבלת ההטבות לפי הקופה והרמה של המשתמש, בלי embedding.
+    מחזיר מילון (service, category, hmo, tier, benefit), או None כשאין טבלה או שההתאמה דו-משמעית.
+    """
+    if not BENEFITS_LOOKUP:
+        return None
+    table = get_vector_index().benefits
+    if table is None:
+        return None
+    return table.answer(question, hmo, tier)
 
-def find_similar_chunks(question, top_k=3):
-    question_emb = get_embedding(question)
+async def find_similar_chunks_batch(queries, top_k=3, hmo=None, tier=None):
+    """
+    חיפוש של כמה שאילתות יחד: קריאת embeddings אחת ומכפלת מטריצות אחת.
+    מחזיר את תוצאות כל השאילתות ממוזגות, ללא כפילויות, מהציון הגבוה לנמוך.
+    """
+    if not queries:
+        return []
 
-    with open(VECTORS_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
+    query_embs = await get_embeddings(list(queries))
+    return await asyncio.to_thread(_search_chunks_batch, get_vector_index(), list(queries), query_embs, top_k, hmo, tier)
 
-    similarities = []
-    for item in data:
-        score = cosine_similarity(question_emb, item["embedding"])
-        similarities.append((score, item["text"]))
+def _search_chunks_batch(index, queries, query_embs, top_k, hmo, tier):
+    candidates = max(top_k, HYBRID_CANDIDATES) if HYBRID_SEARCH else top_k
+    best = {}
+    for query, results in zip(queries, index.search_batch(query_embs, candidates, hmo=hmo, tier=tier)):
+        if HYBRID_SEARCH:
+            results = index.fuse(results, query, top_k, hmo=hmo, tier=tier, lexical_weight=LEXICAL_WEIGHT)
+        for score, row in results:
+            if row not in best or score > best[row]:
+                best[row] = score
 
-    top_chunks = sorted(similarities, key=lambda x: x[0], reverse=True)[:top_k]
-    return [text for _, text in top_chunks]
+    ranked = sorted(best.items(), key=lambda x: x[1], reverse=True)
+    return [index.texts[row] for row, _ in ranked]
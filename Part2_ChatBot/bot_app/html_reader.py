@@ -1,14 +1,31 @@
 import os
-import json
+import sys
+import time
+import random
+import hashlib
 import logging
-from typing import List, Dict, Any, Optional
+import openai
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from typing import List, Dict, Any, Optional, Union, Iterator, Tuple
 from dataclasses import dataclass
-from bs4 import BeautifulSoup
-from bot_app.embeddings import get_embedding
+from bs4 import BeautifulSoup, Tag, NavigableString, CData
+from bot_app.embeddings import embedding_provider
+from bot_app.embedding_providers import EmbeddingProvider
+from bot_app.vector_store import publish_vector_store, read_manifest, load_vector_store
+from bot_app.ann import default_nlist
+from bot_app.ingest_checkpoint import IngestCheckpoint
+from bot_app.benefits import BenefitsTable
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+try:
+    import lxml  # noqa: F401
+    DEFAULT_HTML_PARSER = "lxml"
+except ImportError:
+    DEFAULT_HTML_PARSER = "html.parser"
+
 @dataclass
 class ChunkMetadata:
     """מטא-דאטה של קטע טקסט"""
@@ -19,18 +36,37 @@ class ChunkMetadata:
     insurance_level: str = ""
     source_file: str = ""
     chunk_type: str = ""  # paragraph, list_item, table_cell, etc.
+    content_hash: str = ""  # hash של הטקסט ומודל ה-embedding, לשימוש חוזר ב-embeddings
 
 class Config:
     HTML_DIR = "phase2_data"
-    OUT_FILE = "saved_vectors/vectors.json"
+    HTML_PARSER = DEFAULT_HTML_PARSER  # lxml אם מותקן, אחרת html.parser
+    EXTRACT_WORKERS = os.cpu_count() or 1  # תהליכים לחילוץ קבצים במקביל; 1 = סדרתי
+    EXTRACT_PARALLEL_MIN_FILES = 8  # מתחת לזה תקורת התהליכים גדולה מהרווח
+    OUT_ROOT = "saved_vectors"  # גרסאות תחת versions/ ו-manifest.json
+    STORE_DTYPE = "float32"  # float32 / float16
+    ANN_MODE = "auto"  # auto (IVF from ANN_MIN_ROWS chunks) / ivf / none
+    ANN_MIN_ROWS = 20000
+    ANN_NLIST = 0  # 0 = 4*sqrt(N)
+    QUANTIZATION = "none"  # none / int8 / pq
+    PQ_SUBVECTORS = 96  # 1536 / 96 = 16 מימדים לכל תת-וקטור
+    INCREMENTAL = True  # שימוש חוזר ב-embeddings מהגרסה הקודמת לקטעים שלא השתנו
+    PUBLISH_UNCHANGED = False  # לפרסם גרסה חדשה גם כשהתוכן לא השתנה (למשל אחרי שינוי QUANTIZATION)
+    INGEST_DIR = "ingest"  # נקודות שמירה של ריצה שלא הושלמה, תחת OUT_ROOT
+    RESUME = True  # להמשיך מנקודת השמירה של ריצה שנקטעה במקום לשלם שוב על embeddings
     CHUNK_MIN_LEN = 20
     BATCH_SIZE = 100  
+    EMBEDDING_CONCURRENCY = 4  # מספר batches שנשלחים במקביל
+    MAX_RETRIES = 6
+    BACKOFF_BASE = 1.0  # שניות; מוכפל בכל ניסיון
+    BACKOFF_MAX = 60.0
     MAX_CHUNK_LEN = 1000  
 
 class ImprovedVectorGenerator:
     
-    def __init__(self, config: Config = None):
+    def __init__(self, config: Config = None, provider: EmbeddingProvider = None):
         self.config = config or Config()
+        self.provider = provider or embedding_provider
         
     def clean_text(self, text: str) -> str:
         if not text:
@@ -43,21 +79,37 @@ class ImprovedVectorGenerator:
             
         return text.strip()
     
-    def extract_insurance_info(self, cell_content: str) -> Dict[str, str]:
+    def extract_insurance_info(self, cell: Union[Tag, str]) -> Dict[str, str]:
+        """
+        מעבר אחד על צאצאי התא: הטקסט של כל רמה הוא כל הטקסט שאחרי <strong>רמה:</strong>
+        ועד ה-<strong> הבא (או סוף התא). תא שמגיע כמחרוזת HTML מפוענח פעם אחת.
+        """
+        if isinstance(cell, str):
+            cell = BeautifulSoup(cell, self.config.HTML_PARSER)
+
         levels = {"זהב": "", "כסף": "", "ארד": ""}
-        
-        for level in levels.keys():
-            if f"<strong>{level}:</strong>" in cell_content:
-                start = cell_content.find(f"<strong>{level}:</strong>") + len(f"<strong>{level}:</strong>")
-                end = cell_content.find("<br>", start)
-                if end == -1:
-                    end = cell_content.find(f"<strong>", start)
-                if end == -1:
-                    end = len(cell_content)
-                
-                level_text = cell_content[start:end].strip()
-                levels[level] = self.clean_text(BeautifulSoup(level_text, "html.parser").get_text())
-        
+        parts = {}
+        current = None
+        skip = 0
+
+        for node in cell.descendants:
+            if skip:
+                skip -= 1
+                continue
+            if isinstance(node, Tag):
+                if node.name == "strong":
+                    label = node.get_text()
+                    level = label[:-1] if label.endswith(":") else ""
+                    current = level if level in levels and level not in parts and not node.attrs else None
+                    if current:
+                        parts[current] = []
+                    skip = sum(1 for _ in node.descendants)
+                continue
+            if current and type(node) in (NavigableString, CData):
+                parts[current].append(str(node))
+
+        for level, texts in parts.items():
+            levels[level] = self.clean_text("".join(texts))
         return levels
     
     def create_structured_chunk(self, text: str, metadata: ChunkMetadata) -> str:
@@ -103,8 +155,7 @@ class ImprovedVectorGenerator:
                 if i >= len(cells):
                     continue
                     
-                cell_html = str(cells[i])
-                insurance_levels = self.extract_insurance_info(cell_html)
+                insurance_levels = self.extract_insurance_info(cells[i])
                 
                 for level, details in insurance_levels.items():
                     if details and len(details) >= self.config.CHUNK_MIN_LEN:
@@ -157,7 +208,7 @@ class ImprovedVectorGenerator:
     def extract_chunks_with_enhanced_context(self, file_path: str, filename: str = None) -> List[Dict[str, Any]]:
         try:
             with open(file_path, "r", encoding="utf-8") as f:
-                soup = BeautifulSoup(f, "html.parser")
+                soup = BeautifulSoup(f, self.config.HTML_PARSER)
         except Exception as e:
             logger.error(f"שגיאה בקריאת קובץ {file_path}: {e}")
             return []
@@ -165,6 +216,7 @@ class ImprovedVectorGenerator:
         chunks = []
         current_heading = ""
         current_subheading = ""
+        last_h3 = None  # ה-h3 האחרון שנראה עד כה (במקום find_previous לכל רשימה)
 
         for elem in soup.find_all(["h2", "h3", "h4", "p", "ul", "ol", "table"]):
             try:
@@ -174,6 +226,8 @@ class ImprovedVectorGenerator:
                     
                 elif elem.name in ["h3", "h4"]:
                     current_subheading = self.clean_text(elem.get_text())
+                    if elem.name == "h3":
+                        last_h3 = elem.get_text()
 
                 elif elem.name == "p":
                     text = self.clean_text(elem.get_text())
@@ -192,9 +246,11 @@ class ImprovedVectorGenerator:
                         })
 
                 elif elem.name in ["ul", "ol"]:
-                    parent_h3 = elem.find_previous("h3")
-                    if parent_h3 and any(keyword in parent_h3.get_text() for keyword in ["טלפון", "פרטים", "יצירת קשר"]):
-                        chunks.extend(self.extract_contact_info(elem, current_heading))
+                    if last_h3 and any(keyword in last_h3 for keyword in ["טלפון", "פרטים", "יצירת קשר"]):
+                        contact_chunks = self.extract_contact_info(elem, current_heading)
+                        for chunk in contact_chunks:
+                            chunk["metadata"]["source_file"] = filename or ""
+                        chunks.extend(contact_chunks)
                     else:
                         for li in elem.find_all("li"):
                             li_text = self.clean_text(li.get_text())
@@ -225,68 +281,353 @@ class ImprovedVectorGenerator:
         logger.info(f"חולצו {len(chunks)} קטעים מקובץ {filename}")
         return chunks
 
+    def iter_extracted(self, filenames: List[str]) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """
+        מחזיר (שם קובץ, קטעים) לפי הסדר. כשיש מספיק קבצים החילוץ רץ בתהליכים נפרדים,
+        ולכל היותר 2 x workers קבצים ממתינים בזיכרון לצרכן.
+        """
+        jobs = [(self.config, os.path.join(self.config.HTML_DIR, f), f) for f in filenames]
+        workers = min(self.config.EXTRACT_WORKERS, len(jobs))
+        if workers <= 1 or len(jobs) < self.config.EXTRACT_PARALLEL_MIN_FILES:
+            for job in jobs:
+                yield job[2], _extract_file(job)
+            return
+
+        logger.info(f"מחלץ {len(jobs)} קבצים ב-{workers} תהליכים ({self.config.HTML_PARSER})")
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            pending = deque()
+            for job in jobs:
+                pending.append((job[2], pool.submit(_extract_file, job)))
+                if len(pending) >= workers * 2:
+                    filename, future = pending.popleft()
+                    yield filename, future.result()
+            while pending:
+                filename, future = pending.popleft()
+                yield filename, future.result()
+
+    def extract_files(self, filenames: List[str]) -> List[List[Dict[str, Any]]]:
+        """חילוץ קטעים מכל הקבצים; הסדר נשמר"""
+        return [chunks for _, chunks in self.iter_extracted(filenames)]
+
+    @staticmethod
+    def is_retryable(error: Exception) -> bool:
+        if isinstance(error, (openai.APIConnectionError, openai.APITimeoutError)):
+            return True
+        return getattr(error, "status_code", None) in (408, 409, 429, 500, 502, 503, 504)
+
+    @staticmethod
+    def retry_after(error: Exception) -> Optional[float]:
+        """זמן ההמתנה שהשרת ביקש (Retry-After / retry-after-ms), אם קיים"""
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        try:
+            if headers.get("retry-after-ms"):
+                return float(headers["retry-after-ms"]) / 1000
+            if headers.get("retry-after"):
+                return float(headers["retry-after"])
+        except ValueError:
+            pass
+        return None
+
+    def embed_with_retry(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """
+        שולח batch אחד לספק. שגיאות זמניות (429, 5xx, ניתוק) מנוסות שוב עם המתנה אקספוננציאלית
+        שמכבדת Retry-After. שגיאה קבועה מפצלת את ה-batch לחצאים כדי לבודד את הקטע הבעייתי;
+        קטע שנכשל סופית מוחזר כ-None.
+        """
+        for attempt in range(self.config.MAX_RETRIES + 1):
+            try:
+                return self.provider.embed(texts)
+            except Exception as e:
+                if not self.is_retryable(e):
+                    if len(texts) > 1:
+                        middle = len(texts) // 2
+                        return self.embed_with_retry(texts[:middle]) + self.embed_with_retry(texts[middle:])
+                    logger.error(f"שגיאה קבועה ביצירת embedding: {e}")
+                    return [None]
+                if attempt == self.config.MAX_RETRIES:
+                    logger.error(f"יצירת embedding נכשלה אחרי {attempt + 1} ניסיונות: {e}")
+                    return [None] * len(texts)
+
+                delay = self.retry_after(e)
+                if delay is None:
+                    delay = min(self.config.BACKOFF_MAX, self.config.BACKOFF_BASE * 2 ** attempt)
+                    delay *= random.uniform(0.5, 1.0)
+                logger.warning(f"שגיאה זמנית ({e.__class__.__name__}), ניסיון חוזר בעוד {delay:.1f} שניות")
+                time.sleep(delay)
+
     def process_embeddings_in_batches(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        embeddings ל-batches אמיתיים (קריאה אחת לכל batch), עם עד EMBEDDING_CONCURRENCY batches במקביל.
+        קטעים שנכשלו מנוסים שוב פעם נוספת בסוף; מה שנכשל גם אז מדווח ולא נכלל בתוצאה.
+        """
+        batches = [chunks[i:i + self.config.BATCH_SIZE] for i in range(0, len(chunks), self.config.BATCH_SIZE)]
+        embeddings = [None] * len(batches)
+
+        with ThreadPoolExecutor(max_workers=self.config.EMBEDDING_CONCURRENCY) as pool:
+            futures = {
+                pool.submit(self.embed_with_retry, [item["text"] for item in batch]): n
+                for n, batch in enumerate(batches)
+            }
+            for done, future in enumerate(as_completed(futures), 1):
+                embeddings[futures[future]] = future.result()
+                logger.info(f"מעבד batch {done}/{len(batches)}")
+
         result = []
-        
-        for i in range(0, len(chunks), self.config.BATCH_SIZE):
-            batch = chunks[i:i + self.config.BATCH_SIZE]
-            logger.info(f"מעבד batch {i//self.config.BATCH_SIZE + 1}/{(len(chunks)-1)//self.config.BATCH_SIZE + 1}")
-            
-            for item in batch:
-                try:
-                    embedding = get_embedding(item["text"])
+        failed = []
+        for batch, batch_embeddings in zip(batches, embeddings):
+            for item, embedding in zip(batch, batch_embeddings):
+                if embedding is None:
+                    failed.append(item)
+                else:
                     result.append({
                         "text": item["text"],
                         "embedding": embedding,
                         "metadata": item.get("metadata", {})
                     })
-                except Exception as e:
-                    logger.error(f"שגיאה ביצירת embedding: {e}")
-                    
+
+        if failed:
+            logger.warning(f"מנסה שוב {len(failed)} קטעים שנכשלו")
+            retried = []
+            for i in range(0, len(failed), self.config.BATCH_SIZE):
+                retried.extend(self.embed_with_retry([item["text"] for item in failed[i:i + self.config.BATCH_SIZE]]))
+
+            for item, embedding in zip(failed, retried):
+                if embedding is None:
+                    logger.error(f"לא נוצר embedding לקטע: {item['text'][:80]}")
+                    continue
+                result.append({
+                    "text": item["text"],
+                    "embedding": embedding,
+                    "metadata": item.get("metadata", {})
+                })
+
         return result
 
-    def generate_vectors(self) -> None:
+    def content_hash(self, text: str) -> str:
+        return hashlib.sha256(f"{self.provider.cache_model}\n{text}".encode("utf-8")).hexdigest()[:32]
+
+    @staticmethod
+    def chunk_identity(metadata: Dict[str, Any]) -> tuple:
+        """מיקום לוגי של קטע - משמש לזיהוי קטע ש"השתנה" לעומת קטע שנוסף"""
+        return tuple(metadata.get(field, "") for field in (
+            "source_file", "chunk_type", "category", "subcategory", "service_name", "hmo_name", "insurance_level"
+        ))
+
+    def load_previous_vectors(self):
+        """
+        טוען את הגרסה המפורסמת האחרונה: מילון hash -> embedding, רשימת המטא-דאטה שלה והטקסטים.
+        אם הגרסה נבנתה בספק embeddings אחר - אין שימוש חוזר ב-embeddings.
+        """
+        manifest = read_manifest(self.config.OUT_ROOT)
+        if not manifest:
+            return {}, [], []
+
+        try:
+            texts, metadata, matrix, header = load_vector_store(os.path.join(self.config.OUT_ROOT, manifest["path"]))
+        except Exception as e:
+            logger.warning(f"לא ניתן לקרוא את הגרסה הקודמת {manifest.get('version')}: {e}")
+            return {}, [], []
+
+        if header.get("embedding") != self.provider.signature():
+            logger.info("הגרסה הקודמת נבנתה בספק embeddings אחר - כל הקטעים יעברו embedding מחדש")
+            return {}, metadata, texts
+
+        previous = {}
+        for row, item in enumerate(metadata):
+            if item.get("content_hash"):
+                previous[item["content_hash"]] = matrix[row]
+        return previous, metadata, texts
+
+    @staticmethod
+    def previous_chunks_by_file(texts: List[str], metadata: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+        """הקטעים של הגרסה הקודמת לפי קובץ מקור, בסדר המקורי"""
+        by_file = {}
+        for text, item in zip(texts, metadata):
+            if item.get("source_file"):
+                by_file.setdefault(item["source_file"], []).append({"text": text, "metadata": dict(item)})
+        return by_file
+
+    def iter_file_chunks(self, html_files: List[str],
+                         reusable: Dict[str, List[Dict[str, Any]]]) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+        """קטעים לכל קובץ לפי הסדר: מהגרסה הקודמת אם הקובץ לא השתנה, אחרת חילוץ מחדש"""
+        extracted = self.iter_extracted([f for f in html_files if f not in reusable])
+        for filename in html_files:
+            if filename in reusable:
+                yield filename, reusable[filename]
+            else:
+                yield next(extracted)
+
+    def diff_report(self, previous_metadata: List[Dict[str, Any]], chunks: List[Dict[str, Any]]) -> Dict[str, int]:
+        """סופר קטעים שלא השתנו / נוספו / השתנו / הוסרו לעומת הגרסה הקודמת"""
+        previous_hashes = {m.get("content_hash") for m in previous_metadata}
+        current_hashes = {c["metadata"]["content_hash"] for c in chunks}
+
+        added = [c["metadata"] for c in chunks if c["metadata"]["content_hash"] not in previous_hashes]
+        removed = [m for m in previous_metadata if m.get("content_hash") not in current_hashes]
+
+        removed_identities = {}
+        for m in removed:
+            identity = self.chunk_identity(m)
+            removed_identities[identity] = removed_identities.get(identity, 0) + 1
+
+        changed = 0
+        for m in added:
+            identity = self.chunk_identity(m)
+            if removed_identities.get(identity):
+                removed_identities[identity] -= 1
+                changed += 1
+
+        return {
+            "unchanged": len(chunks) - len(added),
+            "added": len(added) - changed,
+            "changed": changed,
+            "removed": len(removed) - changed,
+        }
+
+    def build_benefits_table(self, texts: List[str], metadata: List[Dict[str, Any]]) -> BenefitsTable:
+        """טבלת ההטבות מתאי הטבלאות: טקסט ההטבה הוא מה שבא אחרי תגי המטא-דאטה בקטע"""
+        fields = set(ChunkMetadata.__dataclass_fields__)
+        rows = []
+        for text, m in zip(texts, metadata):
+            if m.get("chunk_type") != "table_cell":
+                continue
+            prefix = self.create_structured_chunk("", ChunkMetadata(**{k: v for k, v in m.items() if k in fields}))
+            if text.startswith(prefix):
+                rows.append((m.get("category", ""), m["service_name"], m["hmo_name"], m["insurance_level"], text[len(prefix):]))
+        return BenefitsTable.build(rows)
+
+    def embed_to_checkpoint(self, chunks: List[Dict[str, Any]], checkpoint: IngestCheckpoint) -> int:
+        """embeddings לחלון אחד של קטעים, נכתבים מיד ליומן נקודת השמירה"""
+        embedded = self.process_embeddings_in_batches(chunks)
+        checkpoint.append_embeddings(embedded)
+        return len(embedded)
+
+    def generate_vectors(self, touched: Optional[set] = None) -> bool:
+        """
+        צינור מוזרם: חילוץ קובץ אחר קובץ -> embeddings בחלונות של BATCH_SIZE x EMBEDDING_CONCURRENCY
+        שנכתבים ליומן append-only -> דחיסה למאגר ופרסום גרסה. בזיכרון נמצא רק החלון הנוכחי;
+        ריצה שנקטעה ממשיכה מנקודת השמירה בלי לשלם שוב על embeddings שכבר נוצרו.
+        touched - שמות הקבצים ששונו (מצב צפייה); שאר הקבצים לא מחולצים מחדש אלא נלקחים מהגרסה הקודמת.
+        מחזיר True אם המאגר המפורסם משקף עכשיו את הקבצים (גרסה פורסמה, או שאין שינוי בתוכן).
+        """
         if not os.path.exists(self.config.HTML_DIR):
             logger.error(f"תיקייה {self.config.HTML_DIR} לא קיימת")
-            return
+            return False
             
-        all_chunks = []
-        total_files = 0
-        
         html_files = [f for f in os.listdir(self.config.HTML_DIR) if f.endswith(".html")]
         logger.info(f"נמצאו {len(html_files)} קבצי HTML")
-        
-        for filename in html_files:
-            full_path = os.path.join(self.config.HTML_DIR, filename)
-            extracted = self.extract_chunks_with_enhanced_context(full_path, filename)
-            
-            if extracted:
-                all_chunks.extend(extracted)
+
+        previous, previous_metadata, previous_texts = self.load_previous_vectors() if self.config.INCREMENTAL else ({}, [], [])
+
+        reusable = {}
+        if touched is not None:
+            current_files = set(html_files)
+            reusable = {
+                filename: chunks
+                for filename, chunks in self.previous_chunks_by_file(previous_texts, previous_metadata).items()
+                if filename not in touched and filename in current_files
+            }
+            logger.info(f"מחלץ מחדש {len(html_files) - len(reusable)} קבצים, {len(reusable)} ללא שינוי")
+
+        ingest_dir = os.path.join(self.config.OUT_ROOT, self.config.INGEST_DIR)
+        checkpoint = IngestCheckpoint(ingest_dir, self.provider.signature())
+        if not self.config.RESUME:
+            checkpoint.discard()
+        checkpoint.open()
+
+        window = self.config.BATCH_SIZE * self.config.EMBEDDING_CONCURRENCY
+        current_metadata = []
+        pending = []
+        queued = set()
+        total_files = 0
+        embedded = 0
+
+        try:
+            for filename, extracted in self.iter_file_chunks(html_files, reusable):
+                if not extracted:
+                    logger.warning(f"לא חולצו נתונים מקובץ {filename}")
+                    continue
                 total_files += 1
-            else:
-                logger.warning(f"לא חולצו נתונים מקובץ {filename}")
 
-        if not all_chunks:
+                for chunk in extracted:
+                    content_hash = self.content_hash(chunk["text"])
+                    chunk["metadata"]["content_hash"] = content_hash
+                    checkpoint.append_chunk(chunk)
+                    current_metadata.append(chunk["metadata"])
+
+                    if content_hash in previous or content_hash in checkpoint or content_hash in queued:
+                        continue
+                    queued.add(content_hash)
+                    pending.append(chunk)
+                    if len(pending) >= window:
+                        embedded += self.embed_to_checkpoint(pending, checkpoint)
+                        pending = []
+
+            if pending:
+                embedded += self.embed_to_checkpoint(pending, checkpoint)
+        finally:
+            checkpoint.close()
+
+        if not current_metadata:
             logger.error("לא נמצאו נתונים לעיבוד")
-            return
+            return False
             
-        logger.info(f"סה\"כ חולצו {len(all_chunks)} קטעים מ-{total_files} קבצים")
-        
-        logger.info("מתחיל יצירת embeddings...")
-        result = self.process_embeddings_in_batches(all_chunks)
-        
-        os.makedirs(os.path.dirname(self.config.OUT_FILE), exist_ok=True)
-        
+        logger.info(f"סה\"כ חולצו {len(current_metadata)} קטעים מ-{total_files} קבצים")
+        logger.info(
+            f"embeddings: {embedded} נוצרו עכשיו, {checkpoint.embedding_count - embedded} מנקודת שמירה, "
+            f"השאר נלקחו מהגרסה הקודמת"
+        )
+
+        if previous_metadata:
+            report = self.diff_report(previous_metadata, [{"metadata": m} for m in current_metadata])
+            logger.info(
+                f"השוואה לגרסה הקודמת: {report['unchanged']} ללא שינוי, {report['added']} נוספו, "
+                f"{report['changed']} השתנו, {report['removed']} הוסרו"
+            )
+            unchanged = not (report["added"] or report["changed"] or report["removed"])
+            if previous and unchanged and not self.config.PUBLISH_UNCHANGED:
+                logger.info("✅ אין שינויים בתוכן - לא מפורסמת גרסה חדשה")
+                checkpoint.discard()
+                return True
+
+        texts, metadata, matrix = checkpoint.compact(previous, os.path.join(ingest_dir, "matrix.npy"))
+        if matrix is None:
+            logger.error("לא נוצרו embeddings לאף קטע")
+            return False
+
+        ivf_nlist = 0
+        if self.config.ANN_MODE == "ivf" or (self.config.ANN_MODE == "auto" and len(texts) >= self.config.ANN_MIN_ROWS):
+            ivf_nlist = self.config.ANN_NLIST or default_nlist(len(texts))
+            logger.info(f"בונה אינדקס IVF עם {ivf_nlist} רשימות")
+
+        benefits = self.build_benefits_table(texts, metadata)
+        logger.info(f"טבלת הטבות: {len(benefits.services)} שירותים, {len(benefits)} תאים")
+
         try:
-            with open(self.config.OUT_FILE, "w", encoding="utf-8") as f:
-                json.dump(result, f, ensure_ascii=False, indent=2)
+            manifest = publish_vector_store(
+                self.config.OUT_ROOT,
+                texts,
+                metadata,
+                matrix,
+                dtype=self.config.STORE_DTYPE,
+                ivf_nlist=ivf_nlist,
+                quantization=None if self.config.QUANTIZATION == "none" else self.config.QUANTIZATION,
+                pq_m=self.config.PQ_SUBVECTORS,
+                embedding_info=self.provider.signature(),
+                benefits=benefits
+            )
             
-            logger.info(f"✅ הושלם בהצלחה: {len(result)} וקטורים נשמרו ל-{self.config.OUT_FILE}")
+            logger.info(f"✅ הושלם בהצלחה: {len(texts)} וקטורים פורסמו כגרסה {manifest['version']} ב-{self.config.OUT_ROOT}")
+            del matrix
+            checkpoint.discard()
             
-            self.print_statistics(result)
+            self.print_statistics([{"metadata": m} for m in metadata])
+            return True
             
         except Exception as e:
-            logger.error(f"שגיאה בשמירת הקובץ: {e}")
+            logger.error(f"שגיאה בשמירת הקובץ: {e} (נקודת השמירה נשמרה ב-{ingest_dir})")
+            return False
 
     def print_statistics(self, vectors: List[Dict[str, Any]]) -> None:
         """הדפסת סטטיסטיקות"""
@@ -321,10 +662,16 @@ class ImprovedVectorGenerator:
         for chunk_type, count in sorted(chunk_types.items(), key=lambda x: x[1], reverse=True):
             print(f"  {chunk_type}: {count}")
 
+def _extract_file(job) -> List[Dict[str, Any]]:
+    """worker לתהליך נפרד: (config, נתיב, שם קובץ) -> קטעים"""
+    config, file_path, filename = job
+    return ImprovedVectorGenerator(config).extract_chunks_with_enhanced_context(file_path, filename)
+
 def main():
     config = Config()
     generator = ImprovedVectorGenerator(config)
-    generator.generate_vectors()
+    if not generator.generate_vectors():
+        sys.exit(1)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
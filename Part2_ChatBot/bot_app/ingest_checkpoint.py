@@ -0,0 +1,161 @@
+"""
+נקודות שמירה לריצת יצירת וקטורים ארוכה (saved_vectors/ingest/).
+
+    state.json        - חתימת ספק ה-embeddings שהריצה נבנתה בו
+    embeddings.jsonl  - append-only: שורה {"hash", "embedding"} לכל קטע שקיבל embedding;
+                        נכתב ו-fsync אחרי כל חלון batches, כך שריצה שנקטעה ממשיכה מאותה נקודה
+    chunks.jsonl      - הקטעים שחולצו בריצה הנוכחית (טקסט + מטא-דאטה), נכתב מחדש בכל ריצה
+
+בזיכרון נשמר רק מיפוי hash -> מיקום השורה בקובץ; הוקטורים עצמם נקראים מהדיסק בשלב הדחיסה.
+"""
+import os
+import json
+import shutil
+import logging
+from typing import List, Dict, Any, Iterator, Optional
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "state.json"
+EMBEDDINGS_LOG = "embeddings.jsonl"
+CHUNKS_LOG = "chunks.jsonl"
+
+
+class IngestCheckpoint:
+    """embeddings שכבר שולם עליהם בריצה קודמת שלא הושלמה, ויומן הקטעים של הריצה הנוכחית"""
+
+    def __init__(self, ingest_dir: str, embedding_info: Dict[str, Any]):
+        self.ingest_dir = ingest_dir
+        self.embedding_info = embedding_info
+        self._offsets = {}
+        self._embeddings_file = None
+        self._chunks_file = None
+        self.chunk_count = 0
+
+    @property
+    def embedding_count(self) -> int:
+        return len(self._offsets)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.ingest_dir, name)
+
+    def open(self) -> "IngestCheckpoint":
+        os.makedirs(self.ingest_dir, exist_ok=True)
+        state = None
+        try:
+            with open(self._path(STATE_FILE), "r", encoding="utf-8") as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+        if state and state.get("embedding") != self.embedding_info:
+            logger.info("Discarding ingest checkpoint built with a different embedding provider")
+            state = None
+        if state is None:
+            for name in (EMBEDDINGS_LOG, CHUNKS_LOG):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            with open(self._path(STATE_FILE), "w", encoding="utf-8") as f:
+                json.dump({"embedding": self.embedding_info}, f, indent=2)
+        else:
+            self._scan_embeddings()
+            if self._offsets:
+                logger.info(f"Resuming ingest: {len(self._offsets)} embeddings found in checkpoint")
+
+        self._embeddings_file = open(self._path(EMBEDDINGS_LOG), "ab")
+        self._chunks_file = open(self._path(CHUNKS_LOG), "w", encoding="utf-8")
+        return self
+
+    def _scan_embeddings(self) -> None:
+        """קורא את מיקומי השורות; שורה אחרונה חלקית (קריסה באמצע כתיבה) נחתכת מהקובץ"""
+        path = self._path(EMBEDDINGS_LOG)
+        if not os.path.exists(path):
+            return
+
+        good_end = 0
+        with open(path, "rb") as f:
+            for line in iter(f.readline, b""):
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if not line.endswith(b"\n"):
+                    break
+                self._offsets[record["hash"]] = good_end
+                good_end += len(line)
+
+        if good_end < os.path.getsize(path):
+            logger.warning(f"Truncating partial record at the end of {path}")
+            with open(path, "r+b") as f:
+                f.truncate(good_end)
+
+    def __contains__(self, content_hash: str) -> bool:
+        return content_hash in self._offsets
+
+    def append_embeddings(self, items: List[Dict[str, Any]]) -> None:
+        """מוסיף embeddings ליומן וכותב אותם לדיסק לפני שממשיכים"""
+        for item in items:
+            line = json.dumps({"hash": item["metadata"]["content_hash"], "embedding": item["embedding"]}) + "\n"
+            self._offsets[item["metadata"]["content_hash"]] = self._embeddings_file.tell()
+            self._embeddings_file.write(line.encode("utf-8"))
+        self._embeddings_file.flush()
+        os.fsync(self._embeddings_file.fileno())
+
+    def append_chunk(self, chunk: Dict[str, Any]) -> None:
+        self._chunks_file.write(json.dumps({"text": chunk["text"], "metadata": chunk["metadata"]}, ensure_ascii=False) + "\n")
+        self.chunk_count += 1
+
+    def close(self) -> None:
+        for f in (self._embeddings_file, self._chunks_file):
+            if f and not f.closed:
+                f.close()
+
+    def iter_chunks(self) -> Iterator[Dict[str, Any]]:
+        with open(self._path(CHUNKS_LOG), "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def embedding(self, content_hash: str, reader) -> Optional[List[float]]:
+        offset = self._offsets.get(content_hash)
+        if offset is None:
+            return None
+        reader.seek(offset)
+        return json.loads(reader.readline())["embedding"]
+
+    def compact(self, previous: Dict[str, np.ndarray], matrix_path: str):
+        """
+        כותב מטריצה אחת בסדר הקטעים מתוך הגרסה הקודמת (memmap) ויומן ה-embeddings, שורה אחר שורה.
+        מחזיר (טקסטים, מטא-דאטה, מטריצה כ-memmap) של הקטעים שיש להם embedding.
+        """
+        self.close()
+        texts, metadata, sources = [], [], []
+        for chunk in self.iter_chunks():
+            content_hash = chunk["metadata"]["content_hash"]
+            if content_hash in previous or content_hash in self._offsets:
+                texts.append(chunk["text"])
+                metadata.append(chunk["metadata"])
+                sources.append(content_hash)
+            else:
+                logger.warning(f"No embedding for chunk: {chunk['text'][:80]}")
+
+        if not sources:
+            return texts, metadata, None
+
+        with open(self._path(EMBEDDINGS_LOG), "rb") as reader:
+            matrix = None
+            for row, content_hash in enumerate(sources):
+                vector = previous.get(content_hash)
+                if vector is None:
+                    vector = self.embedding(content_hash, reader)
+                if matrix is None:
+                    matrix = np.lib.format.open_memmap(matrix_path, mode="w+", dtype=np.float32,
+                                                       shape=(len(sources), len(vector)))
+                matrix[row] = vector
+        matrix.flush()
+        return texts, metadata, matrix
+
+    def discard(self) -> None:
+        """הריצה פורסמה בהצלחה - אין עוד צורך בנקודות השמירה"""
+        self.close()
+        shutil.rmtree(self.ingest_dir, ignore_errors=True)
@@ -0,0 +1,190 @@
+"""
+אינדקס לקסיקלי (BM25) על טקסט הקטעים, עם טוקניזציה קלה לעברית.
+
+לכל מילה בעברית נשמרת גם הצורה ללא אותיות השימוש ו/ה/ב/ל בתחילתה (עד שתיים),
+כך ש"והלבנת" ו"הלבנת" מתאימות זו לזו.
+
+שמות שירותים מותאמים לשאלות ב-ServiceMatcher - משותף לאינדקס הוקטורים ולטבלת ההטבות.
+"""
+import os
+import re
+import json
+import difflib
+from typing import List, Dict, Any, Tuple, Optional, Iterable
+import numpy as np
+
+HEBREW_PREFIXES = "והבל"
+MIN_STEM_LEN = 3
+TOKEN_RE = re.compile(r"[א-תa-z0-9]+")
+
+FUZZY_MIN_LEN = 4
+FUZZY_CUTOFF = 0.85
+
+VOCAB_FILE = "bm25_vocab.json"
+POSTINGS_FILE = "bm25_postings.npz"
+
+
+def tokenize(text: str) -> List[str]:
+    """מפרק טקסט למילים ומוסיף לכל מילה עברית את הצורות ללא אותיות שימוש"""
+    tokens = []
+    for word in TOKEN_RE.findall((text or "").lower()):
+        tokens.append(word)
+        stem = word
+        for _ in range(2):
+            if len(stem) - 1 >= MIN_STEM_LEN and stem[0] in HEBREW_PREFIXES:
+                stem = stem[1:]
+                tokens.append(stem)
+            else:
+                break
+    return tokens
+
+
+def service_aliases(service_name: str) -> List[str]:
+    """שם שירות וכינוי בסוגריים, למשל "דיקור סיני (אקופונקטורה)" -> ["דיקור סיני", "אקופונקטורה"]"""
+    aliases = [re.sub(r"\([^)]*\)", " ", service_name)]
+    aliases.extend(re.findall(r"\(([^)]*)\)", service_name))
+    return [alias.strip() for alias in aliases if alias.strip()]
+
+
+class ServiceMatcher:
+    """
+    לכל שירות: כינויים (service_aliases), כל כינוי כרשימת צורות אפשריות לכל מילה.
+    fuzzy - גם מילים ארוכות שאינן באוצר המילים של השירותים מותאמות למילים הקרובות אליהן (שגיאות כתיב).
+    """
+
+    def __init__(self, names: Iterable[str], fuzzy: bool = False):
+        self.fuzzy = fuzzy
+        self._aliases = {}
+        vocabulary = set()
+        for name in names:
+            self._aliases[name] = [
+                [set(tokenize(word)) for word in TOKEN_RE.findall(alias.lower())]
+                for alias in service_aliases(name)
+            ]
+            for alias in self._aliases[name]:
+                for forms in alias:
+                    vocabulary |= forms
+        self._vocabulary = sorted(vocabulary)
+        self._vocabulary_set = vocabulary
+
+    def _query_tokens(self, question: str) -> set:
+        tokens = set(tokenize(question))
+        if self.fuzzy:
+            for token in list(tokens):
+                if len(token) >= FUZZY_MIN_LEN and token not in self._vocabulary_set:
+                    tokens.update(difflib.get_close_matches(token, self._vocabulary, n=3, cutoff=FUZZY_CUTOFF))
+        return tokens
+
+    def match(self, question: str) -> Tuple[Optional[str], List[str]]:
+        """
+        מחזיר (שירות, מועמדים): שירות יחיד שכל מילות שמו או כינויו מופיעות בשאלה.
+        כמה שירותים שאינם מוכלים זה בזה - דו-משמעי, ומוחזר (None, המועמדים).
+        """
+        tokens = self._query_tokens(question)
+        matches = {}
+        for name, aliases in self._aliases.items():
+            for words in aliases:
+                if words and all(forms & tokens for forms in words):
+                    matched = {min(forms, key=len) for forms in words}
+                    if len(matched) > len(matches.get(name, ())):
+                        matches[name] = matched
+
+        names = [name for name, words in matches.items()
+                 if not any(words < other for other_name, other in matches.items() if other_name != name)]
+        return (names[0] if len(names) == 1 else None), sorted(names)
+
+
+def reciprocal_rank_fusion(result_lists: Iterable[List[Tuple[float, int]]],
+                           weights: Optional[List[float]] = None, k: int = 60) -> List[Tuple[float, int]]:
+    """מיזוג דירוגים (RRF): כל רשימה תורמת weight / (k + rank) לכל שורה שהופיעה בה"""
+    fused = {}
+    for n, results in enumerate(result_lists):
+        weight = weights[n] if weights else 1.0
+        for rank, (_, row) in enumerate(results):
+            fused[row] = fused.get(row, 0.0) + weight / (k + rank + 1)
+    return sorted(((score, row) for row, score in fused.items()), key=lambda x: x[0], reverse=True)
+
+
+class BM25Index:
+    """רשימות הפוכות בפורמט CSR עם משקל BM25 מחושב מראש לכל מופע"""
+
+    def __init__(self, vocab: Dict[str, int], offsets: np.ndarray, docs: np.ndarray, weights: np.ndarray,
+                 count: int, k1: float = 1.5, b: float = 0.75):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.docs = docs
+        self.weights = weights
+        self.count = count
+        self.k1 = k1
+        self.b = b
+
+    @classmethod
+    def build(cls, texts: List[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        vocab = {}
+        postings = []
+        lengths = np.zeros(len(texts), dtype=np.float32)
+
+        for doc, text in enumerate(texts):
+            counts = {}
+            for token in tokenize(text):
+                counts[token] = counts.get(token, 0) + 1
+            lengths[doc] = sum(counts.values())
+            for token, tf in counts.items():
+                term = vocab.setdefault(token, len(vocab))
+                postings.append((term, doc, tf))
+
+        postings.sort()
+        terms = np.array([p[0] for p in postings], dtype=np.int64)
+        docs = np.array([p[1] for p in postings], dtype=np.int64)
+        tfs = np.array([p[2] for p in postings], dtype=np.float32)
+
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(terms, minlength=len(vocab)))
+
+        df = np.diff(offsets).astype(np.float32)
+        idf = np.log(1 + (len(texts) - df + 0.5) / (df + 0.5))
+        avg_len = float(lengths.mean()) if len(texts) else 1.0
+        norm = k1 * (1 - b + b * lengths[docs] / max(avg_len, 1e-6))
+        weights = (idf[terms] * tfs * (k1 + 1) / (tfs + norm)).astype(np.float32)
+
+        return cls(vocab, offsets, docs, weights, len(texts), k1, b)
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(self.count, dtype=np.float32)
+        for token in set(tokenize(query)):
+            term = self.vocab.get(token)
+            if term is None:
+                continue
+            start, end = self.offsets[term], self.offsets[term + 1]
+            # כל מסמך מופיע פעם אחת ברשימה של מונח, לכן אין צורך ב-np.add.at
+            scores[self.docs[start:end]] += self.weights[start:end]
+        return scores
+
+    def search(self, query: str, top_k: int = 3, mask: Optional[np.ndarray] = None) -> List[Tuple[float, int]]:
+        """מחזיר (ציון, מספר שורה) של הקטעים עם ציון חיובי, מהגבוה לנמוך"""
+        if top_k <= 0:
+            return []
+
+        scores = self.scores(query)
+        if mask is not None:
+            scores[~mask] = 0.0
+
+        hits = np.flatnonzero(scores > 0)
+        if len(hits) > top_k:
+            hits = hits[np.argpartition(-scores[hits], top_k - 1)[:top_k]]
+        hits = hits[np.argsort(-scores[hits], kind="stable")]
+        return [(float(scores[i]), int(i)) for i in hits]
+
+    def save(self, store_dir: str) -> Dict[str, Any]:
+        with open(os.path.join(store_dir, VOCAB_FILE), "w", encoding="utf-8") as f:
+            json.dump(self.vocab, f, ensure_ascii=False)
+        np.savez(os.path.join(store_dir, POSTINGS_FILE), offsets=self.offsets, docs=self.docs, weights=self.weights)
+        return {"type": "bm25", "k1": self.k1, "b": self.b}
+
+    @classmethod
+    def load(cls, store_dir: str, count: int, header: Dict[str, Any]) -> "BM25Index":
+        with open(os.path.join(store_dir, VOCAB_FILE), "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        postings = np.load(os.path.join(store_dir, POSTINGS_FILE))
+        return cls(vocab, postings["offsets"], postings["docs"], postings["weights"], count,
+                   header.get("k1", 1.5), header.get("b", 0.75))
@@ -0,0 +1,206 @@
+"""
+סיווג מקומי של הודעות אחרי ההרשמה: רפואית (שאלה על השירותים / ההטבות) או לא.
+
+1. לקסיקון - מונחים רפואיים חד-משמעיים ושמות שירותים מטבלת ההטבות: החלטה מיידית, בלי רשת.
+2. מרכז הכובד הקרוב - embedding של ההודעה (אותו embedding שהשליפה מחשבת, דרך המטמון)
+   מול מרכזי הכובד של דוגמאות רפואיות ולא-רפואיות. margin = דמיון לרפואי פחות דמיון ללא-רפואי.
+   מילים כלליות ושמות קופות ("ביטוח", "הנחה", "test", "מכבי") לא מכריעות לבד - רק מזיזות את ה-margin
+   ב-MEDICAL_CLASSIFIER_BAND לכיוון רפואי, כך ש"מי ניצח במשחק של מכבי" מגיע לכל היותר לבדיקה של הרצועה.
+3. רק כש-|margin| קטן מ-MEDICAL_CLASSIFIER_BAND (אזור אי-הוודאות) - קריאה למודל השפה, עם הקשר השיחה.
+
+הודעת המשך ("ומה לגבי זהב?", "and for gold tier?") או הודעה קצרה מאוד תלויות בהקשר שהמרכזים לא רואים,
+ולכן - אם אין בהן מונח רפואי משלהן - עוברות למודל השפה, שמקבל את ההודעות האחרונות.
+
+כל החלטה נרשמת ביומן עם המקור (lexicon / centroid / llm) והביטחון, כדי לכייל את הרצועה.
+MEDICAL_CLASSIFIER=llm מחזיר את ההתנהגות הקודמת (קריאה למודל בכל הודעה).
+"""
+import os
+import re
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Callable, Awaitable
+import numpy as np
+from bot_app.lexical import tokenize
+from bot_app.vector_index import HMO_ALIASES
+
+logger = logging.getLogger(__name__)
+
+MEDICAL_CLASSIFIER = os.getenv("MEDICAL_CLASSIFIER", "local")
+MEDICAL_CLASSIFIER_BAND = float(os.getenv("MEDICAL_CLASSIFIER_BAND", "0.03"))
+
+# מונחים שמופיעים כמעט רק בהקשר רפואי - מכריעים מיד
+MEDICAL_TERMS = {
+    "רופא", "רופאה", "רופאים", "מרפאה", "מרפאת", "מרפאות", "שיניים", "הריון", "היריון", "תרופה", "תרופות",
+    "ניתוח", "פיזיותרפיה", "דיקור", "אבחון", "משקפיים", "תזונאית", "דיאטנית", "אופטומטריה", "קלינאית", "רפואה",
+    "רפואי", "רפואית", "אחות", "חיסון",
+    "doctor", "dental", "dentist", "teeth", "tooth", "pregnancy", "pregnant", "medication", "medicine", "surgery",
+    "physiotherapy", "acupuncture", "diagnosis", "dietitian", "optometry", "medical", "nurse", "vaccine", "copay",
+    "hmo",
+}
+
+# מילים שמתאימות גם לנושאים אחרים (ביטוח רכב, test במתמטיקה, המשחק של מכבי) - רק מזיזות את ה-margin
+WEAK_MEDICAL_TERMS = {
+    "טיפול", "טיפולי", "טיפולים", "בדיקה", "בדיקת", "בדיקות", "כאב", "כאבים", "הנחה", "הנחות", "כיסוי", "מכוסה",
+    "זכאי", "זכאית", "זכאות", "ביטוח", "קופה", "קופת", "חולים", "ראייה", "עדשות", "תזונה", "סדנה", "סדנת",
+    "סדנאות", "עישון", "תקשורת", "בריאות", "הפניה", "מומחה", "הטבה", "הטבות", "השתתפות", "זהב", "כסף", "ארד",
+    "clinic", "treatment", "treatments", "therapy", "test", "tests", "exam", "pain", "discount", "coverage",
+    "covered", "entitled", "insurance", "appointment", "eye", "glasses", "lenses", "nutrition", "workshop",
+    "workshops", "smoking", "speech", "health", "referral", "specialist", "benefit", "benefits", "gold", "silver",
+    "bronze",
+} | set(HMO_ALIASES)
+
+# הודעת המשך שנשענת על הקודמת: פתיחה של המשך, או הודעה קצרה מאוד
+FOLLOWUP_RE = re.compile(r"^\W*(?:ו(?:מה|אם|לגבי|גם|ב)|גם|מה\s+לגבי|and|also|what\s+about|how\s+about|same)\b",
+                         re.IGNORECASE)
+FOLLOWUP_MAX_WORDS = 3
+
+MEDICAL_EXAMPLES = [
+    "מה מגיע לי על טיפולי שיניים?",
+    "כמה הנחה יש על דיקור סיני?",
+    "האם יש כיסוי לבדיקות בהריון?",
+    "איפה אפשר לעשות בדיקת ראייה?",
+    "מה הטלפון של מרפאת התקשורת?",
+    "כמה טיפולים בשנה מגיעים לי בפיזיותרפיה?",
+    "האם הביטוח מכסה הלבנת שיניים?",
+    "יש סדנאות לגמילה מעישון?",
+    "what discount do I get for acupuncture?",
+    "is dental cleaning covered by my plan?",
+    "how many physiotherapy sessions am I entitled to?",
+    "where can I get an eye exam?",
+    "are pregnancy tests covered?",
+    "what is the phone number of the speech therapy clinic?",
+    "do I get a discount on glasses?",
+]
+
+NON_MEDICAL_EXAMPLES = [
+    "מה מזג האוויר היום?",
+    "ספר לי בדיחה",
+    "מי ניצח במשחק אתמול?",
+    "תמליץ לי על מסעדה טובה",
+    "מה השעה עכשיו?",
+    "איך מכינים עוגת שוקולד?",
+    "שלום, מה שלומך?",
+    "תודה רבה",
+    "what's the weather tomorrow?",
+    "tell me a joke",
+    "who won the football game?",
+    "recommend a good movie",
+    "how do I cook pasta?",
+    "hello, how are you?",
+    "what is the capital of France?",
+    # נושאים שחולקים מילים עם השאלות הרפואיות (ביטוח, הנחה, test, שמות הקופות)
+    "כמה עולה ביטוח רכב?",
+    "יש הנחה על כרטיסים להופעה?",
+    "מי ניצח במשחק של מכבי תל אביב?",
+    "help me study for my math test",
+    "where is a good health food store?",
+    "what is the best car insurance?",
+]
+
+
+class MedicalClassifier:
+    """לקסיקון, ואז מרכזי כובד של embeddings, ואז - רק באזור אי-הוודאות - מודל השפה"""
+
+    def __init__(self, embed_one: Callable[[str], Awaitable[List[float]]],
+                 embed_many: Callable[[List[str]], Awaitable[List[List[float]]]],
+                 llm_classify: Callable[[str, List[Dict[str, str]]], Awaitable[bool]],
+                 service_matcher: Optional[Callable[[str], bool]] = None,
+                 mode: str = MEDICAL_CLASSIFIER, band: float = MEDICAL_CLASSIFIER_BAND):
+        self.embed_one = embed_one
+        self.embed_many = embed_many
+        self.llm_classify = llm_classify
+        self.service_matcher = service_matcher
+        self.mode = mode
+        self.band = band
+        self._centroids = None
+        self._lock = threading.Lock()
+        self.decisions = {}
+
+    def lexicon_match(self, message: str) -> Optional[str]:
+        """המונח הרפואי או השירות שנמצאו בהודעה, או None"""
+        for token in tokenize(message):
+            if token in MEDICAL_TERMS:
+                return token
+        if self.service_matcher is not None and self.service_matcher(message):
+            return "service name"
+        return None
+
+    @staticmethod
+    def weak_terms(message: str) -> List[str]:
+        return sorted({token for token in tokenize(message) if token in WEAK_MEDICAL_TERMS})
+
+    @staticmethod
+    def is_followup(message: str, chat_history: List[Dict[str, str]]) -> bool:
+        """הודעה שמשמעותה תלויה בהודעות הקודמות"""
+        has_previous = any(m.get("role") == "user" for m in chat_history)
+        return has_previous and bool(FOLLOWUP_RE.search(message) or len(message.split()) <= FOLLOWUP_MAX_WORDS)
+
+    async def centroids(self) -> np.ndarray:
+        """מרכזי הכובד (רפואי, לא-רפואי), מנורמלים; מחושבים פעם אחת, וה-embeddings נשמרים במטמון"""
+        if self._centroids is None:
+            vectors = np.asarray(await self.embed_many(MEDICAL_EXAMPLES + NON_MEDICAL_EXAMPLES), dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            centroids = np.stack([vectors[:len(MEDICAL_EXAMPLES)].mean(axis=0),
+                                  vectors[len(MEDICAL_EXAMPLES):].mean(axis=0)])
+            self._centroids = centroids / np.linalg.norm(centroids, axis=1, keepdims=True)
+        return self._centroids
+
+    async def centroid_margin(self, message: str) -> float:
+        query = np.asarray(await self.embed_one(message), dtype=np.float32)
+        query /= max(float(np.linalg.norm(query)), 1e-12)
+        medical, non_medical = await self.centroids() @ query
+        return float(medical - non_medical)
+
+    def _record(self, decision: Dict[str, Any]) -> Dict[str, Any]:
+        with self._lock:
+            self.decisions[decision["source"]] = self.decisions.get(decision["source"], 0) + 1
+        margin = f" margin={decision['margin']:+.3f}" if decision.get("margin") is not None else ""
+        logger.info(f"Medical classifier: medical={decision['medical']} source={decision['source']} "
+                    f"confidence={decision['confidence']:.2f}{margin}")
+        return decision
+
+    async def classify(self, message: str, chat_history: List[Dict[str, str]]) -> Dict[str, Any]:
+        """מחזיר {"medical", "source", "confidence", "margin"}"""
+        if self.mode == "llm":
+            try:
+                medical = await self.llm_classify(message, chat_history)
+                return self._record({"medical": medical, "source": "llm", "confidence": 1.0, "margin": None})
+            except Exception as e:
+                logger.warning(f"LLM classification failed, assuming medical: {e}")
+                return self._record({"medical": True, "source": "default", "confidence": 0.0, "margin": None})
+
+        term = self.lexicon_match(message)
+        if term:
+            logger.debug(f"Lexicon match: {term}")
+            return self._record({"medical": True, "source": "lexicon", "confidence": 1.0, "margin": None})
+
+        margin = await self.centroid_margin(message)
+        weak = self.weak_terms(message)
+        if weak:
+            logger.debug(f"Weak medical terms {weak}, margin {margin:+.3f} -> {margin + self.band:+.3f}")
+            margin += self.band
+        # ביטחון 0.5 בקצה הרצועה, ושואף ל-1 ככל שה-margin גדל
+        confidence = abs(margin) / (abs(margin) + self.band) if self.band > 0 else 1.0
+        if self.is_followup(message, chat_history):
+            logger.debug("Follow-up message, escalating to the LLM with the conversation context")
+        elif abs(margin) >= self.band:
+            return self._record({"medical": margin > 0, "source": "centroid", "confidence": confidence,
+                                 "margin": margin})
+
+        try:
+            medical = await self.llm_classify(message, chat_history)
+            return self._record({"medical": medical, "source": "llm", "confidence": 1.0, "margin": margin})
+        except Exception as e:
+            logger.warning(f"LLM classification failed, using the centroid decision: {e}")
+            return self._record({"medical": margin >= 0, "source": "centroid-fallback", "confidence": confidence,
+                                 "margin": margin})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = sum(self.decisions.values())
+            return {
+                "mode": self.mode,
+                "band": self.band,
+                "decisions": dict(self.decisions),
+                "llm_ratio": round(self.decisions.get("llm", 0) / total, 4) if total else 0.0,
+            }
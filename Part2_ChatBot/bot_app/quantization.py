@@ -0,0 +1,264 @@
+"""
+דחיסת embeddings לשמירה בזיכרון: int8 (scalar quantization) או PQ (product quantization).
+
+הציון הראשוני מחושב על הקודים הדחוסים, ורשימה קצרה של מועמדים מדורגת מחדש
+מול הוקטורים המלאים שנקראים מ-embeddings.npy בדיסק (memmap).
+
+הרצה כסקריפט מדפיסה דוח recall מול חיפוש מדויק על מאגר קיים:
+    python -m bot_app.quantization [--questions questions.txt]
+"""
+import os
+import time
+import logging
+import argparse
+from typing import Dict, Any, Optional, List, Iterator
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+INT8_CODES_FILE = "int8_codes.npy"
+INT8_SCALE_FILE = "int8_scale.npy"
+PQ_CODES_FILE = "pq_codes.npy"
+PQ_CODEBOOKS_FILE = "pq_codebooks.npy"
+
+SCORE_BLOCK = 65536
+
+
+def _blocks(matrix: np.ndarray, rows: Optional[np.ndarray] = None) -> Iterator[np.ndarray]:
+    """המטריצה (או השורות rows בלבד) בבלוקים של float32"""
+    count = matrix.shape[0] if rows is None else len(rows)
+    for start in range(0, count, SCORE_BLOCK):
+        index = slice(start, start + SCORE_BLOCK) if rows is None else rows[start:start + SCORE_BLOCK]
+        yield np.asarray(matrix[index], dtype=np.float32)
+
+
+class Int8Quantizer:
+    """קוד int8 לכל רכיב, עם קנה מידה נפרד לכל מימד"""
+
+    def __init__(self, codes: np.ndarray, scale: np.ndarray):
+        self.codes = codes
+        self.scale = scale
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, training: Optional[np.ndarray] = None) -> "Int8Quantizer":
+        """training - השורות שמהן נלמד קנה המידה (ברירת מחדל: כולן); כל השורות מקודדות"""
+        scale = np.zeros(matrix.shape[1], dtype=np.float32)
+        for block in _blocks(matrix, training):
+            scale = np.maximum(scale, np.abs(block).max(axis=0))
+        scale = np.where(scale > 0, scale / 127.0, 1.0).astype(np.float32)
+
+        codes = np.empty(matrix.shape, dtype=np.int8)
+        for start in range(0, matrix.shape[0], SCORE_BLOCK):
+            block = np.asarray(matrix[start:start + SCORE_BLOCK], dtype=np.float32)
+            codes[start:start + SCORE_BLOCK] = np.clip(np.rint(block / scale), -127, 127)
+        return cls(codes, scale)
+
+    def scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        scaled_query = query * self.scale
+        codes = self.codes if rows is None else self.codes[rows]
+        scores = np.empty(codes.shape[0], dtype=np.float32)
+        for start in range(0, codes.shape[0], SCORE_BLOCK):
+            scores[start:start + SCORE_BLOCK] = codes[start:start + SCORE_BLOCK].astype(np.float32) @ scaled_query
+        return scores
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.codes.shape[1]
+
+    def save(self, store_dir: str) -> Dict[str, Any]:
+        np.save(os.path.join(store_dir, INT8_CODES_FILE), self.codes)
+        np.save(os.path.join(store_dir, INT8_SCALE_FILE), self.scale)
+        return {"type": "int8"}
+
+    @classmethod
+    def load(cls, store_dir: str, header: Dict[str, Any]) -> "Int8Quantizer":
+        return cls(np.load(os.path.join(store_dir, INT8_CODES_FILE)),
+                   np.load(os.path.join(store_dir, INT8_SCALE_FILE)))
+
+
+class PQQuantizer:
+    """חלוקת הוקטור ל-m תת-וקטורים; כל תת-וקטור מקודד כמספר centroid (בית אחד) מתוך 256"""
+
+    def __init__(self, codes: np.ndarray, codebooks: np.ndarray):
+        self.codes = codes
+        self.codebooks = codebooks
+
+    @property
+    def m(self) -> int:
+        return self.codebooks.shape[0]
+
+    @classmethod
+    def build(cls, matrix: np.ndarray, m: int = 96, ksub: int = 256, iterations: int = 10,
+              sample_size: int = 65536, seed: int = 0, training: Optional[np.ndarray] = None) -> "PQQuantizer":
+        """training - השורות שמהן נדגמים וקטורי האימון של ה-codebooks (ברירת מחדל: כולן)"""
+        count, dim = matrix.shape
+        if dim % m != 0:
+            raise ValueError(f"dimension {dim} is not divisible by {m} sub-vectors")
+        dsub = dim // m
+        pool = count if training is None else np.asarray(training)
+        pool_size = count if training is None else len(pool)
+        ksub = min(ksub, pool_size)
+        rng = np.random.default_rng(seed)
+
+        sample_rows = np.sort(rng.choice(pool, size=min(pool_size, sample_size), replace=False))
+        sample = np.asarray(matrix[sample_rows], dtype=np.float32).reshape(len(sample_rows), m, dsub)
+
+        codebooks = np.empty((m, ksub, dsub), dtype=np.float32)
+        for j in range(m):
+            data = sample[:, j, :]
+            centroids = data[rng.choice(len(data), size=ksub, replace=False)].copy()
+            for _ in range(iterations):
+                assignment = cls._nearest(data, centroids)
+                sums = np.zeros_like(centroids)
+                np.add.at(sums, assignment, data)
+                counts = np.bincount(assignment, minlength=ksub)
+                filled = counts > 0
+                centroids[filled] = sums[filled] / counts[filled, None]
+            codebooks[j] = centroids
+
+        codes = np.empty((count, m), dtype=np.uint8)
+        for start in range(0, count, SCORE_BLOCK):
+            block = np.asarray(matrix[start:start + SCORE_BLOCK], dtype=np.float32)
+            block = block.reshape(len(block), m, dsub)
+            for j in range(m):
+                codes[start:start + SCORE_BLOCK, j] = cls._nearest(block[:, j, :], codebooks[j])
+        return cls(codes, codebooks)
+
+    @staticmethod
+    def _nearest(data: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+        distances = (centroids ** 2).sum(axis=1) - 2 * data @ centroids.T
+        return np.argmin(distances, axis=1)
+
+    def scores(self, query: np.ndarray, rows: Optional[np.ndarray] = None) -> np.ndarray:
+        # טבלת חיפוש (m x 256) של מכפלות פנימיות בין תת-השאילתה לכל centroid
+        table = np.einsum("jkd,jd->jk", self.codebooks, query.reshape(self.m, -1))
+        codes = self.codes if rows is None else self.codes[rows]
+        scores = np.zeros(codes.shape[0], dtype=np.float32)
+        for j in range(self.m):
+            scores += table[j, codes[:, j]]
+        return scores
+
+    @property
+    def bytes_per_vector(self) -> int:
+        return self.m
+
+    def save(self, store_dir: str) -> Dict[str, Any]:
+        np.save(os.path.join(store_dir, PQ_CODES_FILE), self.codes)
+        np.save(os.path.join(store_dir, PQ_CODEBOOKS_FILE), self.codebooks)
+        return {"type": "pq", "m": self.m}
+
+    @classmethod
+    def load(cls, store_dir: str, header: Dict[str, Any]) -> "PQQuantizer":
+        return cls(np.load(os.path.join(store_dir, PQ_CODES_FILE)),
+                   np.load(os.path.join(store_dir, PQ_CODEBOOKS_FILE)))
+
+
+QUANTIZERS = {"int8": Int8Quantizer, "pq": PQQuantizer}
+
+
+def build_quantizer(kind: str, matrix: np.ndarray, pq_m: int = 96, training: Optional[np.ndarray] = None):
+    if kind == "int8":
+        return Int8Quantizer.build(matrix, training=training)
+    if kind == "pq":
+        return PQQuantizer.build(matrix, m=pq_m, training=training)
+    raise ValueError(f"unknown quantization {kind}, expected one of {list(QUANTIZERS)}")
+
+
+def load_quantizer(store_dir: str, header: Dict[str, Any]):
+    return QUANTIZERS[header["type"]].load(store_dir, header)
+
+
+def _embed_questions(questions: List[str], header: Dict[str, Any]) -> np.ndarray:
+    """embeddings של שאלות, בספק שמוגדר ב-EMBEDDING_PROVIDER (חייב להתאים לספק שבנה את המאגר)"""
+    from bot_app.embeddings import embedding_provider
+
+    embedding_provider.check_compatible(header.get("embedding"), header["dim"])
+    vectors = np.asarray(embedding_provider.embed(questions), dtype=np.float32)
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def recall_report(store_dir: str, queries: int = 200, top_k: int = 5, rerank_factor: int = 10,
+                  pq_m: int = 96, seed: int = 0, questions: Optional[List[str]] = None) -> None:
+    """
+    משווה int8 ו-PQ לחיפוש מדויק, recall@k עם ובלי דירוג מחדש, על שאילתות שהדחיסה לא ראתה:
+    - questions: embeddings של שאלות אמיתיות; הדחיסה נלמדת מכל המאגר.
+    - אחרת: מדגם של קטעים מוחזק בצד - קנה המידה וה-codebooks נלמדים רק משאר הקטעים,
+      והקטע עצמו לא נספר בין התוצאות (אחרת הוא תמיד ה-top-1 של עצמו).
+    """
+    from bot_app.vector_store import load_vector_store
+
+    _, _, matrix, header = load_vector_store(store_dir)
+    exact = np.asarray(matrix, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    if questions:
+        query_vectors, query_rows, training = _embed_questions(questions, header), [None] * len(questions), None
+        source = f"{len(questions)} questions"
+    else:
+        # לכל היותר חמישית מהמאגר, כדי שיישאר מספיק לאימון
+        held_out = min(queries, max(1, len(exact) // 5))
+        query_rows = rng.choice(len(exact), size=held_out, replace=False)
+        query_vectors = exact[query_rows]
+        training = np.setdiff1d(np.arange(len(exact)), query_rows)
+        source = f"{held_out} held-out chunks (trained on the other {len(training)})"
+
+    shortlist_size = min(top_k * rerank_factor, len(exact))
+    print(f"\n📏 Recall report for {store_dir}: {header['count']} vectors, dim {header['dim']}, "
+          f"queries: {source}, k={top_k}, re-rank list {shortlist_size}")
+    print(f"  float32: {exact.shape[1] * 4} bytes/vector")
+
+    for kind in QUANTIZERS:
+        if kind == "pq" and exact.shape[1] % pq_m != 0:
+            print(f"  pq: skipped, dimension {exact.shape[1]} is not divisible by --pq-m {pq_m}")
+            continue
+        started = time.time()
+        quantizer = build_quantizer(kind, exact, pq_m=pq_m, training=training)
+        build_time = time.time() - started
+
+        raw_hits = reranked_hits = 0
+        for row, query in zip(query_rows, query_vectors):
+            exact_scores = exact @ query
+            approx = quantizer.scores(query)
+            if row is not None:
+                exact_scores[row] = approx[row] = -np.inf
+            truth = set(np.argsort(-exact_scores)[:top_k])
+
+            raw = np.argsort(-approx)[:top_k]
+            shortlist = np.argpartition(-approx, shortlist_size - 1)[:shortlist_size]
+            reranked = shortlist[np.argsort(-exact_scores[shortlist])[:top_k]]
+
+            raw_hits += len(truth & set(raw))
+            reranked_hits += len(truth & set(reranked))
+
+        total = len(query_vectors) * top_k
+        print(f"  {kind}: {quantizer.bytes_per_vector} bytes/vector, build {build_time:.1f}s, "
+              f"recall@{top_k} {raw_hits / total:.3f} (codes only), {reranked_hits / total:.3f} (re-ranked)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall of int8 / PQ quantization against exact search")
+    parser.add_argument("--store", help="store directory (default: the version published in saved_vectors/manifest.json)")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument("--rerank-factor", type=int, default=10)
+    parser.add_argument("--pq-m", type=int, default=96)
+    parser.add_argument("--questions", help="text file with one user question per line, used as queries "
+                                            "instead of held-out chunks (embedded with EMBEDDING_PROVIDER)")
+    args = parser.parse_args()
+
+    store = args.store
+    if not store:
+        from bot_app.vector_store import read_manifest
+
+        manifest = read_manifest("saved_vectors")
+        if not manifest:
+            parser.error("no published vector store found; pass --store")
+        store = os.path.join("saved_vectors", manifest["path"])
+    questions = None
+    if args.questions:
+        with open(args.questions, "r", encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    recall_report(store, args.queries, args.top_k, args.rerank_factor, args.pq_m, questions=questions)
+
+
+if __name__ == "__main__":
+    main()
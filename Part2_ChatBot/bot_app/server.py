@@ -1,11 +1,20 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from typing import List, Dict
-from bot_app.bot_logic import get_answer
+from typing import List, Dict, Any, Optional, AsyncIterator
+from bot_app.bot_logic import get_answer, stream_answer, all_info_collected, answer_cache, medical_classifier
+from bot_app.session_store import SessionStore
+from bot_app.conversation_context import adopt_fold, pending_fold
+from bot_app.embeddings import embedding_cache, get_vector_index, get_index_version, start_index_reloader
 import os
+import json
+import time
+import asyncio
 import logging
+import weakref
 
 # Setup logging
 logging.basicConfig(level=logging.INFO)
@@ -16,7 +25,34 @@ project_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..
 env_path = os.path.join(project_root, ".env")
 load_dotenv(dotenv_path=env_path)
 
-app = FastAPI(title="Medical Bot API", description="API for medical chatbot", version="1.0.0")
+# שיחות בצד השרת: היסטוריה, פרופיל ומצב הרשמה לפי session_id
+session_store = SessionStore()
+# בקשות מקבילות לאותה שיחה מטופלות בזו אחר זו, כדי שאף תור לא יידרס
+session_locks = weakref.WeakValueDictionary()
+
+def session_lock(session_id: Optional[str]) -> asyncio.Lock:
+    if not session_id:
+        return asyncio.Lock()
+    lock = session_locks.get(session_id)
+    if lock is None:
+        lock = session_locks[session_id] = asyncio.Lock()
+    return lock
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the vector index up front (off the event loop) and watch for newly published versions
+    try:
+        await asyncio.to_thread(get_vector_index)
+        logger.info(f"Vector index version {get_index_version()} loaded.")
+    except Exception:
+        logger.error("Could not load the vector index at startup", exc_info=True)
+    stop_reloader = start_index_reloader()
+    session_store.start()
+    yield
+    stop_reloader.set()
+    await asyncio.to_thread(session_store.close)
+
+app = FastAPI(title="Medical Bot API", description="API for medical chatbot", version="1.0.0", lifespan=lifespan)
 
 # CORS middleware configuration
 app.add_middleware(
@@ -30,12 +66,147 @@ app.add_middleware(
 class AskRequest(BaseModel):
     question: str
     chat_history: List[Dict[str, str]] = []
+    user_profile: Optional[Dict[str, Any]] = None
+    context: Optional[Dict[str, Any]] = None
 
 class AskResponse(BaseModel):
     answer: str
     chat_history: List[Dict[str, str]]
+    user_profile: Optional[Dict[str, Any]] = None
+    context: Optional[Dict[str, Any]] = None
     error: str = None
 
+class ChatRequest(BaseModel):
+    message: str
+    session_id: Optional[str] = None
+
+class ChatResponse(BaseModel):
+    answer: str
+    session_id: str
+    registered: bool = False
+    error: str = None
+
+class SessionResponse(BaseModel):
+    session_id: str
+    chat_history: List[Dict[str, str]]
+    registered: bool
+
+async def open_session(session_id: Optional[str]) -> Dict[str, Any]:
+    # קריאה מ-SQLite אם השיחה לא בזיכרון - ב-thread, מחוץ ל-event loop
+    session = await asyncio.to_thread(session_store.get, session_id) if session_id else None
+    if session is None:
+        if session_id:
+            logger.info(f"Unknown or expired session {session_id}, starting a new one.")
+        session = session_store.create()
+    logger.info(f"Received message for session {session['session_id']}")
+    return session
+
+# משימות ששומרות בשיחות סיכומים שהסתיימו ברקע; ההפניה מונעת את איסופן לפני שסיימו
+background_tasks = set()
+
+async def store_fold(session: Dict[str, Any], fold: asyncio.Task) -> None:
+    """כשהסיכום ברקע מסתיים - מחיל אותו על השיחה ושומר, אם היא עדיין קיימת"""
+    await asyncio.wait([fold])
+    async with session_lock(session["session_id"]):
+        if await asyncio.to_thread(session_store.get, session["session_id"]) is not session:
+            return
+        context = adopt_fold(session["chat_history"], session["context"])
+        if context != session["context"]:
+            session["context"] = context
+            session_store.save(session)
+
+def update_session(session: Dict[str, Any], response: Dict[str, Any]) -> None:
+    session["chat_history"] = response["chat_history"]
+    session["user_profile"] = response.get("user_profile")
+    session["context"] = response.get("context")
+    session["registered"] = all_info_collected(session["chat_history"])
+    session_store.save(session)
+    fold = pending_fold(session["context"])
+    if fold is not None:
+        task = asyncio.create_task(store_fold(session, fold))
+        background_tasks.add(task)
+        task.add_done_callback(background_tasks.discard)
+
+def sse(event: Dict[str, Any]) -> str:
+    return f"data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+async def sse_stream(events: AsyncIterator[Dict[str, Any]]) -> AsyncIterator[str]:
+    """אירועי stream_answer בפורמט Server-Sent Events, עם רישום הזמן עד הטוקן הראשון"""
+    started = time.perf_counter()
+    first_token = True
+    async for event in events:
+        if first_token and event["type"] == "token":
+            first_token = False
+            logger.info(f"First token after {time.perf_counter() - started:.2f}s")
+        if event["type"] == "done":
+            logger.info(f"Stream finished after {time.perf_counter() - started:.2f}s")
+        yield sse(event)
+
+def streaming_response(events: AsyncIterator[Dict[str, Any]]) -> StreamingResponse:
+    # בלי buffering בדרך (nginx וכדומה), כדי שכל טוקן יגיע מיד
+    return StreamingResponse(sse_stream(events), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(data: ChatRequest):
+    """
+    הלקוח שולח רק session_id וההודעה החדשה; ההיסטוריה והפרופיל נשמרים בשרת.
+    session_id חסר, לא מוכר או שפג תוקפו פותח שיחה חדשה, והמזהה שלה מוחזר בתשובה.
+    """
+    async with session_lock(data.session_id):
+        session = await open_session(data.session_id)
+
+        try:
+            response = await get_answer(data.message, session["chat_history"], session["user_profile"],
+                                        session.get("context"))
+            update_session(session, response)
+
+            logger.info("Response generated successfully.")
+            return ChatResponse(answer=response["answer"], session_id=session["session_id"],
+                                registered=session["registered"])
+
+        except Exception as e:
+            logger.error("Error while processing message", exc_info=True)
+            return ChatResponse(
+                answer="מצטער, אירעה שגיאה בעיבוד השאלה. אנא נסה שוב.",
+                session_id=session["session_id"],
+                registered=session["registered"],
+                error=str(e)
+            )
+
+@app.post("/chat/stream")
+async def chat_stream(data: ChatRequest):
+    """
+    כמו /chat, בהזרמת SSE: אירוע session עם המזהה, אירוע token לכל טוקן,
+    ובסוף אירוע done (answer, session_id, registered). השיחה נשמרת רק בסוף התור.
+    """
+    async def events():
+        async with session_lock(data.session_id):
+            session = await open_session(data.session_id)
+            yield {"type": "session", "session_id": session["session_id"]}
+            async for event in stream_answer(data.message, session["chat_history"], session["user_profile"],
+                                            session.get("context")):
+                if event["type"] == "done":
+                    update_session(session, event)
+                    event = {"type": "done", "answer": event["answer"], "session_id": session["session_id"],
+                             "registered": session["registered"], "error": event.get("error")}
+                yield event
+
+    return streaming_response(events())
+
+@app.get("/sessions/{session_id}", response_model=SessionResponse)
+def get_session(session_id: str):
+    session = session_store.get(session_id)
+    if session is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    return SessionResponse(session_id=session_id, chat_history=session["chat_history"],
+                           registered=session["registered"])
+
+@app.delete("/sessions/{session_id}")
+def delete_session(session_id: str):
+    session_store.delete(session_id)
+    return {"deleted": session_id}
+
 @app.post("/ask", response_model=AskResponse)
 async def ask_question(data: AskRequest):
     logger.info(f"Received question: {data.question}")
@@ -43,12 +214,14 @@ async def ask_question(data: AskRequest):
         question = data.question
         chat_history = data.chat_history
 
-        response = get_answer(question, chat_history)
+        response = await get_answer(question, chat_history, data.user_profile, data.context)
 
         logger.info("Response generated successfully.")
         return AskResponse(
             answer=response["answer"],
-            chat_history=response["chat_history"]
+            chat_history=response["chat_history"],
+            user_profile=response.get("user_profile"),
+            context=response.get("context")
         )
 
     except Exception as e:
@@ -56,13 +229,29 @@ async def ask_question(data: AskRequest):
         return AskResponse(
             answer="מצטער, אירעה שגיאה בעיבוד השאלה. אנא נסה שוב.",
             chat_history=data.chat_history,
+            user_profile=data.user_profile,
+            context=data.context,
             error=str(e)
         )
 
+@app.post("/ask/stream")
+async def ask_stream(data: AskRequest):
+    """כמו /ask, בהזרמת SSE: אירועי token ובסוף done עם answer / chat_history / user_profile / context"""
+    logger.info(f"Received streaming question: {data.question}")
+    return streaming_response(stream_answer(data.question, data.chat_history, data.user_profile, data.context))
+
 @app.get("/health")
 def health_check():
     logger.info("Health check requested.")
-    return {"status": "healthy", "message": "✅ Bot API is running"}
+    return {
+        "status": "healthy",
+        "message": "✅ Bot API is running",
+        "index_version": get_index_version(),
+        "embedding_cache": embedding_cache.stats(),
+        "sessions": session_store.stats(),
+        "answer_cache": answer_cache.stats(),
+        "medical_classifier": medical_classifier.stats()
+    }
 
 @app.get("/")
 def read_root():
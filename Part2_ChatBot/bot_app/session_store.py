@@ -0,0 +1,241 @@
+"""
+מאגר שיחות בצד השרת, לפי session_id.
+
+שכבה 1: LRU חסום בזיכרון (SESSION_MAX_SESSIONS), עם TTL מהפעולה האחרונה (SESSION_TTL).
+שכבה 2 (אופציונלית, SESSION_DB_PATH): קובץ SQLite ששורד הפעלה מחדש. הכתיבה אליו היא write-behind -
+בקשה רק מסמנת את השיחה כ"מלוכלכת", ו-thread ברקע כותב את כל השינויים יחד כל SESSION_FLUSH_INTERVAL שניות.
+
+לכל שיחה נשמרים: היסטוריית ההודעות, פרופיל המשתמש שחולץ, הקשר השיחה המסוכם, והאם ההרשמה אושרה.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "10000"))
+SESSION_TTL = float(os.getenv("SESSION_TTL", str(24 * 3600)))
+SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "")
+SESSION_FLUSH_INTERVAL = float(os.getenv("SESSION_FLUSH_INTERVAL", "2"))
+
+
+def new_session(session_id: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        "session_id": session_id or uuid.uuid4().hex,
+        "chat_history": [],
+        "user_profile": None,
+        "context": None,
+        "registered": False,
+        "updated_at": time.time(),
+    }
+
+
+class SessionStore:
+    """שיחות: LRU עם TTL בזיכרון, ומעליו SQLite אופציונלי בכתיבה מושהית"""
+
+    def __init__(self, max_sessions: int = SESSION_MAX_SESSIONS, ttl: float = SESSION_TTL,
+                 db_path: Optional[str] = SESSION_DB_PATH or None,
+                 flush_interval: float = SESSION_FLUSH_INTERVAL):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.db_path = db_path
+        self.flush_interval = flush_interval
+        self._memory = OrderedDict()
+        self._dirty = {}
+        self._deleted = set()
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn = None
+        self._stop = threading.Event()
+        self._flusher = None
+        self.created = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evicted = 0
+        self.expired = 0
+
+        if self.db_path:
+            try:
+                self._connect()
+            except sqlite3.Error as e:
+                logger.warning(f"Session persistence disabled ({self.db_path}): {e}")
+                self.db_path = None
+
+    def _connect(self) -> None:
+        directory = os.path.dirname(self.db_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # חיבור אחד, משותף ל-thread הכתיבה ולקריאות של בקשות (תחת _db_lock)
+        self._conn = sqlite3.connect(self.db_path, timeout=10, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS sessions_updated_at ON sessions (updated_at)")
+        self._conn.commit()
+
+    def __len__(self) -> int:
+        return len(self._memory)
+
+    def _expired(self, session: Dict[str, Any], now: float) -> bool:
+        return self.ttl > 0 and now - session["updated_at"] > self.ttl
+
+    def _remember(self, session: Dict[str, Any]) -> None:
+        """נקרא תחת _lock. שיחה שנדחקה מהזיכרון עדיין נכתבת לדיסק אם היא ב-_dirty"""
+        self._memory[session["session_id"]] = session
+        self._memory.move_to_end(session["session_id"])
+        while len(self._memory) > self.max_sessions:
+            self._memory.popitem(last=False)
+            self.evicted += 1
+
+    def create(self) -> Dict[str, Any]:
+        session = new_session()
+        with self._lock:
+            self._remember(session)
+            self.created += 1
+        return session
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            session = self._memory.get(session_id) or self._dirty.get(session_id)
+            if session is not None:
+                if self._expired(session, now):
+                    self._drop(session_id)
+                    self.expired += 1
+                    return None
+                self._remember(session)
+                self.memory_hits += 1
+                return session
+            if session_id in self._deleted:
+                self.misses += 1
+                return None
+
+        session = self._load(session_id)
+        with self._lock:
+            if session is None or self._expired(session, now):
+                self.misses += 1
+                return None
+            self._remember(session)
+            self.disk_hits += 1
+        return session
+
+    def save(self, session: Dict[str, Any]) -> None:
+        """מעדכן בזיכרון ומסמן לכתיבה; הכתיבה לדיסק קורית ב-flush הבא"""
+        session["updated_at"] = time.time()
+        with self._lock:
+            self._remember(session)
+            self._deleted.discard(session["session_id"])
+            if self.db_path:
+                self._dirty[session["session_id"]] = session
+
+    def delete(self, session_id: str) -> None:
+        with self._lock:
+            self._drop(session_id)
+
+    def _drop(self, session_id: str) -> None:
+        """נקרא תחת _lock"""
+        self._memory.pop(session_id, None)
+        self._dirty.pop(session_id, None)
+        if self.db_path:
+            self._deleted.add(session_id)
+
+    def _load(self, session_id: str) -> Optional[Dict[str, Any]]:
+        if not self.db_path:
+            return None
+        try:
+            with self._db_lock:
+                row = self._conn.execute("SELECT data FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"Session read failed: {e}")
+            return None
+        return json.loads(row[0]) if row else None
+
+    def flush(self) -> int:
+        """כותב לדיסק את כל השיחות שהשתנו מאז ה-flush הקודם, בטרנזקציה אחת, ומוחק שיחות שפג תוקפן"""
+        if not self.db_path:
+            return 0
+        # _dirty ו-_deleted מתרוקנים רק אחרי ה-commit: עד אז get() לא קורא מהדיסק שורה ישנה
+        # של שיחה שנמחקה או שהשתנתה (ואז טוען אותה מחדש)
+        with self._lock:
+            dirty = dict(self._dirty)
+            deleted = set(self._deleted)
+            rows = [(sid, json.dumps(s, ensure_ascii=False), s["updated_at"]) for sid, s in dirty.items()]
+
+        try:
+            with self._db_lock:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)", rows
+                )
+                self._conn.executemany("DELETE FROM sessions WHERE session_id = ?", [(sid,) for sid in deleted])
+                if self.ttl > 0:
+                    self._conn.execute("DELETE FROM sessions WHERE updated_at < ?", (time.time() - self.ttl,))
+                self._conn.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"Session flush failed, will retry: {e}")
+            return 0
+
+        with self._lock:
+            # שיחה שנשמרה שוב בזמן הכתיבה נשארת מלוכלכת ל-flush הבא
+            for sid, _, updated_at in rows:
+                session = self._dirty.get(sid)
+                if session is dirty[sid] and session["updated_at"] == updated_at:
+                    del self._dirty[sid]
+            self._deleted -= deleted
+        return len(rows)
+
+    def purge_expired(self) -> int:
+        now = time.time()
+        with self._lock:
+            expired = [sid for sid, s in self._memory.items() if self._expired(s, now)]
+            for sid in expired:
+                self._memory.pop(sid, None)
+                self._dirty.pop(sid, None)
+            self.expired += len(expired)
+        return len(expired)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.flush_interval):
+            self.purge_expired()
+            self.flush()
+
+    def start(self) -> "SessionStore":
+        if self._flusher is None:
+            self._flusher = threading.Thread(target=self._run, daemon=True, name="session-flusher")
+            self._flusher.start()
+        return self
+
+    def close(self) -> None:
+        """עוצר את thread הכתיבה ומבצע flush אחרון, כדי ששיחות פתוחות ישרדו הפעלה מחדש"""
+        self._stop.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
+        if self._conn is not None:
+            with self._db_lock:
+                self._conn.close()
+            self._conn = None
+            self.db_path = None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "sessions_in_memory": len(self._memory),
+                "pending_writes": len(self._dirty),
+                "created": self.created,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evicted": self.evicted,
+                "expired": self.expired,
+                "persistent": bool(self.db_path),
+            }
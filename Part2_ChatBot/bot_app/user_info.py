@@ -1,4 +1,9 @@
-from pydantic import BaseModel
+from typing import Dict, Any
+from pydantic import BaseModel, field_validator
+from bot_app.vector_index import normalize_hmo, normalize_tier
+
+HMOS = {"מכבי", "מאוחדת", "כללית"}
+TIERS = {"זהב", "כסף", "ארד"}
 
 class UserInfo(BaseModel):
     first_name: str
@@ -9,3 +14,65 @@ class UserInfo(BaseModel):
     hmo: str         # "מכבי", "מאוחדת", "כללית"
     hmo_card: str
     tier: str        # "זהב", "כסף", "ארד"
+
+    @field_validator("first_name", "last_name", "gender")
+    @classmethod
+    def not_blank(cls, value: str) -> str:
+        value = value.strip()
+        if not value:
+            raise ValueError("must not be empty")
+        return value
+
+    @field_validator("last_name")
+    @classmethod
+    def last_name_length(cls, value: str) -> str:
+        if len(value) < 2:
+            raise ValueError("must be at least 2 characters")
+        return value
+
+    @field_validator("id_number", "hmo_card")
+    @classmethod
+    def nine_digits(cls, value: str) -> str:
+        value = value.strip()
+        if not (value.isdigit() and len(value) == 9):
+            raise ValueError("must be exactly 9 digits")
+        return value
+
+    @field_validator("age")
+    @classmethod
+    def age_range(cls, value: int) -> int:
+        if not 0 <= value <= 120:
+            raise ValueError("must be between 0 and 120")
+        return value
+
+    @field_validator("hmo")
+    @classmethod
+    def known_hmo(cls, value: str) -> str:
+        """גם Maccabi / Meuhedet / Clalit - נשמר בעברית"""
+        hmo = normalize_hmo(value)
+        if hmo not in HMOS:
+            raise ValueError(f"unknown HMO: {value}")
+        return hmo
+
+    @field_validator("tier")
+    @classmethod
+    def known_tier(cls, value: str) -> str:
+        """גם Gold / Silver / Bronze - נשמר בעברית"""
+        tier = normalize_tier(value)
+        if tier not in TIERS:
+            raise ValueError(f"unknown insurance tier: {value}")
+        return tier
+
+    @classmethod
+    def from_extracted(cls, data: Dict[str, Any]) -> "UserInfo":
+        """מתוצאת החילוץ מהשיחה (שבה רמת הביטוח נקראת insurance_tier)"""
+        data = {k: v for k, v in data.items() if v not in ("", None)}
+        if "tier" not in data and "insurance_tier" in data:
+            data["tier"] = data.pop("insurance_tier")
+        return cls(**data)
+
+    def to_extracted(self) -> Dict[str, str]:
+        """בחזרה למבנה שהלוגיקה של הבוט עובדת איתו"""
+        data = {k: str(v) for k, v in self.model_dump().items()}
+        data["insurance_tier"] = data.pop("tier")
+        return data
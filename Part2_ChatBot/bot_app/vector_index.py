@@ -0,0 +1,289 @@
+import json
+import logging
+from typing import List, Dict, Any, Tuple, Optional
+import numpy as np
+from bot_app.lexical import BM25Index, ServiceMatcher, reciprocal_rank_fusion
+
+logger = logging.getLogger(__name__)
+
+HMO_ALIASES = {
+    "מכבי": "מכבי", "maccabi": "מכבי",
+    "מאוחדת": "מאוחדת", "meuhedet": "מאוחדת",
+    "כללית": "כללית", "clalit": "כללית",
+}
+TIER_ALIASES = {
+    "זהב": "זהב", "gold": "זהב",
+    "כסף": "כסף", "silver": "כסף",
+    "ארד": "ארד", "bronze": "ארד",
+}
+
+
+def normalize_hmo(hmo: Optional[str]) -> str:
+    value = (hmo or "").strip().lower()
+    return HMO_ALIASES.get(value, value)
+
+
+def normalize_tier(tier: Optional[str]) -> str:
+    value = (tier or "").strip().lower()
+    return TIER_ALIASES.get(value, value)
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class VectorIndex:
+    """אינדקס וקטורים בזיכרון: מטריצה מנורמלת + טקסטים ומטא-דאטה מקבילים"""
+
+    def __init__(self, texts: List[str], metadata: List[Dict[str, Any]], embeddings, normalized: bool = False):
+        if normalized:
+            # מטריצה מנורמלת מראש (למשל memmap מהמאגר הבינארי) נשמרת כמו שהיא, ללא העתקה
+            matrix = embeddings
+        else:
+            matrix = normalize_rows(np.asarray(embeddings, dtype=np.float32))
+        if matrix.ndim != 2 or matrix.shape[0] != len(texts):
+            raise ValueError(f"embeddings shape {matrix.shape} does not match {len(texts)} texts")
+
+        self.texts = texts
+        self.metadata = metadata
+        self.matrix = matrix
+        self.ann = None
+        self.nprobe = 8
+        self.lexical = None
+        self.quantizer = None
+        self.rerank_factor = 10
+        self.embedding_info = None
+        self.benefits = None
+        self._build_partitions()
+        self._build_service_aliases()
+
+    def _build_partitions(self) -> None:
+        """
+        מחשב מראש את השורות לכל צירוף (קופה, רמת ביטוח).
+        קטעים ללא קופה / ללא רמת ביטוח (פסקאות, רשימות, פרטי קשר) נכללים בכל מחיצה מתאימה.
+        """
+        self._hmo_column = np.array([normalize_hmo(m.get("hmo_name")) for m in self.metadata], dtype=object)
+        self._tier_column = np.array([normalize_tier(m.get("insurance_level")) for m in self.metadata], dtype=object)
+        self.hmos = sorted(set(self._hmo_column) - {""})
+        self.tiers = sorted(set(self._tier_column) - {""})
+
+        self._partitions = {}
+        self._partition_masks = {}
+        for hmo in self.hmos:
+            for tier in self.tiers:
+                self.partition(hmo, tier)
+
+    def _build_service_aliases(self) -> None:
+        """השורות של כל שירות, ומתאים של שמות השירותים וכינוייהם לשאילתות"""
+        self._service_rows = {}
+        for row, m in enumerate(self.metadata):
+            if m.get("service_name"):
+                self._service_rows.setdefault(m["service_name"], []).append(row)
+        self._service_matcher = ServiceMatcher(self._service_rows)
+
+    def _partition_key(self, hmo: Optional[str], tier: Optional[str]) -> Optional[Tuple[str, str]]:
+        hmo = normalize_hmo(hmo)
+        tier = normalize_tier(tier)
+        if hmo not in self.hmos:
+            hmo = ""
+        if tier not in self.tiers:
+            tier = ""
+        if not hmo and not tier:
+            return None
+        return hmo, tier
+
+    def partition(self, hmo: Optional[str] = None, tier: Optional[str] = None) -> Optional[np.ndarray]:
+        """מחזיר את מספרי השורות המתאימים לסינון, או None כשאין סינון בפועל"""
+        key = self._partition_key(hmo, tier)
+        if key is None:
+            return None
+
+        hmo, tier = key
+        rows = self._partitions.get(key)
+        if rows is None:
+            mask = np.ones(len(self.texts), dtype=bool)
+            if hmo:
+                mask &= (self._hmo_column == hmo) | (self._hmo_column == "")
+            if tier:
+                mask &= (self._tier_column == tier) | (self._tier_column == "")
+            rows = np.flatnonzero(mask)
+            self._partitions[key] = rows
+        return rows
+
+    def _partition_mask(self, hmo: Optional[str], tier: Optional[str]) -> Optional[np.ndarray]:
+        key = self._partition_key(hmo, tier)
+        if key is None:
+            return None
+
+        mask = self._partition_masks.get(key)
+        if mask is None:
+            mask = np.zeros(len(self.texts), dtype=bool)
+            mask[self.partition(hmo, tier)] = True
+            self._partition_masks[key] = mask
+        return mask
+
+    @classmethod
+    def from_json(cls, path: str) -> "VectorIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+
+        texts = [item["text"] for item in data]
+        metadata = [item.get("metadata", {}) for item in data]
+        embeddings = [item["embedding"] for item in data]
+        logger.info(f"Loaded {len(texts)} vectors from {path}")
+        return cls(texts, metadata, embeddings)
+
+    @classmethod
+    def from_store(cls, store_dir: str) -> "VectorIndex":
+        from bot_app.vector_store import load_vector_store
+        from bot_app.ann import IVFIndex
+        from bot_app.quantization import load_quantizer
+        from bot_app.benefits import BenefitsTable
+
+        texts, metadata, matrix, header = load_vector_store(store_dir)
+        logger.info(f"Mapped {len(texts)} vectors ({header['dtype']}) from {store_dir}")
+        index = cls(texts, metadata, matrix, normalized=header.get("normalized", False))
+        index.embedding_info = header.get("embedding")
+        if header.get("ann", {}).get("type") == "ivf_flat":
+            index.ann = IVFIndex.load(store_dir)
+        if header.get("lexical", {}).get("type") == "bm25":
+            index.lexical = BM25Index.load(store_dir, len(texts), header["lexical"])
+        if header.get("quantization"):
+            index.quantizer = load_quantizer(store_dir, header["quantization"])
+        if header.get("benefits", {}).get("type") == "benefits":
+            index.benefits = BenefitsTable.load(store_dir, header["benefits"])
+        return index
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @property
+    def dim(self) -> int:
+        return self.matrix.shape[1]
+
+    def _ann_candidates(self, query: np.ndarray, top_k: int, nprobe: Optional[int],
+                        hmo: Optional[str], tier: Optional[str]) -> Optional[np.ndarray]:
+        """שורות מועמדות מ-nprobe רשימות ה-IVF, מסוננות למחיצה; None אם אין מספיק מועמדים"""
+        candidates = self.ann.candidates(query, nprobe or self.nprobe)
+        mask = self._partition_mask(hmo, tier)
+        if mask is not None:
+            candidates = candidates[mask[candidates]]
+        if len(candidates) < top_k:
+            return None
+        return np.sort(candidates)
+
+    def search(self, query_embedding, top_k: int = 3,
+               hmo: Optional[str] = None, tier: Optional[str] = None,
+               nprobe: Optional[int] = None) -> List[Tuple[float, int]]:
+        """
+        מחזיר (ציון, מספר שורה) של top_k הקטעים הדומים ביותר, מהגבוה לנמוך.
+        כשמחובר אינדקס ANN נסרקות רק nprobe רשימות; אחרת החיפוש מדויק.
+        כשמחובר quantizer הציון הראשוני מחושב על הקודים הדחוסים ורק רשימה קצרה מדורגת מול הוקטורים המלאים.
+        """
+        query = normalize_rows(np.asarray(query_embedding, dtype=np.float32))
+
+        rows = None
+        if self.ann is not None:
+            rows = self._ann_candidates(query, top_k, nprobe, hmo, tier)
+        if rows is None:
+            rows = self.partition(hmo, tier)
+
+        k = min(top_k, len(self) if rows is None else len(rows))
+        if k <= 0:
+            return []
+
+        if self.quantizer is not None:
+            return self._quantized_search(query, k, rows)
+
+        if rows is None:
+            scores = self.matrix @ query
+        else:
+            scores = self.matrix[rows] @ query
+
+        return self._top_k(scores, k, rows)
+
+    def _quantized_search(self, query: np.ndarray, k: int, rows: Optional[np.ndarray]) -> List[Tuple[float, int]]:
+        approx = self.quantizer.scores(query, rows)
+        shortlist = min(k * self.rerank_factor, len(approx))
+        positions = np.argpartition(-approx, shortlist - 1)[:shortlist]
+        candidates = np.sort(positions if rows is None else rows[positions])
+
+        scores = np.asarray(self.matrix[candidates], dtype=np.float32) @ query
+        return self._top_k(scores, k, candidates)
+
+    def search_batch(self, query_embeddings, top_k: int = 3,
+                     hmo: Optional[str] = None, tier: Optional[str] = None,
+                     nprobe: Optional[int] = None) -> List[List[Tuple[float, int]]]:
+        """חיפוש של כמה שאילתות יחד במכפלת מטריצות אחת; מחזיר רשימת תוצאות לכל שאילתה"""
+        queries = normalize_rows(np.asarray(query_embeddings, dtype=np.float32))
+        if len(queries) == 0:
+            return []
+        if self.ann is not None or self.quantizer is not None:
+            return [self.search(query, top_k, hmo=hmo, tier=tier, nprobe=nprobe) for query in queries]
+
+        rows = self.partition(hmo, tier)
+        k = min(top_k, len(self) if rows is None else len(rows))
+        if k <= 0:
+            return [[] for _ in queries]
+
+        if rows is None:
+            scores = self.matrix @ queries.T
+        else:
+            scores = self.matrix[rows] @ queries.T
+
+        return [self._top_k(scores[:, i], k, rows) for i in range(len(queries))]
+
+    def lexical_search(self, query_text: str, top_k: int = 3,
+                       hmo: Optional[str] = None, tier: Optional[str] = None) -> List[Tuple[float, int]]:
+        if self.lexical is None:
+            self.lexical = BM25Index.build(self.texts)
+        return self.lexical.search(query_text, top_k, mask=self._partition_mask(hmo, tier))
+
+    def fuse(self, vector_results: List[Tuple[float, int]], query_text: str, top_k: int = 3,
+             hmo: Optional[str] = None, tier: Optional[str] = None,
+             lexical_weight: float = 1.0) -> List[Tuple[float, int]]:
+        """מיזוג תוצאות וקטוריות עם תוצאות BM25 לאותה שאילתה (RRF)"""
+        lexical_results = self.lexical_search(query_text, max(len(vector_results), top_k), hmo, tier)
+        return reciprocal_rank_fusion([vector_results, lexical_results], [1.0, lexical_weight])[:top_k]
+
+    def match_service(self, query_text: str) -> Optional[str]:
+        """
+        מחזיר שם שירות יחיד שכל מילותיו (או כל מילות הכינוי שלו) מופיעות בשאילתה.
+        אם הותאמו כמה שירותים שאינם מוכלים זה בזה - ההתאמה דו-משמעית ומוחזר None.
+        """
+        return self._service_matcher.match(query_text)[0]
+
+    def lexical_fast_path(self, query_text: str, top_k: int = 3,
+                          hmo: Optional[str] = None, tier: Optional[str] = None) -> Optional[List[Tuple[float, int]]]:
+        """
+        מסלול מהיר ללא embedding: כשהשאילתה מזכירה שירות אחד באופן חד-משמעי,
+        מוחזרות שורות השירות במחיצה ואחריהן שאר תוצאות BM25. None אם אין התאמה חד-משמעית.
+        """
+        service = self.match_service(query_text)
+        if service is None:
+            return None
+
+        mask = self._partition_mask(hmo, tier)
+        service_rows = [row for row in self._service_rows[service] if mask is None or mask[row]]
+        if not service_rows:
+            return None
+
+        lexical_results = self.lexical_search(query_text, max(top_k, len(service_rows)) + top_k, hmo, tier)
+        scores = dict((row, score) for score, row in lexical_results)
+        ranked = sorted(((scores.get(row, 0.0), row) for row in service_rows), key=lambda x: x[0], reverse=True)
+        ranked.extend((score, row) for score, row in lexical_results if row not in set(service_rows))
+        return ranked[:top_k]
+
+    @staticmethod
+    def _top_k(scores: np.ndarray, k: int, rows: Optional[np.ndarray]) -> List[Tuple[float, int]]:
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        if rows is not None:
+            return [(float(scores[i]), int(rows[i])) for i in top]
+        return [(float(scores[i]), int(i)) for i in top]
@@ -0,0 +1,255 @@
+"""
+פורמט שמירה בינארי למאגר הוקטורים.
+
+תיקיית מאגר מכילה:
+    embeddings.npy  - מטריצת embeddings מנורמלת (float32 או float16), נפתחת עם np.memmap
+    chunks.json     - טקסטים ומטא-דאטה בפורמט עמודות
+    meta.json       - כותרת הפורמט (גרסה, dtype, מימד, מספר שורות); נכתבת אחרונה
+ולצדם קבצי BM25 ואופציונלית IVF וקודים דחוסים.
+
+פרסום גרסאות: כל ריצה נכתבת לתיקייה חדשה תחת versions/, ורק אחרי שהיא שלמה
+manifest.json מוחלף אטומית (os.replace) כך שקוראים תמיד רואים גרסה שלמה.
+"""
+import os
+import json
+import time
+import uuid
+from datetime import datetime
+import shutil
+import logging
+import argparse
+from typing import List, Dict, Any, Tuple, Optional
+import numpy as np
+from bot_app.vector_index import normalize_rows
+from bot_app.ann import IVFIndex, default_nlist
+from bot_app.lexical import BM25Index
+from bot_app.quantization import build_quantizer
+
+logger = logging.getLogger(__name__)
+
+FORMAT_NAME = "medbot-vectors"
+FORMAT_VERSION = 1
+SUPPORTED_DTYPES = ("float32", "float16")
+
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.json"
+META_FILE = "meta.json"
+MANIFEST_FILE = "manifest.json"
+VERSIONS_DIR = "versions"
+KEEP_VERSIONS = 3
+SAVE_BLOCK = 65536
+
+
+def is_vector_store(store_dir: str) -> bool:
+    return os.path.isfile(os.path.join(store_dir, META_FILE))
+
+
+def _to_columns(metadata: List[Dict[str, Any]]) -> Dict[str, List[Any]]:
+    fields = []
+    for item in metadata:
+        for key in item:
+            if key not in fields:
+                fields.append(key)
+    return {field: [item.get(field, "") for item in metadata] for field in fields}
+
+
+def _from_columns(columns: Dict[str, List[Any]], count: int) -> List[Dict[str, Any]]:
+    return [{field: values[i] for field, values in columns.items()} for i in range(count)]
+
+
+def save_vector_store(store_dir: str, texts: List[str], metadata: List[Dict[str, Any]],
+                      embeddings, dtype: str = "float32", ivf_nlist: int = 0,
+                      quantization: Optional[str] = None, pq_m: int = 96,
+                      embedding_info: Optional[Dict[str, Any]] = None, benefits=None) -> Dict[str, Any]:
+    """
+    שומר מאגר וקטורים בפורמט הבינארי ומחזיר את כותרת הפורמט.
+    ivf_nlist > 0 בונה גם אינדקס IVF-flat עם מספר הרשימות הנתון.
+    quantization ("int8" / "pq") שומר גם קודים דחוסים לחיפוש עם דירוג מחדש.
+    embedding_info - חתימת ספק ה-embeddings שבנה את המאגר (provider / model / dim).
+    benefits - טבלת הטבות מובנית (BenefitsTable) לחיפוש ישיר, אם נבנתה.
+    embeddings יכול להיות memmap גדול מהזיכרון - הנרמול והכתיבה נעשים בבלוקים.
+    """
+    if dtype not in SUPPORTED_DTYPES:
+        raise ValueError(f"unsupported dtype {dtype}, expected one of {SUPPORTED_DTYPES}")
+
+    if not isinstance(embeddings, np.ndarray):
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+    if embeddings.ndim != 2 or embeddings.shape[0] != len(texts):
+        raise ValueError(f"embeddings shape {embeddings.shape} does not match {len(texts)} texts")
+
+    os.makedirs(store_dir, exist_ok=True)
+    meta_path = os.path.join(store_dir, META_FILE)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    matrix = np.lib.format.open_memmap(os.path.join(store_dir, EMBEDDINGS_FILE), mode="w+",
+                                       dtype=dtype, shape=embeddings.shape)
+    for start in range(0, embeddings.shape[0], SAVE_BLOCK):
+        block = np.asarray(embeddings[start:start + SAVE_BLOCK], dtype=np.float32)
+        matrix[start:start + SAVE_BLOCK] = normalize_rows(block)
+    matrix.flush()
+
+    with open(os.path.join(store_dir, CHUNKS_FILE), "w", encoding="utf-8") as f:
+        json.dump({"text": list(texts), "metadata": _to_columns(metadata)}, f, ensure_ascii=False)
+
+    lexical = BM25Index.build(list(texts)).save(store_dir)
+
+    ann = None
+    if ivf_nlist > 0:
+        ivf = IVFIndex.build(matrix, nlist=ivf_nlist)
+        ivf.save(store_dir)
+        ann = {"type": "ivf_flat", "nlist": ivf.nlist}
+
+    quantized = None
+    if quantization:
+        quantized = build_quantizer(quantization, matrix, pq_m=pq_m).save(store_dir)
+
+    header = {
+        "format": FORMAT_NAME,
+        "version": FORMAT_VERSION,
+        "dtype": dtype,
+        "dim": int(matrix.shape[1]),
+        "count": int(matrix.shape[0]),
+        "normalized": True,
+        "lexical": lexical,
+    }
+    if ann:
+        header["ann"] = ann
+    if quantized:
+        header["quantization"] = quantized
+    if embedding_info:
+        header["embedding"] = embedding_info
+    if benefits is not None:
+        header["benefits"] = benefits.save(store_dir)
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(header, f, indent=2)
+
+    return header
+
+
+def load_vector_store(store_dir: str) -> Tuple[List[str], List[Dict[str, Any]], np.ndarray, Dict[str, Any]]:
+    """טוען מאגר וקטורים; המטריצה מוחזרת כ-memmap לקריאה בלבד"""
+    with open(os.path.join(store_dir, META_FILE), "r", encoding="utf-8") as f:
+        header = json.load(f)
+
+    if header.get("format") != FORMAT_NAME:
+        raise ValueError(f"{store_dir} is not a {FORMAT_NAME} store")
+    if header.get("version", 0) > FORMAT_VERSION:
+        raise ValueError(f"store version {header['version']} is newer than supported version {FORMAT_VERSION}")
+
+    matrix = np.load(os.path.join(store_dir, EMBEDDINGS_FILE), mmap_mode="r")
+    if matrix.shape != (header["count"], header["dim"]):
+        raise ValueError(f"embeddings shape {matrix.shape} does not match header in {store_dir}")
+
+    with open(os.path.join(store_dir, CHUNKS_FILE), "r", encoding="utf-8") as f:
+        chunks = json.load(f)
+
+    texts = chunks["text"]
+    metadata = _from_columns(chunks.get("metadata", {}), len(texts))
+    return texts, metadata, matrix, header
+
+
+def read_manifest(root_dir: str) -> Optional[Dict[str, Any]]:
+    try:
+        with open(os.path.join(root_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def publish_vector_store(root_dir: str, texts: List[str], metadata: List[Dict[str, Any]],
+                         embeddings, **store_options) -> Dict[str, Any]:
+    """
+    כותב גרסה חדשה של המאגר לתיקייה נפרדת ומפרסם אותה ב-manifest.json באופן אטומי.
+    מחזיר את ה-manifest שפורסם.
+    """
+    # מזהה גרסה שממוין לפי זמן יצירה
+    version = datetime.now().strftime("%Y%m%d-%H%M%S-%f") + "-" + uuid.uuid4().hex[:6]
+    relative_path = os.path.join(VERSIONS_DIR, version)
+    header = save_vector_store(os.path.join(root_dir, relative_path), texts, metadata, embeddings, **store_options)
+
+    manifest = {
+        "version": version,
+        "path": relative_path,
+        "count": header["count"],
+        "dim": header["dim"],
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    temp_path = os.path.join(root_dir, f".{MANIFEST_FILE}.{version}.tmp")
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, os.path.join(root_dir, MANIFEST_FILE))
+    logger.info(f"Published vector store version {version} ({header['count']} vectors)")
+
+    prune_versions(root_dir, keep=KEEP_VERSIONS)
+    return manifest
+
+
+def prune_versions(root_dir: str, keep: int = KEEP_VERSIONS) -> None:
+    """מוחק גרסאות ישנות; הגרסה הפעילה לעולם לא נמחקת"""
+    versions_dir = os.path.join(root_dir, VERSIONS_DIR)
+    manifest = read_manifest(root_dir) or {}
+    versions = sorted(os.listdir(versions_dir)) if os.path.isdir(versions_dir) else []
+
+    for version in versions[:-keep] if keep > 0 else versions:
+        if version == manifest.get("version"):
+            continue
+        try:
+            shutil.rmtree(os.path.join(versions_dir, version))
+        except OSError as e:
+            # למשל ב-Windows, כשתהליך אחר עדיין ממפה את הקבצים
+            logger.warning(f"Could not remove old vector store version {version}: {e}")
+
+
+def _legacy_embedding_info(embeddings: List[List[float]]) -> Dict[str, Any]:
+    # vectors.json נוצר רק עם Azure ada-002
+    return {"provider": "azure", "model": "text-embedding-ada-002", "dim": len(embeddings[0]) if embeddings else 0}
+
+
+def _read_json_vectors(json_path: str) -> Tuple[List[str], List[Dict[str, Any]], List[List[float]]]:
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return ([item["text"] for item in data],
+            [item.get("metadata", {}) for item in data],
+            [item["embedding"] for item in data])
+
+
+def convert_json_to_store(json_path: str, store_dir: str, dtype: str = "float32",
+                          ivf_nlist: int = 0, quantization: Optional[str] = None) -> Dict[str, Any]:
+    """המרה חד-פעמית של vectors.json הישן לפורמט הבינארי"""
+    texts, metadata, embeddings = _read_json_vectors(json_path)
+    header = save_vector_store(store_dir, texts, metadata, embeddings, dtype=dtype, ivf_nlist=ivf_nlist,
+                               quantization=quantization, embedding_info=_legacy_embedding_info(embeddings))
+    logger.info(f"Converted {header['count']} vectors from {json_path} to {store_dir} ({dtype})")
+    return header
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert saved_vectors/vectors.json to the binary vector store format")
+    parser.add_argument("--json", default="saved_vectors/vectors.json", help="path of the legacy JSON vectors file")
+    parser.add_argument("--root", default="saved_vectors", help="publish a new store version under this directory")
+    parser.add_argument("--out", help="write a plain store directory instead of publishing a version")
+    parser.add_argument("--dtype", default="float32", choices=SUPPORTED_DTYPES)
+    parser.add_argument("--ivf-nlist", type=int, default=0,
+                        help="build an IVF-flat ANN index with this many lists (-1 = 4*sqrt(N), 0 = none)")
+    parser.add_argument("--quantization", default="none", choices=["none", "int8", "pq"],
+                        help="also store compressed codes for in-memory scoring")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    quantization = None if args.quantization == "none" else args.quantization
+    texts, metadata, embeddings = _read_json_vectors(args.json)
+    ivf_nlist = default_nlist(len(texts)) if args.ivf_nlist < 0 else args.ivf_nlist
+
+    if args.out:
+        convert_json_to_store(args.json, args.out, args.dtype, ivf_nlist, quantization)
+    else:
+        publish_vector_store(args.root, texts, metadata, embeddings, dtype=args.dtype,
+                             ivf_nlist=ivf_nlist, quantization=quantization,
+                             embedding_info=_legacy_embedding_info(embeddings))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+מצב צפייה: שומר את מאגר הוקטורים מעודכן כשקבצי HTML ב-phase2_data משתנים.
+
+אירועי מערכת הקבצים (watchdog אם מותקן, אחרת סריקת mtime/גודל כל POLL_INTERVAL שניות)
+נאספים לקבוצת קבצים שנגעו בהם. הבנייה מתחילה רק אחרי DEBOUNCE שניות ללא אירועים חדשים
+(ולכל היותר MAX_DELAY שניות מהאירוע הראשון), כך שרצף כתיבות של קבצים רבים הופך לבנייה אחת.
+בבנייה מחולצים מחדש רק הקבצים שנגעו בהם, ורק קטעים שהשתנו עוברים embedding.
+
+    python generate_data.py --watch
+"""
+import os
+import time
+import logging
+import threading
+from typing import Dict, Tuple, Set, Optional
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = float(os.getenv("WATCH_POLL_INTERVAL", "2"))
+DEBOUNCE = float(os.getenv("WATCH_DEBOUNCE", "3"))
+MAX_DELAY = float(os.getenv("WATCH_MAX_DELAY", "60"))
+WRITE_EVENTS = {"created", "modified", "moved", "deleted", "closed"}
+
+
+class DirectoryWatcher:
+    """אוסף שמות קבצים ששונו בתיקייה, עם debounce"""
+
+    def __init__(self, directory: str, suffix: str = ".html", poll_interval: float = POLL_INTERVAL,
+                 debounce: float = DEBOUNCE, max_delay: float = MAX_DELAY):
+        self.directory = directory
+        self.suffix = suffix
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.max_delay = max_delay
+        self._touched = set()
+        self._first_event = None
+        self._last_event = None
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._stop = threading.Event()
+        self._observer = None
+        self._poller = None
+
+    def touch(self, path: str) -> None:
+        filename = os.path.basename(path)
+        if not filename.endswith(self.suffix):
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._touched.add(filename)
+            self._first_event = self._first_event or now
+            self._last_event = now
+        self._event.set()
+
+    def snapshot(self) -> Dict[str, Tuple[float, int]]:
+        files = {}
+        try:
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    if entry.name.endswith(self.suffix) and entry.is_file():
+                        stat = entry.stat()
+                        files[entry.name] = (stat.st_mtime, stat.st_size)
+        except FileNotFoundError:
+            pass
+        return files
+
+    def _poll(self) -> None:
+        previous = self.snapshot()
+        while not self._stop.wait(self.poll_interval):
+            current = self.snapshot()
+            for filename in set(previous) | set(current):
+                if previous.get(filename) != current.get(filename):
+                    self.touch(filename)
+            previous = current
+
+    def start(self) -> "DirectoryWatcher":
+        try:
+            from watchdog.observers import Observer
+            from watchdog.events import FileSystemEventHandler
+        except ImportError:
+            Observer = None
+
+        if Observer is not None:
+            watcher = self
+
+            class Handler(FileSystemEventHandler):
+                def on_any_event(self, event):
+                    # אירועי פתיחה / קריאה (גם של הבנייה עצמה) אינם שינוי
+                    if event.is_directory or event.event_type not in WRITE_EVENTS:
+                        return
+                    watcher.touch(event.src_path)
+                    if getattr(event, "dest_path", None):
+                        watcher.touch(event.dest_path)
+
+            self._observer = Observer()
+            self._observer.schedule(Handler(), self.directory, recursive=False)
+            self._observer.start()
+            logger.info(f"Watching {self.directory} (filesystem events)")
+        else:
+            self._poller = threading.Thread(target=self._poll, daemon=True, name="html-watcher")
+            self._poller.start()
+            logger.info(f"Watching {self.directory} (polling every {self.poll_interval}s)")
+        return self
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._event.set()
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer.join()
+
+    def wait_for_changes(self) -> Optional[Set[str]]:
+        """
+        חוסם עד שיש שינויים שנרגעו (DEBOUNCE שניות בלי אירוע, או MAX_DELAY מהאירוע הראשון)
+        ומחזיר את שמות הקבצים. מחזיר None אחרי stop().
+        """
+        while not self._stop.is_set():
+            self._event.wait()
+            with self._lock:
+                if self._stop.is_set():
+                    return None
+                if not self._touched:
+                    self._event.clear()
+                    continue
+                now = time.monotonic()
+                remaining = min(self._last_event + self.debounce, self._first_event + self.max_delay) - now
+                if remaining <= 0:
+                    touched, self._touched = self._touched, set()
+                    self._first_event = self._last_event = None
+                    self._event.clear()
+                    return touched
+            self._stop.wait(remaining)
+        return None
+
+
+def watch(config=None) -> None:
+    """
+    בנייה ראשונית ואז בנייה מחדש של הקבצים שנגעו בהם בכל פעם שהתיקייה משתנה.
+    קבצים של בנייה שנכשלה מצטרפים לבנייה הבאה, עד שגרסה מתפרסמת - אחרת הבנייה הבאה
+    הייתה לוקחת עבורם את הקטעים מהגרסה הקודמת, והשינוי היה הולך לאיבוד.
+    """
+    from bot_app.html_reader import ImprovedVectorGenerator, Config
+
+    config = config or Config()
+    generator = ImprovedVectorGenerator(config)
+    watcher = DirectoryWatcher(config.HTML_DIR).start()
+    # אם גם הבנייה הראשונית נכשלה, אין גרסה עדכנית לקחת ממנה קבצים - הבנייה הבאה מלאה
+    full_rebuild = not generator.generate_vectors()
+    failed = set()
+
+    try:
+        while True:
+            touched = watcher.wait_for_changes()
+            if touched is None:
+                break
+            touched |= failed
+            logger.info(f"Rebuilding after changes to {len(touched)} file(s): {', '.join(sorted(touched))}")
+            try:
+                published = generator.generate_vectors(touched=None if full_rebuild else touched)
+            except Exception as e:
+                # שגיאה בבנייה לא עוצרת את הצפייה; השינוי הבא יבנה שוב
+                logger.error(f"Rebuild failed: {e}")
+                published = False
+            if published:
+                failed = set()
+                full_rebuild = False
+            else:
+                failed = touched
+                logger.warning(f"Rebuild did not publish; {len(failed)} file(s) will be rebuilt with the next change")
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.stop()
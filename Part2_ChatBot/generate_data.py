@@ -1,4 +1,9 @@
-from bot_app.html_reader import generate_vectors
+import sys
+from bot_app.html_reader import main
 
-generate_vectors()
-print("✅ Embeddings successfully generated and saved to saved_vectors/vectors.json")
+if "--watch" in sys.argv[1:]:
+    from bot_app.watcher import watch
+    watch()
+else:
+    main()
+    print("✅ Embeddings successfully generated and published to saved_vectors/")
@@ -1,7 +1,7 @@
 import streamlit as st
 import requests
 import json
-from typing import List, Dict
+from typing import Dict, Iterator, Optional
 
 # Configuration
 API_URL = "http://localhost:8000"  # Change this to your FastAPI server URL
@@ -228,36 +228,52 @@ def initialize_session_state():
         st.session_state.messages = [
             {"role": "assistant", "content": "היי! 👋 אני הבוט הרפואי שלך. איך אוכל לעזור לך היום? אתה יכול לשאול אותי על נושאי בריאות, שירותי בריאות בישראל, או כל דבר רפואי אחר."}
         ]
-    if "chat_history" not in st.session_state:
-        st.session_state.chat_history = []
+    if "session_id" not in st.session_state:
+        st.session_state.session_id = None
 
-def call_api(question: str, chat_history: List[Dict[str, str]]) -> Dict:
-    """Call the FastAPI backend"""
+def stream_api(message: str, session_id: Optional[str]) -> Iterator[Dict]:
+    """Call the streaming FastAPI endpoint and yield its events (session, token..., done)"""
     try:
-        response = requests.post(
-            f"{API_URL}/ask",
+        # The read timeout applies between chunks, so long answers don't hit it while tokens keep arriving
+        with requests.post(
+            f"{API_URL}/chat/stream",
             json={
-                "question": question,
-                "chat_history": chat_history
+                "message": message,
+                "session_id": session_id
             },
-            timeout=30
-        )
-        
-        if response.status_code == 200:
-            return response.json()
-        else:
-            return {
-                "answer": f"מצטער, נתקלתי בבעיה טכנית (שגיאת שרת: {response.status_code}). אנא נסה שוב.",
-                "chat_history": chat_history,
-                "error": f"HTTP {response.status_code}"
-            }
+            stream=True,
+            timeout=(5, 60)
+        ) as response:
+            if response.status_code != 200:
+                yield {
+                    "type": "done",
+                    "answer": f"מצטער, נתקלתי בבעיה טכנית (שגיאת שרת: {response.status_code}). אנא נסה שוב.",
+                    "session_id": session_id,
+                    "error": f"HTTP {response.status_code}"
+                }
+                return
+
+            response.encoding = "utf-8"
+            for line in response.iter_lines(decode_unicode=True):
+                if line and line.startswith("data: "):
+                    yield json.loads(line[len("data: "):])
     except requests.exceptions.RequestException as e:
-        return {
+        yield {
+            "type": "done",
             "answer": "מצטער, לא ניתן להתחבר לשרת כרגע. אנא בדוק את החיבור לאינטרנט ונסה שוב מאוחר יותר.",
-            "chat_history": chat_history,
+            "session_id": session_id,
             "error": str(e)
         }
 
+def delete_session(session_id: Optional[str]) -> None:
+    """Drop the server-side conversation"""
+    if not session_id:
+        return
+    try:
+        requests.delete(f"{API_URL}/sessions/{session_id}", timeout=5)
+    except requests.exceptions.RequestException:
+        pass
+
 def display_welcome_section():
     """Display welcome section with services"""
     st.markdown("""
@@ -346,23 +362,31 @@ def main():
         # Add user message to chat
         st.session_state.messages.append({"role": "user", "content": prompt})
         
-        # Show typing indicator
+        # Typing indicator until the first token, then the answer as it streams in
         with st.chat_message("assistant"):
-            with st.spinner("🤔 חושב על התשובה..."):
-                if api_connected:
-                    response = call_api(prompt, st.session_state.chat_history)
-                    
-                    if response.get("error"):
-                        answer = "מצטער, נתקלתי בבעיה טכנית. אנא נסה שוב או נסח את השאלה באופן שונה."
-                    else:
-                        answer = response["answer"]
-                        st.session_state.chat_history = response["chat_history"]
-                else:
-                    # Demo response when API is not connected
-                    answer = f"זו תגובה לדוגמה לשאלתך: '{prompt}'. כרגע הבוט עובד במצב הדגמה מכיוון שהAPI לא זמין."
-                
-                # Update session state
-                st.session_state.messages.append({"role": "assistant", "content": answer})
+            placeholder = st.empty()
+            placeholder.markdown("🤔 חושב על התשובה...")
+            if api_connected:
+                answer = ""
+                for event in stream_api(prompt, st.session_state.session_id):
+                    if event["type"] == "session":
+                        st.session_state.session_id = event["session_id"]
+                    elif event["type"] == "token":
+                        answer += event["content"]
+                        placeholder.markdown(answer + "▌")
+                    elif event["type"] == "done":
+                        if event.get("error"):
+                            answer = "מצטער, נתקלתי בבעיה טכנית. אנא נסה שוב או נסח את השאלה באופן שונה."
+                        else:
+                            answer = event["answer"]
+                            st.session_state.session_id = event["session_id"]
+            else:
+                # Demo response when API is not connected
+                answer = f"זו תגובה לדוגמה לשאלתך: '{prompt}'. כרגע הבוט עובד במצב הדגמה מכיוון שהAPI לא זמין."
+            placeholder.markdown(answer)
+            
+            # Update session state
+            st.session_state.messages.append({"role": "assistant", "content": answer})
         
         # Refresh to show new messages
         st.rerun()
@@ -375,7 +399,8 @@ def main():
             st.session_state.messages = [
                 {"role": "assistant", "content": "היי! 👋 אני הבוט הרפואי שלך. איך אוכל לעזור לך היום?"}
             ]
-            st.session_state.chat_history = []
+            delete_session(st.session_state.session_id)
+            st.session_state.session_id = None
             st.rerun()
         
         st.markdown("---")